@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the in-process metric engine (yuv_metrics.py) to tiny_ssim on a pair
+# of I420 files, reporting the time taken by each and the largest difference
+# between their results. Exits with an error if any difference is out of
+# tolerance.
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import binary_vars
+import yuv_metrics
+
+parser = argparse.ArgumentParser(
+    description='Benchmark yuv_metrics.py against tiny_ssim.')
+parser.add_argument('source_file', help='source .yuv file')
+parser.add_argument('decoded_file', help='decoded .yuv file')
+parser.add_argument('size', metavar='WIDTHxHEIGHT')
+parser.add_argument('--temporal-skip', type=int, default=0)
+parser.add_argument('--psnr-tolerance', type=float, default=0.01)
+parser.add_argument('--ssim-tolerance', type=float, default=0.001)
+
+
+def run_tiny_ssim(args, width, height, framestats_file):
+    output = subprocess.check_output([
+        binary_vars.TINY_SSIM_BIN, args.source_file, args.decoded_file,
+        "%dx%d" % (width, height),
+        str(args.temporal_skip), framestats_file
+    ],
+                                     encoding='utf-8')
+    summary = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        (metric, value) = line.split(': ')
+        summary[metric] = float(value)
+    frame_stats = {}
+    with open(framestats_file) as csvfile:
+        for row in csv.DictReader(csvfile):
+            for (metric, value) in row.items():
+                frame_stats.setdefault(metric, []).append(float(value))
+    return (summary, frame_stats)
+
+
+def tolerance(args, metric):
+    return args.ssim_tolerance if 'SSIM' in metric.upper() else \
+        args.psnr_tolerance
+
+
+def main():
+    args = parser.parse_args()
+    (width, height) = [int(x) for x in args.size.split('x')]
+    (fd, framestats_file) = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        start_time = time.time()
+        (tiny_summary, tiny_frame_stats) = run_tiny_ssim(
+            args, width, height, framestats_file)
+        tiny_seconds = time.time() - start_time
+    finally:
+        os.remove(framestats_file)
+
+    start_time = time.time()
+    (summary, frame_stats) = yuv_metrics.compute_metrics(args.source_file,
+                                                         args.decoded_file,
+                                                         width, height,
+                                                         args.temporal_skip)
+    numpy_seconds = time.time() - start_time
+
+    print("tiny_ssim: %.3fs, numpy: %.3fs (%.2fx)" %
+          (tiny_seconds, numpy_seconds, tiny_seconds / max(numpy_seconds, 1e-9)))
+
+    failed = False
+    for metric in sorted(set(tiny_summary) & set(summary)):
+        difference = abs(tiny_summary[metric] - summary[metric])
+        # VpxSSIM is SSIM^8 on a 0-100 scale, which magnifies differences.
+        limit = 100 * 8 * args.ssim_tolerance if metric == 'VpxSSIM' else \
+            tolerance(args, metric)
+        if metric == 'Nframes':
+            limit = 0
+        ok = difference <= limit
+        failed = failed or not ok
+        print("%-12s tiny_ssim: %10.4f numpy: %10.4f diff: %.4f%s" %
+              (metric, tiny_summary[metric], summary[metric], difference,
+               '' if ok else ' OUT OF TOLERANCE'))
+    for metric in sorted(set(tiny_frame_stats) & set(frame_stats)):
+        if len(tiny_frame_stats[metric]) != len(frame_stats[metric]):
+            print("frame-%s: %d frames vs. %d frames" %
+                  (metric, len(tiny_frame_stats[metric]),
+                   len(frame_stats[metric])))
+            failed = True
+            continue
+        difference = max([
+            abs(a - b)
+            for (a, b) in zip(tiny_frame_stats[metric], frame_stats[metric])
+        ] or [0])
+        ok = difference <= tolerance(args, metric)
+        failed = failed or not ok
+        print("frame-%-6s max diff: %.4f%s" %
+              (metric, difference, '' if ok else ' OUT OF TOLERANCE'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Chunked encoding of offline encoders. The frame window of a clip is split
+# into chunks, either at fixed GOP boundaries or at scene cuts, that are
+# encoded in parallel by separate encoder processes. The IVF outputs of the
+# chunks are concatenated into a single bitstream that is decoded and measured
+# like any other. Chunks start with a keyframe, so chunked encodes aren't
+# comparable to monolithic ones and their results are labeled with
+# 'chunk-mode' and 'encode-chunks'.
+
+import os
+import struct
+
+import numpy as np
+
+import yuv_reader
+
+CHUNK_MODES = ['gop', 'scene']
+# Encoders that run one long serial process per job and can be chunked.
+CHUNKED_ENCODERS = ['aom-offline', 'rav1e-offline', 'svt-offline']
+# Parameters that make an encoder write IVF, added to the commands of chunks.
+# aom-offline runs both of its passes in a single process.
+IVF_PARAMS = {'aom-offline': ['--ivf']}
+DEFAULT_CHUNK_FRAMES = 150
+# Scene chunks are at least this fraction of --chunk-frames long, unless the
+# window is shorter, and at most twice --chunk-frames.
+MIN_SCENE_CHUNK = 0.25
+# Scene cuts are detected on luma averaged over blocks of this many pixels
+# per side.
+DOWNSCALE = 8
+# A frame starts a new scene when its mean absolute luma difference to the
+# previous frame is above this, and well above the typical difference.
+SCENE_CUT_THRESHOLD = 20.0
+SCENE_CUT_MEDIAN_RATIO = 3.0
+BATCH_FRAMES = 32
+
+IVF_SIGNATURE = b'DKIF'
+IVF_HEADER_SIZE = 32
+IVF_FRAME_HEADER = struct.Struct('<IQ')
+
+
+class ChunkError(ValueError):
+    pass
+
+
+def downscaled_luma(frames, width, height):
+    # Returns the luma of a (frames, frame size) batch averaged over
+    # DOWNSCALE x DOWNSCALE blocks, cropping partial blocks.
+    rows = height // DOWNSCALE
+    columns = width // DOWNSCALE
+    luma = frames[:, :width * height].reshape(-1, height, width)
+    luma = luma[:, :rows * DOWNSCALE, :columns * DOWNSCALE]
+    return luma.reshape(-1, rows, DOWNSCALE, columns,
+                        DOWNSCALE).mean(axis=(2, 4), dtype=np.float32)
+
+
+def scene_cuts(frames_file, width, height, offsets):
+    # Returns the indexes (into `offsets`) of the frames that start a new
+    # scene.
+    if len(offsets) < 2 or width < DOWNSCALE or height < DOWNSCALE:
+        return []
+    thumbnails = np.concatenate([
+        downscaled_luma(batch, width, height)
+        for batch in yuv_reader.read_frame_batches(
+            frames_file, width, height, offsets, batch_size=BATCH_FRAMES)
+    ])
+    differences = np.abs(np.diff(thumbnails, axis=0)).mean(axis=(1, 2))
+    threshold = max(SCENE_CUT_THRESHOLD,
+                    SCENE_CUT_MEDIAN_RATIO * float(np.median(differences)))
+    return [int(i) + 1 for i in np.flatnonzero(differences > threshold)]
+
+
+def plan_chunks(num_frames, chunk_frames, cuts=None):
+    # Returns (start, count) of the chunks of a window of `num_frames` frames.
+    # Without `cuts` chunks are `chunk_frames` long. Otherwise chunks end at
+    # the first scene cut that leaves them long enough, or are split at
+    # `chunk_frames` when the next cut is too far away.
+    if cuts is None:
+        return [(start, min(chunk_frames, num_frames - start))
+                for start in range(0, num_frames, chunk_frames)]
+    min_frames = max(1, int(chunk_frames * MIN_SCENE_CHUNK))
+    chunks = []
+    start = 0
+    while start < num_frames:
+        end = min(start + chunk_frames * 2, num_frames)
+        candidates = [
+            cut for cut in cuts if start + min_frames <= cut < end and
+            num_frames - cut >= min_frames
+        ]
+        if candidates:
+            end = candidates[0]
+        elif end < num_frames:
+            end = start + chunk_frames
+        chunks.append((start, end - start))
+        start = end
+    return chunks
+
+
+def read_ivf(filename):
+    # Returns the header and the (pts, data) frames of an IVF file.
+    with open(filename, 'rb') as f:
+        header = f.read(IVF_HEADER_SIZE)
+        if len(header) < IVF_HEADER_SIZE or \
+                not header.startswith(IVF_SIGNATURE):
+            raise ChunkError("%s isn't an IVF file." % filename)
+        (header_size,) = struct.unpack('<H', header[6:8])
+        f.read(header_size - IVF_HEADER_SIZE)
+        frames = []
+        while True:
+            frame_header = f.read(IVF_FRAME_HEADER.size)
+            if not frame_header:
+                break
+            if len(frame_header) < IVF_FRAME_HEADER.size:
+                raise ChunkError("%s is truncated." % filename)
+            (size, pts) = IVF_FRAME_HEADER.unpack(frame_header)
+            data = f.read(size)
+            if len(data) < size:
+                raise ChunkError("%s is truncated." % filename)
+            frames.append((pts, data))
+    return (header, frames)
+
+
+def concatenate_ivf(filenames, out_filename):
+    # Writes the frames of the IVF files one after another, with timestamps
+    # continuing from the end of the previous file.
+    header = None
+    frames = []
+    for filename in filenames:
+        (file_header, file_frames) = read_ivf(filename)
+        if header is None:
+            header = file_header
+        elif file_header[8:16] != header[8:16]:
+            raise ChunkError("%s doesn't match the codec or resolution of %s." %
+                             (filename, filenames[0]))
+        pts_offset = frames[-1][0] + 1 if frames else 0
+        if file_frames:
+            pts_offset -= file_frames[0][0]
+        frames += [(pts + pts_offset, data) for (pts, data) in file_frames]
+    with open(out_filename, 'wb') as out_file:
+        out_file.write(header[:24] + struct.pack('<I', len(frames)) +
+                       header[28:])
+        for (pts, data) in frames:
+            out_file.write(IVF_FRAME_HEADER.pack(len(data), pts))
+            out_file.write(data)
+
+
+def ivf_encoded_files(encoded_files):
+    # Encoded files of a chunked job, named for the IVF bitstream they hold
+    # whatever the encoder's own container is.
+    return [
+        dict(layer, filename=os.path.splitext(layer['filename'])[0] + '.ivf')
+        for layer in encoded_files
+    ]
+
+
+def label_results(results_dict, mode, num_chunks):
+    results_dict['chunk-mode'] = mode
+    results_dict['encode-chunks'] = num_chunks
+
+
+def encoder_label(results_dict):
+    # Name under which chunked results are reported, apart from the
+    # monolithic encodes of the same encoder.
+    if 'chunk-mode' not in results_dict:
+        return results_dict['encoder']
+    return "%s-%s-chunks" % (results_dict['encoder'],
+                             results_dict['chunk-mode'])
@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+import numpy as np
+import pytest
+
+import chunking
+import yuv_reader
+
+
+def covers(chunks, num_frames):
+    return [start for (start, _) in chunks] == [0] + [
+        start + count for (start, count) in chunks[:-1]
+    ] and sum(count for (_, count) in chunks) == num_frames
+
+
+def test_plan_gop_chunks():
+    assert chunking.plan_chunks(25, 10) == [(0, 10), (10, 10), (20, 5)]
+    assert chunking.plan_chunks(10, 10) == [(0, 10)]
+    assert chunking.plan_chunks(3, 10) == [(0, 3)]
+
+
+def test_plan_scene_chunks():
+    # Chunks end at the first cut that leaves them at least 2 frames long.
+    chunks = chunking.plan_chunks(40, 10, cuts=[1, 3, 12, 30])
+    assert chunks == [(0, 3), (3, 9), (12, 18), (30, 10)]
+    assert covers(chunks, 40)
+
+
+def test_plan_scene_chunks_without_cuts():
+    # Chunks are split at the chunk length when the next cut is too far, the
+    # last chunk takes up to twice the chunk length.
+    chunks = chunking.plan_chunks(50, 10, cuts=[])
+    assert chunks == [(0, 10), (10, 10), (20, 10), (30, 20)]
+    assert covers(chunks, 50)
+
+
+def test_plan_scene_chunks_short_tail():
+    # A cut that would leave a too short last chunk is ignored.
+    assert chunking.plan_chunks(20, 10, cuts=[19]) == [(0, 20)]
+
+
+def test_scene_cuts(tmp_path):
+    (width, height) = (32, 16)
+    size = yuv_reader.frame_size(width, height)
+    frames = np.zeros((12, size), dtype=np.uint8)
+    frames[:, :width * height] = 40
+    frames[5:, :width * height] = 200
+    # Small changes within a scene aren't cuts.
+    frames[2, :width * height] = 44
+    frames_file = str(tmp_path / 'clip.yuv')
+    frames.tofile(frames_file)
+    offsets = yuv_reader.frame_offsets(width, height, 0, 12)
+    assert chunking.scene_cuts(frames_file, width, height, offsets) == [5]
+    assert chunking.scene_cuts(frames_file, 4, 4, offsets[:1]) == []
+
+
+def write_ivf(path, frames, width=16, height=8, fourcc=b'AV01'):
+    header = b'DKIF' + struct.pack('<HH', 0, 32) + fourcc + struct.pack(
+        '<HHIII', width, height, 30, 1, len(frames)) + b'\0' * 4
+    with open(path, 'wb') as f:
+        f.write(header)
+        for (pts, data) in frames:
+            f.write(struct.pack('<IQ', len(data), pts))
+            f.write(data)
+    return str(path)
+
+
+def test_concatenate_ivf(tmp_path):
+    first = write_ivf(tmp_path / 'a.ivf', [(0, b'key'), (1, b'inter')])
+    second = write_ivf(tmp_path / 'b.ivf', [(5, b'key2'), (6, b'x'),
+                                            (7, b'yz')])
+    out = str(tmp_path / 'out.ivf')
+    chunking.concatenate_ivf([first, second], out)
+    (header, frames) = chunking.read_ivf(out)
+    assert struct.unpack('<I', header[24:28])[0] == 5
+    assert frames == [(0, b'key'), (1, b'inter'), (2, b'key2'), (3, b'x'),
+                      (4, b'yz')]
+
+
+def test_concatenate_ivf_mismatch(tmp_path):
+    first = write_ivf(tmp_path / 'a.ivf', [(0, b'a')])
+    second = write_ivf(tmp_path / 'b.ivf', [(0, b'b')], width=32)
+    with pytest.raises(chunking.ChunkError):
+        chunking.concatenate_ivf([first, second], str(tmp_path / 'out.ivf'))
+
+
+def test_read_truncated_ivf(tmp_path):
+    filename = write_ivf(tmp_path / 'a.ivf', [(0, b'frame')])
+    with open(filename, 'r+b') as f:
+        f.truncate(32 + 12 + 2)
+    with pytest.raises(chunking.ChunkError):
+        chunking.read_ivf(filename)
+    with open(filename, 'wb') as f:
+        f.write(b'RIFF' + b'\0' * 28)
+    with pytest.raises(chunking.ChunkError):
+        chunking.read_ivf(filename)
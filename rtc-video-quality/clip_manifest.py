@@ -0,0 +1,188 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Clip manifests list clips with everything needed to run them (geometry, frame
+# rate, frame count, sha1sum and optional tags), so that large sets of clips can
+# be loaded without probing every clip. Manifests are JSON files holding a list
+# of entries, or CSV files with one entry per row. Paths are stored relative to
+# the manifest.
+
+import csv
+import json
+import os
+import re
+import tempfile
+
+import clip_probe
+import file_hashes
+import yuv_reader
+
+FIELDS = [
+    'path', 'file_type', 'width', 'height', 'fps', 'frame_count', 'sha1sum',
+    'size', 'mtime_ns', 'tags'
+]
+# Optional fields, empty in CSV files when missing.
+OPTIONAL_INT_FIELDS = ['frame_count', 'size', 'mtime_ns']
+
+# Raw clips found when scanning need their geometry in the file name.
+yuv_name_pattern = re.compile(r"^.*[\._](\d+)_(\d+)\.yuv$")
+CLIP_EXTENSIONS = ['.y4m', '.yuv', '.mkv', '.mp4', '.webm', '.ivf']
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def is_csv(filename):
+    return filename.endswith('.csv')
+
+
+def optional_int(value):
+    return int(value) if value not in [None, ''] else None
+
+
+def parse_entry(entry, manifest_dir):
+    if not isinstance(entry, dict):
+        raise ManifestError("Invalid manifest entry %r." % (entry,))
+    try:
+        return {
+            'path': os.path.normpath(os.path.join(manifest_dir, entry['path'])),
+            'file_type': entry['file_type'],
+            'width': int(entry['width']),
+            'height': int(entry['height']),
+            'fps': float(entry['fps']),
+            'frame_count': optional_int(entry.get('frame_count')),
+            'sha1sum': entry.get('sha1sum') or None,
+            # The sha1sum is trusted while the file keeps its size and
+            # modification time.
+            'size': optional_int(entry.get('size')),
+            'mtime_ns': optional_int(entry.get('mtime_ns')),
+            'tags': entry.get('tags') or [],
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ManifestError("Invalid manifest entry %r: %s" % (entry, e))
+
+
+def load(filename):
+    manifest_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, newline='') as f:
+        if is_csv(filename):
+            entries = []
+            for row in csv.DictReader(f):
+                row['tags'] = (row.get('tags') or '').split()
+                entries.append(row)
+        else:
+            try:
+                entries = json.load(f)
+            except ValueError as e:
+                raise ManifestError("Invalid manifest '%s': %s" % (filename, e))
+            if not isinstance(entries, list):
+                raise ManifestError(
+                    "Invalid manifest '%s': not a list of clips." % filename)
+    return [parse_entry(entry, manifest_dir) for entry in entries]
+
+
+def save(filename, entries):
+    manifest_dir = os.path.dirname(os.path.abspath(filename))
+    rows = []
+    for entry in sorted(entries, key=lambda entry: entry['path']):
+        row = dict(entry)
+        row['path'] = os.path.relpath(entry['path'], manifest_dir)
+        rows.append(row)
+    (fd, temp_filename) = tempfile.mkstemp(dir=manifest_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w', newline='') as f:
+        if is_csv(filename):
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            for row in rows:
+                row['tags'] = ' '.join(row['tags'])
+                for field in OPTIONAL_INT_FIELDS:
+                    if row[field] is None:
+                        row[field] = ''
+                writer.writerow(row)
+        else:
+            json.dump(rows, f, indent=2, sort_keys=True)
+    os.replace(temp_filename, filename)
+
+
+def filter_tags(entries, tags):
+    # Keeps entries with any of `tags`, or all entries if no tags are given.
+    if not tags:
+        return entries
+    return [entry for entry in entries if set(entry['tags']) & set(tags)]
+
+
+def entry_clip(entry):
+    # Returns the clip dict used by generate_data.py for a manifest entry.
+    return {
+        'input_file': entry['path'],
+        'width': entry['width'],
+        'height': entry['height'],
+        'fps': entry['fps'],
+        'file_type': entry['file_type'],
+        'probed_frames': entry['frame_count'],
+        'manifest_sha1sum': entry['sha1sum'],
+    }
+
+
+def add_hashes(entries):
+    # Spares hashing clips that haven't changed since they were added to the
+    # manifest.
+    for entry in entries:
+        if entry['sha1sum'] and entry['size'] is not None and \
+                entry['mtime_ns'] is not None:
+            file_hashes.add(entry['path'], entry['sha1sum'], entry['size'],
+                            entry['mtime_ns'])
+
+
+def probe_entry(path, yuv_fps):
+    # Returns a manifest entry for the clip at `path`, or None for raw clips
+    # that can't be used (without their geometry in the name or `yuv_fps`).
+    if path.endswith('.yuv'):
+        name_match = yuv_name_pattern.match(path)
+        if not name_match or not yuv_fps:
+            return None
+        (width, height) = (int(name_match.group(1)), int(name_match.group(2)))
+        info = {
+            'file_type': 'yuv',
+            'width': width,
+            'height': height,
+            'fps': float(yuv_fps),
+            'frame_count': yuv_reader.count_frames(path, width, height),
+        }
+    else:
+        info = clip_probe.probe(path)
+    # Taken before hashing, a file changed in the meantime is hashed again
+    # when it's used.
+    st = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'file_type': info['file_type'],
+        'width': info['width'],
+        'height': info['height'],
+        'fps': info['fps'],
+        'frame_count': info['frame_count'],
+        'sha1sum': file_hashes.sha1(path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'tags': [],
+    }
+
+
+def find_clips(directory):
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in CLIP_EXTENSIONS:
+                yield os.path.join(dirpath, filename)
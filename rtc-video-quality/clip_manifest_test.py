@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+import clip_manifest
+import file_hashes
+
+
+def write_clip(tmp_path):
+    clip = tmp_path / 'clips' / 'clip.y4m'
+    clip.parent.mkdir()
+    frame = b'FRAME\n' + b'\x80' * (4 * 2 * 3 // 2)
+    clip.write_bytes(b'YUV4MPEG2 W4 H2 F30:1 Ip C420jpeg\n' + frame * 2)
+    return str(clip)
+
+
+@pytest.mark.parametrize('manifest', ['manifest.json', 'manifest.csv'])
+def test_save_and_load(tmp_path, manifest):
+    entry = clip_manifest.probe_entry(write_clip(tmp_path), None)
+    entry['tags'] = ['derf', 'small']
+    yuv_entry = dict(entry,
+                     path=str(tmp_path / 'clips' / 'a.4_2.yuv'),
+                     file_type='yuv',
+                     frame_count=None,
+                     sha1sum=None,
+                     size=None,
+                     mtime_ns=None,
+                     tags=[])
+    filename = str(tmp_path / manifest)
+    clip_manifest.save(filename, [entry, yuv_entry])
+    assert clip_manifest.load(filename) == [yuv_entry, entry]
+    # Paths are stored relative to the manifest.
+    with open(filename) as f:
+        contents = f.read()
+    assert os.path.join('clips', 'clip.y4m') in contents
+    assert str(tmp_path) not in contents
+
+
+@pytest.mark.parametrize('contents', [
+    '{"path": "clip.y4m"}', '["clip.y4m"]', '[{"path": "clip.y4m"}]',
+    '[{"path": "a.y4m", "file_type": "y4m", "width": "wide", "height": 2, '
+    '"fps": 30}]', '[{'
+])
+def test_invalid_manifest(tmp_path, contents):
+    filename = tmp_path / 'manifest.json'
+    filename.write_text(contents)
+    with pytest.raises(clip_manifest.ManifestError):
+        clip_manifest.load(str(filename))
+
+
+def test_filter_tags():
+    entries = [{'tags': ['derf']}, {'tags': ['hd', 'derf']}, {'tags': []}]
+    assert clip_manifest.filter_tags(entries, []) == entries
+    assert clip_manifest.filter_tags(entries, ['hd', 'other']) == [entries[1]]
+
+
+def test_unchanged_clips_are_not_hashed(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_hashes, 'hashes', {})
+    clip = write_clip(tmp_path)
+    entry = clip_manifest.probe_entry(clip, None)
+    monkeypatch.setattr(file_hashes, 'hashes', {})
+    monkeypatch.setattr(file_hashes, 'file_sha1', lambda filename: 'rehashed')
+    clip_manifest.add_hashes([entry])
+    assert file_hashes.sha1(clip) == entry['sha1sum']
+    # Clips modified since the manifest was written are hashed again.
+    monkeypatch.setattr(file_hashes, 'hashes', {})
+    os.utime(clip, ns=(entry['mtime_ns'], entry['mtime_ns'] + 1000))
+    clip_manifest.add_hashes([entry])
+    assert file_hashes.sha1(clip) == 'rehashed'
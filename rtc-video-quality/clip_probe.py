@@ -0,0 +1,80 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Probing of clip dimensions, frame rate, pixel format and frame count. .y4m
+# clips are probed from their header in-process, mediainfo is only run (once per
+# file) for formats that can't be parsed here.
+
+import os
+import subprocess
+
+import y4m_reader
+
+MEDIAINFO_FIELDS = ['Width', 'Height', 'FrameRate', 'FrameCount']
+
+probed_clips = {}
+
+
+def is_y4m(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(y4m_reader.SIGNATURE)) == y4m_reader.SIGNATURE
+
+
+def probe_y4m(filename):
+    header = y4m_reader.read_header(filename)
+    try:
+        frame_count = y4m_reader.count_frames(filename, header)
+    except y4m_reader.Y4mError:
+        # Reported when the clip is prepared.
+        frame_count = None
+    return {
+        'file_type': 'y4m',
+        'width': header['W'],
+        'height': header['H'],
+        'fps': header['F'],
+        'pix_fmt': y4m_reader.pixel_format(header),
+        'frame_count': frame_count,
+    }
+
+
+def probe_mediainfo(filename):
+    # Fetches all fields with a single mediainfo run.
+    inform = 'Video;' + '|'.join('%' + field + '%'
+                                 for field in MEDIAINFO_FIELDS)
+    output = subprocess.check_output(
+        ['mediainfo', '--Inform=' + inform, filename], encoding='utf-8')
+    values = dict(zip(MEDIAINFO_FIELDS, output.strip().split('|')))
+    return {
+        'file_type': 'video',
+        'width': int(values['Width']),
+        'height': int(values['Height']),
+        'fps': float(values['FrameRate']),
+        # Left to ffmpeg, which converts these clips to I420.
+        'pix_fmt': None,
+        'frame_count':
+            int(values['FrameCount']) if values.get('FrameCount') else None,
+    }
+
+
+def probe(filename):
+    # Returns a dict with the clip's 'file_type', 'width', 'height', 'fps',
+    # 'pix_fmt' (None if the clip must be converted to be read) and
+    # 'frame_count' (None if unknown). Results are memoized per file.
+    path = os.path.realpath(filename)
+    if path not in probed_clips:
+        if is_y4m(path):
+            probed_clips[path] = probe_y4m(path)
+        else:
+            probed_clips[path] = probe_mediainfo(path)
+    return probed_clips[path]
@@ -0,0 +1,74 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+
+import pytest
+
+import clip_probe
+
+
+@pytest.fixture(autouse=True)
+def probed_clips(monkeypatch):
+    monkeypatch.setattr(clip_probe, 'probed_clips', {})
+
+
+def test_probe_y4m(tmp_path):
+    clip = tmp_path / 'clip.y4m'
+    frame = b'FRAME\n' + b'\x80' * (4 * 2 * 3 // 2)
+    clip.write_bytes(b'YUV4MPEG2 W4 H2 F25:1 Ip C420jpeg\n' + frame * 3)
+    assert clip_probe.probe(str(clip)) == {
+        'file_type': 'y4m',
+        'width': 4,
+        'height': 2,
+        'fps': 25.0,
+        'pix_fmt': 'yuv420p',
+        'frame_count': 3,
+    }
+
+
+def test_probe_invalid_y4m(tmp_path):
+    clip = tmp_path / 'clip.y4m'
+    frame = b'\x80' * (2 * 2 * 3)
+    clip.write_bytes(b'YUV4MPEG2 W2 H2 F30000:1001 C444\nFRAME\n' + frame +
+                     b'FRAMX\n' + frame)
+    info = clip_probe.probe(str(clip))
+    assert info['fps'] == pytest.approx(29.97, abs=0.001)
+    assert info['pix_fmt'] == 'yuv444p'
+    # Left for preparing the clip to report.
+    assert info['frame_count'] is None
+
+
+def test_probe_mediainfo_once(tmp_path, monkeypatch):
+    clip = tmp_path / 'clip.mkv'
+    clip.write_bytes(b'\x1aE\xdf\xa3')
+    runs = []
+
+    def check_output(command, encoding):
+        runs.append(command)
+        return '1280|720|59.940|\n'
+
+    monkeypatch.setattr(subprocess, 'check_output', check_output)
+    for i in range(2):
+        assert clip_probe.probe(str(clip)) == {
+            'file_type': 'video',
+            'width': 1280,
+            'height': 720,
+            'fps': 59.94,
+            'pix_fmt': None,
+            'frame_count': None,
+        }
+    assert len(runs) == 1
+    assert runs[0][1] == \
+        '--Inform=Video;%Width%|%Height%|%FrameRate%|%FrameCount%'
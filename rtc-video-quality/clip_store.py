@@ -0,0 +1,95 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Persistent store of prepared clips (raw .yuv conversions, frame windows and
+# .y4m files) shared across runs. Files are keyed by the sha1sum of the source
+# clip and a variant name describing what was derived from it. The store is
+# kept below a size limit by evicting the least recently used files.
+
+import os
+import tempfile
+import time
+
+
+def entry_path(store_dir, sha1sum, variant):
+    return os.path.join(store_dir, sha1sum[:2], "%s-%s" % (sha1sum, variant))
+
+
+def touch(filename):
+    # Marks a file as recently used. The time is set explicitly as the
+    # filesystem's own clock can lag behind time.time().
+    now = time.time()
+    os.utime(filename, (now, now))
+
+
+def lookup(store_dir, sha1sum, variant):
+    filename = entry_path(store_dir, sha1sum, variant)
+    try:
+        touch(filename)
+    except FileNotFoundError:
+        return None
+    return filename
+
+
+def materialize(store_dir, sha1sum, variant, produce_func):
+    # Returns the stored file for `variant`, calling `produce_func(filename)`
+    # to create it first if it isn't stored yet.
+    filename = lookup(store_dir, sha1sum, variant)
+    if filename:
+        return filename
+    filename = entry_path(store_dir, sha1sum, variant)
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    # Keep the extension, tools such as ffmpeg pick formats by it.
+    (fd, temp_filename) = tempfile.mkstemp(dir=directory,
+                                           prefix='.tmp',
+                                           suffix=os.path.splitext(variant)[1])
+    os.close(fd)
+    try:
+        produce_func(temp_filename)
+        touch(temp_filename)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    return filename
+
+
+def store_files(store_dir):
+    for (directory, _, filenames) in os.walk(store_dir):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                yield (path, os.stat(path))
+            except FileNotFoundError:
+                # Evicted or renamed by another run.
+                continue
+
+
+def evict(store_dir, max_bytes, used_since):
+    # Removes least recently used files until the store is below `max_bytes`.
+    # Files used at or after `used_since` (by the current run) are kept.
+    files = sorted(store_files(store_dir), key=lambda entry: entry[1].st_mtime)
+    total_bytes = sum(stat.st_size for (path, stat) in files)
+    evicted = 0
+    for (path, stat) in files:
+        if total_bytes <= max_bytes or stat.st_mtime >= used_since:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= stat.st_size
+        evicted += 1
+    return (evicted, total_bytes)
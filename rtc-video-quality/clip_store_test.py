@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+import clip_store
+
+
+def produce(data):
+    produced = []
+
+    def produce_func(filename):
+        produced.append(filename)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    return (produce_func, produced)
+
+
+def set_used(filename, used_time):
+    os.utime(filename, (used_time, used_time))
+
+
+def test_materialize_once(tmp_path):
+    store_dir = str(tmp_path)
+    (produce_func, produced) = produce(b'frames')
+    filename = clip_store.materialize(store_dir, 'abc', '176_144.yuv',
+                                      produce_func)
+    assert clip_store.materialize(store_dir, 'abc', '176_144.yuv',
+                                  produce_func) == filename
+    assert len(produced) == 1
+    # Files are produced under a temporary name with the variant's extension.
+    assert produced[0] != filename
+    assert produced[0].endswith('.yuv')
+    with open(filename, 'rb') as f:
+        assert f.read() == b'frames'
+    assert clip_store.lookup(store_dir, 'abd', '176_144.yuv') is None
+
+
+def test_failed_produce_stores_nothing(tmp_path):
+    def fail(filename):
+        raise OSError('conversion failed')
+
+    with pytest.raises(OSError):
+        clip_store.materialize(str(tmp_path), 'abc', 'clip.y4m', fail)
+    assert list(clip_store.store_files(str(tmp_path))) == []
+
+
+def test_evict_least_recently_used(tmp_path):
+    store_dir = str(tmp_path)
+    files = {}
+    for (i, sha1sum) in enumerate(['aa', 'bb', 'cc']):
+        files[sha1sum] = clip_store.materialize(store_dir, sha1sum, 'x.yuv',
+                                                produce(b'0123456789')[0])
+        set_used(files[sha1sum], 1000 + i)
+    # 'aa' is used again, so 'bb' is the least recently used file.
+    set_used(clip_store.lookup(store_dir, 'aa', 'x.yuv'), 1003)
+    assert clip_store.evict(store_dir, 20, used_since=2000) == (1, 20)
+    assert not os.path.exists(files['bb'])
+    assert os.path.exists(files['aa']) and os.path.exists(files['cc'])
+
+
+def test_evict_keeps_files_of_current_run(tmp_path):
+    store_dir = str(tmp_path)
+    for (i, sha1sum) in enumerate(['aa', 'bb']):
+        set_used(
+            clip_store.materialize(store_dir, sha1sum, 'x.yuv',
+                                   produce(b'0123456789')[0]), 1000 + i)
+    assert clip_store.evict(store_dir, 0, used_since=1001) == (1, 10)
@@ -21,6 +21,9 @@ import binary_vars
 
 libvpx_threads = 4
 
+# Thread count of encoders that spawn one thread per available core.
+ALL_CORES = -1
+
 INTRA_IVAL_LOW_LATENCY = 60
 
 RAV1E_SPEED = 4
@@ -31,6 +34,25 @@ AOM_RT_SPEED = 5
 RAV1E_RT_SPEED = 7
 SVT_RT_SPEED = 5
 
+def is_frame_window(clip):
+    # Whether clip['yuv_file'] holds more frames than the frame window.
+    return (clip['yuv_file_start'] > 0 or
+            clip['frame_count'] < clip['yuv_file_frames'])
+
+
+def aom_frame_window_params(clip):
+    if not is_frame_window(clip):
+        return []
+    return ['--skip=%d' % clip['yuv_file_start'],
+            '--limit=%d' % clip['frame_count']]
+
+
+def svt_frame_window_params(clip):
+    if not is_frame_window(clip):
+        return []
+    return ['-skip', clip['yuv_file_start'], '-n', clip['frame_count']]
+
+
 def rav1e_command(job, temp_dir):
     assert job['num_spatial_layers'] == 1
     assert job['num_temporal_layers'] == 1
@@ -138,7 +160,7 @@ def svt_command(job, temp_dir):
         '-h', clip['height'],
         '-i', clip['yuv_file'],
         '-b', encoded_filename,
-    ]
+    ] + svt_frame_window_params(clip)
 
     if job['param'] == 'bitrate':
         assert len(job['target_bitrates_kbps'])
@@ -239,7 +261,7 @@ def aom_command(job, temp_dir):
         '--height=%d' % clip['height'],
         '--output=%s' % encoded_filename,
         clip['yuv_file']
-    ]
+    ] + aom_frame_window_params(clip)
 
     if job['param'] == 'bitrate':
         assert len(job['target_bitrates_kbps'])
@@ -353,7 +375,7 @@ def libvpx_tl_command(job, temp_dir):
 
     command = [
         binary_vars.VPX_SVC_ENC_BIN,
-        clip['yuv_file'],
+        clip['yuv_window_file'],
         outfile_prefix,
         job['codec'],
         clip['width'],
@@ -429,7 +451,7 @@ def libvpx_command(job, temp_dir):
       '--width=%d' % clip['width'],
       '--height=%d' % clip['height'],
       '--output=%s' % encoded_filename,
-      clip['yuv_file']
+      clip['yuv_window_file']
     ]
     encoded_files = [{'spatial-layer': 0, 'temporal-layer': 0, 'filename': encoded_filename}]
     return (command, encoded_files)
@@ -458,7 +480,7 @@ def openh264_command(job, temp_dir):
       '-sw', clip['width'],
       '-sh', clip['height'],
       '-frin', clip['fps'],
-      '-org', clip['yuv_file'],
+      '-org', clip['yuv_window_file'],
       '-bf', encoded_filename,
       '-numl', 1,
       '-dw', 0, clip['width'],
@@ -489,7 +511,7 @@ def yami_command(job, temp_dir):
       '--ipperiod', 1,
       '--intraperiod', 3000,
       '-c', job['codec'].upper(),
-      '-i', clip['yuv_file'],
+      '-i', clip['yuv_window_file'],
       '-W', clip['width'],
       '-H', clip['height'],
       '-f', fps,
@@ -524,3 +546,76 @@ def get_encoder_command(encoder):
         return openh264_command
     elif 'yami' in encoder:
         return yami_command
+
+
+def get_encoder_input(encoder):
+    # Input format read by an encoder, the clip is only prepared in formats
+    # that some selected encoder reads.
+    if 'rav1e' in encoder:
+        return 'y4m' ## clip['y4m_file']
+    return 'yuv' ## clip['yuv_file'] or clip['yuv_window_file']
+
+
+def reads_frame_window(encoder):
+    # Encoders that select the frame window of clip['yuv_file'] themselves, or
+    # read clip['y4m_file'] which only contains the window. Other encoders read
+    # clip['yuv_window_file'], a copy of the window when it isn't the whole
+    # clip.
+    return encoder.split('-')[0] in ['aom', 'rav1e', 'svt']
+
+
+def encoder_passes(command):
+    # Splits a command into the commands of its '&&'-chained passes.
+    passes = [[]]
+    for arg in command:
+        if arg == '&&':
+            passes.append([])
+        else:
+            passes[-1].append(arg)
+    return passes
+
+
+def command_arg(command, name):
+    # Value of a '--name=value' or '--name value' argument of a command, or
+    # None if it isn't passed.
+    for (i, arg) in enumerate(command):
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+        if arg == name and i + 1 < len(command):
+            return command[i + 1]
+    return None
+
+
+def pass_threads(encoder, command):
+    if encoder.startswith('svt'):
+        # SVT-AV1 spawns a thread per core unless --lp limits it.
+        lp = command_arg(command, '--lp')
+        return ALL_CORES if lp is None else int(lp)
+    if encoder.startswith('rav1e'):
+        # rav1e encodes tiles in parallel, on at most --threads cores.
+        threads = command_arg(command, '--threads')
+        tiles = int(command_arg(command, '--tiles') or 1)
+        return tiles if threads in [None, '0'] else min(int(threads), tiles)
+    # libaom and libvpx run on a single thread with --threads=0 or without
+    # --threads.
+    return max(int(command_arg(command, '--threads') or 1), 1)
+
+
+def get_encoder_threads(encoder, command):
+    # Number of cores an encoder command keeps busy while encoding, read from
+    # the thread counts it passes to the encoder. Passes run one after
+    # another.
+    threads = [pass_threads(encoder, p) for p in encoder_passes(command)]
+    return ALL_CORES if ALL_CORES in threads else max(threads)
+
+
+# Arguments through which the first pass of two-pass encoder configurations
+# writes the statistics read by the second pass.
+FIRST_PASS_STAT_ARGS = {
+    'rav1e-offline': '--first-pass',
+    'svt-offline': '--output-stat-file',
+}
+
+
+def first_pass_stat_file(encoder, first_pass):
+    return first_pass[first_pass.index(FIRST_PASS_STAT_ARGS[encoder]) + 1]
@@ -0,0 +1,119 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Streams the output of one process into several consumer processes through
+# named pipes, so that data that would otherwise be written to disk once and
+# read back by every consumer is never stored.
+
+import errno
+import fcntl
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+BLOCKSIZE = 1024 * 1024
+
+
+def make_fifos(temp_dir, count, suffix=".yuv"):
+    fifos = []
+    for i in range(count):
+        fifo = os.path.join(tempfile.mkdtemp(dir=temp_dir), 'stream' + suffix)
+        os.mkfifo(fifo)
+        fifos.append(fifo)
+    return fifos
+
+
+def open_for_writing(fifo, consumer):
+    # Opening a FIFO for writing blocks until it's opened for reading. Poll
+    # instead so that a consumer that exits before opening its input doesn't
+    # block the producer forever. Returns None in that case.
+    while True:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if consumer.poll() is not None:
+                return None
+            time.sleep(0.01)
+            continue
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        return fd
+
+
+def tee(source, fifos, consumers):
+    # Copies everything read from the file object `source` into each FIFO,
+    # until end of file or until all consumers have exited.
+    fds = [open_for_writing(fifo, consumer)
+           for (fifo, consumer) in zip(fifos, consumers)]
+    try:
+        while any(fd is not None for fd in fds):
+            data = source.read(BLOCKSIZE)
+            if not data:
+                break
+            for (i, fd) in enumerate(fds):
+                if fd is None:
+                    continue
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+                except BrokenPipeError:
+                    # The consumer exited, its exit status tells why.
+                    os.close(fd)
+                    fds[i] = None
+    finally:
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+
+class ThreadConsumer(object):
+    # Runs `func(fifo)` in a thread, providing the parts of the
+    # subprocess.Popen interface used for consumer processes.
+
+    def __init__(self, func, fifo):
+        self.args = [getattr(func, '__name__', 'consumer'), fifo]
+        self.returncode = None
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(func, fifo))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, func, fifo):
+        try:
+            self.result = func(fifo)
+            self.returncode = 0
+        except Exception as e:
+            self.error = e
+            self.returncode = 1
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self.thread.join()
+        return self.returncode
+
+    def check(self):
+        # Raises like subprocess.check_call() if the function failed, chained
+        # to the exception of the function.
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.returncode, self.args,
+                output=repr(self.error)) from self.error
@@ -0,0 +1,79 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import subprocess
+
+import pytest
+
+import fifo_stream
+import y4m_reader
+
+WIDTH = 8
+HEIGHT = 6
+FRAME_SIZE = WIDTH * HEIGHT * 3 // 2
+
+
+def y4m_bytes(num_frames):
+    # A small 8-bit 4:2:0 Y4M clip with a different value in every frame.
+    data = y4m_reader.i420_header_line(WIDTH, HEIGHT, 30)
+    for i in range(num_frames):
+        data += b'FRAME\n' + bytes([i]) * FRAME_SIZE
+    return data
+
+
+def read_frames(fifo):
+    # Reads the Y4M clip streamed into the FIFO and returns its frames.
+    with open(fifo, 'rb') as f:
+        header = y4m_reader.parse_header(f)
+        frames = []
+        while y4m_reader.read_line(f):
+            frames.append(f.read(header['W'] * header['H'] * 3 // 2))
+    return frames
+
+
+def test_tee_to_thread_and_process(tmp_path):
+    data = y4m_bytes(3)
+    fifos = fifo_stream.make_fifos(str(tmp_path), 2, suffix='.y4m')
+    out_file = str(tmp_path / 'out.y4m')
+    with open(out_file, 'wb') as out:
+        process = subprocess.Popen(['cat', fifos[1]], stdout=out)
+        thread = fifo_stream.ThreadConsumer(read_frames, fifos[0])
+        fifo_stream.tee(io.BytesIO(data), fifos, [thread, process])
+        assert process.wait() == 0
+    assert thread.wait() == 0
+    thread.check()
+    assert thread.result == [bytes([i]) * FRAME_SIZE for i in range(3)]
+    with open(out_file, 'rb') as f:
+        assert f.read() == data
+
+
+def test_failing_consumer(tmp_path):
+    def fail(fifo):
+        raise ValueError('bad frame')
+
+    data = y4m_bytes(2)
+    fifos = fifo_stream.make_fifos(str(tmp_path), 2, suffix='.y4m')
+    failing = fifo_stream.ThreadConsumer(fail, fifos[0])
+    # The failing consumer never opens its FIFO, the stream to the other
+    # consumer is not held up by it.
+    reader = fifo_stream.ThreadConsumer(read_frames, fifos[1])
+    fifo_stream.tee(io.BytesIO(data), fifos, [failing, reader])
+    assert reader.wait() == 0
+    assert len(reader.result) == 2
+    assert failing.wait() == 1
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        failing.check()
+    assert e.value.__cause__ is failing.error
+    assert 'bad frame' in e.value.output
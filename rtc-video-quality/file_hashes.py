@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# sha1 digests of files, computed in-process and remembered per path together
+# with the file's size, modification time and inode. A file that hasn't
+# changed since it was last hashed isn't read again. Digests can be persisted
+# to a JSON file shared across runs.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+BLOCKSIZE = 1024 * 1024
+
+hashes = {}
+hash_file = None
+hashes_changed = False
+hash_lock = threading.Lock()
+
+
+def file_sha1(filename):
+    # hashlib releases the GIL while hashing large blocks, so files can be
+    # hashed in parallel from several threads.
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def stat_key(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def load(filename):
+    # Uses `filename` to persist digests, starting out with the digests
+    # stored there.
+    global hash_file
+    hash_file = filename
+    try:
+        with open(filename) as f:
+            hashes.update(json.load(f))
+    except FileNotFoundError:
+        pass
+
+
+def sha1(filename):
+    global hashes_changed
+    path = os.path.realpath(filename)
+    key = stat_key(os.stat(path))
+    with hash_lock:
+        entry = hashes.get(path)
+    if entry and entry['stat'] == key:
+        return entry['sha1']
+    digest = file_sha1(path)
+    # The file may have changed while it was being hashed.
+    if stat_key(os.stat(path)) != key:
+        return digest
+    with hash_lock:
+        hashes[path] = {'stat': key, 'sha1': digest}
+        hashes_changed = True
+    return digest
+
+
+def add(filename, digest, size, mtime_ns):
+    # Remembers a digest known from elsewhere, such as a clip manifest, for a
+    # file that still has the size and modification time it was hashed with.
+    path = os.path.realpath(filename)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    if [st.st_size, st.st_mtime_ns] != [size, mtime_ns]:
+        return
+    with hash_lock:
+        hashes[path] = {'stat': stat_key(st), 'sha1': digest}
+
+
+def save():
+    # Writes new digests, keeping those added by other runs in the meantime.
+    global hashes_changed
+    with hash_lock:
+        if not hash_file or not hashes_changed:
+            return
+        try:
+            with open(hash_file) as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            stored = {}
+        stored.update(hashes)
+        directory = os.path.dirname(os.path.abspath(hash_file))
+        os.makedirs(directory, exist_ok=True)
+        (fd, temp_filename) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        os.replace(temp_filename, hash_file)
+        hashes_changed = False
@@ -0,0 +1,72 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+
+import pytest
+
+import file_hashes
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    # Resets the digests and records which files are actually read.
+    monkeypatch.setattr(file_hashes, 'hashes', {})
+    monkeypatch.setattr(file_hashes, 'hash_file', None)
+    monkeypatch.setattr(file_hashes, 'hashes_changed', False)
+    hashed = []
+    file_sha1 = file_hashes.file_sha1
+
+    def counting_file_sha1(filename):
+        hashed.append(filename)
+        return file_sha1(filename)
+
+    monkeypatch.setattr(file_hashes, 'file_sha1', counting_file_sha1)
+    return hashed
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_unchanged_files_are_not_read_again(tmp_path, hashed):
+    clip = write(tmp_path / 'clip.y4m', b'frames')
+    assert file_hashes.sha1(clip) == hashlib.sha1(b'frames').hexdigest()
+    assert file_hashes.sha1(clip) == hashlib.sha1(b'frames').hexdigest()
+    assert len(hashed) == 1
+    # Same size, but a new modification time.
+    write(tmp_path / 'clip.y4m', b'frameS')
+    st = os.stat(clip)
+    os.utime(clip, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert file_hashes.sha1(clip) == hashlib.sha1(b'frameS').hexdigest()
+    assert len(hashed) == 2
+
+
+def test_save_and_load(tmp_path, hashed):
+    hash_file = str(tmp_path / 'hashes' / 'sha1sums.json')
+    clip = write(tmp_path / 'clip.y4m', b'frames')
+    file_hashes.load(hash_file)
+    file_hashes.sha1(clip)
+    file_hashes.save()
+    with open(hash_file) as f:
+        assert list(json.load(f)) == [os.path.realpath(clip)]
+    # A later run reads the digest from the hash file.
+    file_hashes.hashes.clear()
+    file_hashes.load(hash_file)
+    assert file_hashes.sha1(clip) == hashlib.sha1(b'frames').hexdigest()
+    assert len(hashed) == 1
+
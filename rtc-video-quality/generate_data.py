@@ -14,11 +14,12 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
 import csv
 import json
 import multiprocessing
 import os
-import pprint
+import queue
 import re
 import shutil
 import subprocess
@@ -31,6 +32,27 @@ import math
 
 from encoder_commands import *
 import binary_vars
+import chunking
+import clip_manifest
+import clip_probe
+import clip_store
+import file_hashes
+import fifo_stream
+import job_journal
+import job_scheduler
+import resource_usage
+import result_cache
+import results_io
+import preview
+import process_control
+import rate_search
+import scratch_space
+import sharding
+import tracing
+import work_queue
+import yuv_metrics
+import y4m_reader
+import yuv_reader
 
 binary_absolute_paths = {}
 
@@ -64,31 +86,28 @@ yuv_clip_pattern = re.compile(r"^(.*[\._](\d+)_(\d+).yuv):(\d+)$")
 
 
 def clip_arg(clip):
-    (file_root, file_ext) = os.path.splitext(clip)
-    if file_ext != '.yuv':
-        width = int(
-            subprocess.check_output(
-                ["mediainfo", "--Inform=Video;%Width%", clip],
-                encoding='utf-8'))
-        height = int(
-            subprocess.check_output(
-                ["mediainfo", "--Inform=Video;%Height%", clip],
-                encoding='utf-8'))
-        fps = float(
-            subprocess.check_output(
-                ["mediainfo", "--Inform=Video;%FrameRate%", clip],
-                encoding='utf-8'))
+    clip_match = yuv_clip_pattern.match(clip)
+    if not clip_match and not clip.endswith('.yuv'):
+        if not os.path.isfile(clip) or not os.access(clip, os.R_OK):
+            raise argparse.ArgumentTypeError(
+                "'%s' is either not a file or cannot be opened for reading.\n" %
+                clip)
+        try:
+            info = clip_probe.probe(clip)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            raise argparse.ArgumentTypeError("Can't probe '%s': %s\n" %
+                                             (clip, e))
         return {
             'input_file': clip,
-            'height': height,
-            'width': width,
-            'fps': fps,
-            'file_type': 'y4m'
+            'height': info['height'],
+            'width': info['width'],
+            'fps': info['fps'],
+            'file_type': info['file_type'],
+            'probed_frames': info['frame_count']
         }
 
     # Make sure YUV files are correctly formatted + look readable before actually
     # running the script on them.
-    clip_match = yuv_clip_pattern.match(clip)
     if not clip_match:
         raise argparse.ArgumentTypeError(
             "Argument '%s' doesn't match input format.\n" % clip)
@@ -97,12 +116,15 @@ def clip_arg(clip):
         raise argparse.ArgumentTypeError(
             "'%s' is either not a file or cannot be opened for reading.\n" %
             input_file)
+    width = int(clip_match.group(2))
+    height = int(clip_match.group(3))
     return {
         'input_file': clip_match.group(1),
-        'width': int(clip_match.group(2)),
-        'height': int(clip_match.group(3)),
+        'width': width,
+        'height': height,
         'fps': float(clip_match.group(4)),
-        'file_type': 'yuv'
+        'file_type': 'yuv',
+        'probed_frames': yuv_reader.count_frames(input_file, width, height)
     }
 
 
@@ -143,16 +165,36 @@ def positive_int(num):
     return num_int
 
 
+def shard_arg(shard):
+    shard_match = re.match(r"^(\d+)/(\d+)$", shard)
+    if not shard_match or not 1 <= int(shard_match.group(1)) <= int(
+            shard_match.group(2)):
+        raise argparse.ArgumentTypeError(
+            "'%s' is not a shard I/N where 1 <= I <= N.\n" % shard)
+    return (int(shard_match.group(1)), int(shard_match.group(2)))
+
+
 parser = argparse.ArgumentParser(
     description='Generate graph data for video-quality comparison.')
 parser.add_argument('--enable-bitrate', action='store_true')
 parser.add_argument('clips',
-                    nargs='+',
+                    nargs='*',
                     metavar='clip_WIDTH_HEIGHT.yuv:FPS|clip.y4m',
                     type=clip_arg)
+parser.add_argument('--clip-manifest',
+                    default=None,
+                    metavar='manifest.json',
+                    help='load clips from a manifest (.json or .csv)')
+parser.add_argument('--clip-tags',
+                    default=None,
+                    help='only load manifest clips with any of these tags')
 parser.add_argument('--single-datapoint', action='store_true')
 parser.add_argument('--dump-commands', action='store_true')
 parser.add_argument('--enable-vmaf', action='store_true')
+parser.add_argument('--stream-decoded', action='store_true')
+parser.add_argument('--metrics-backend',
+                    default='tiny_ssim',
+                    choices=['tiny_ssim', 'numpy'])
 parser.add_argument('--encoded-file-dir', default=None, type=writable_dir)
 parser.add_argument('--encoders',
                     required=True,
@@ -166,95 +208,463 @@ parser.add_argument('--num-temporal-layers',
                     type=int,
                     default=1,
                     choices=[1, 2, 3])
-parser.add_argument('--out',
-                    required=True,
-                    metavar='output.txt',
-                    type=argparse.FileType('w'))
+parser.add_argument('--out', required=True, metavar='output.txt')
+parser.add_argument('--out-format',
+                    default=None,
+                    choices=results_io.OUTPUT_FORMATS,
+                    help="defaults to 'jsonl' for .jsonl files, else 'python'")
+parser.add_argument('--journal', default=None, metavar='output.txt.journal')
+parser.add_argument('--resume', action='store_true')
 parser.add_argument('--use-system-path', action='store_true')
+parser.add_argument('--cache-dir', default=None, type=writable_dir)
+parser.add_argument('--cache-bitstreams', action='store_true')
+parser.add_argument('--hash-cache', default=None, metavar='sha1sums.json')
+parser.add_argument('--clip-store', default=None, type=writable_dir)
+parser.add_argument('--clip-store-size',
+                    default=None,
+                    type=float,
+                    metavar='GB',
+                    help='evict least recently used clips above this size')
 parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+parser.add_argument('--decode-workers', type=positive_int, default=None)
+parser.add_argument('--metric-workers', type=positive_int, default=None)
+parser.add_argument('--timing-history', default=None, metavar='timings.json')
+parser.add_argument('--encode-timeout',
+                    default=None,
+                    type=float,
+                    metavar='SECONDS',
+                    help='kill encoders of jobs that take longer than this')
+parser.add_argument('--decode-timeout',
+                    default=None,
+                    type=float,
+                    metavar='SECONDS',
+                    help='kill decoders of jobs that take longer than this')
+parser.add_argument('--metric-timeout',
+                    default=None,
+                    type=float,
+                    metavar='SECONDS',
+                    help='kill metric tools of jobs that take longer than this')
+parser.add_argument('--retries',
+                    default=0,
+                    type=int,
+                    metavar='N',
+                    help='run jobs that time out or are killed by a signal '
+                    'again up to N times')
+parser.add_argument('--scratch-budget',
+                    default=None,
+                    type=float,
+                    metavar='GB',
+                    help='only start jobs while their estimated scratch space '
+                    'fits in this size')
+parser.add_argument('--scratch-small-dir',
+                    default=None,
+                    type=writable_dir,
+                    help='keep small intermediates of jobs here, such as on a '
+                    'tmpfs')
+parser.add_argument('--core-budget',
+                    type=positive_int,
+                    default=len(job_scheduler.available_cores()))
+parser.add_argument('--pin-cores', action='store_true')
+parser.add_argument('--shard',
+                    default=None,
+                    type=shard_arg,
+                    metavar='I/N',
+                    help='only run the jobs of shard I out of N')
+parser.add_argument('--preview',
+                    action='store_true',
+                    help='only encode a few segments of every clip, of '
+                    '--num-frames frames each, to estimate results quickly')
+parser.add_argument('--preview-segments',
+                    default=preview.DEFAULT_SEGMENTS,
+                    type=positive_int,
+                    metavar='N',
+                    help='segments per clip for --preview')
+parser.add_argument('--rate-search',
+                    action='store_true',
+                    help='pick rate points per clip and encoder adaptively '
+                    'instead of using a fixed grid')
+parser.add_argument('--rate-points',
+                    default=5,
+                    type=positive_int,
+                    metavar='N',
+                    help='rate points per encoder for --rate-search')
+parser.add_argument('--chunked',
+                    default=None,
+                    choices=chunking.CHUNK_MODES,
+                    help='split clips of offline encoders into chunks at '
+                    'fixed GOP boundaries or scene cuts and encode the chunks '
+                    'in parallel')
+parser.add_argument('--chunk-frames',
+                    default=chunking.DEFAULT_CHUNK_FRAMES,
+                    type=positive_int,
+                    metavar='N',
+                    help='frames per chunk for --chunked')
+parser.add_argument('--chunk-workers',
+                    default=4,
+                    type=positive_int,
+                    metavar='N',
+                    help='chunks of a job encoded at a time for --chunked')
+parser.add_argument('--reuse-first-pass',
+                    action='store_true',
+                    help='run the first pass of two-pass encoders once per '
+                    'clip, at the middle rate point, and share its statistics '
+                    'between all rate points')
+parser.add_argument('--worker',
+                    action='store_true',
+                    help='claim jobs from the work queue in --queue-dir')
+parser.add_argument('--queue-dir', default=None, type=writable_dir)
+parser.add_argument('--trace',
+                    default=None,
+                    metavar='trace.json',
+                    help='write a Chrome trace of the run')
+parser.add_argument('--profile',
+                    default=None,
+                    metavar='profile.out',
+                    help='write cProfile stats of the Python code')
+
+
+def prepared_file(args, clip, temp_dir, variant, produce_func):
+    # Returns a file derived from the clip, created by
+    # `produce_func(filename)`. Files are taken from and added to the clip store
+    # when one is used, and are otherwise temporary.
+    produce_span = lambda filename: traced_call(
+        'prepare %s' % os.path.splitext(variant)[1][1:], 'prepare',
+        {'clip': clip['input_file']}, produce_func, filename)
+    if args.clip_store:
+        return clip_store.materialize(args.clip_store, clip['sha1sum'],
+                                      variant, produce_span)
+    (fd, filename) = tempfile.mkstemp(dir=temp_dir, suffix=variant)
+    os.close(fd)
+    produce_span(filename)
+    return filename
+
+
+def traced_call(name, category, span_args, func, *args):
+    with tracing.span(name, category, span_args):
+        return func(*args)
+
+
+def convert_to_yuv(clip, yuv_file):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            ['ffmpeg', '-y', '-i', clip['input_file'], yuv_file], stdout=devnull, stderr=devnull)
+
+
+def prepare_clip(args, clip, temp_dir, inputs, copy_window):
+    clip['sha1sum'] = traced_call('hash', 'prepare',
+                                  {'clip': clip['input_file']},
+                                  file_hashes.sha1, clip['input_file'])
+    if clip.get('manifest_sha1sum') and \
+            clip['sha1sum'] != clip['manifest_sha1sum']:
+        raise clip_manifest.ManifestError(
+            "sha1sum %s doesn't match %s in the clip manifest." %
+            (clip['sha1sum'], clip['manifest_sha1sum']))
+
+    # Frames of 8-bit 4:2:0 .y4m clips are read in place, other clips are
+    # converted to yuv using ffmpeg.
+    header = None
+    if clip['file_type'] == 'y4m':
+        header = y4m_reader.read_header(clip['input_file'])
+        if not y4m_reader.is_i420(header):
+            header = None
+    if header:
+        clip['frames_file'] = clip['input_file']
+        source_offsets = traced_call('index frames', 'prepare',
+                                     {'clip': clip['input_file']},
+                                     y4m_reader.frame_index,
+                                     clip['input_file'], header)
+    else:
+        if clip['file_type'] != 'yuv':
+            clip['frames_file'] = prepared_file(
+                args, clip, temp_dir,
+                "%d_%d.yuv" % (clip['width'], clip['height']),
+                lambda yuv_file: convert_to_yuv(clip, yuv_file))
+        else:
+            clip['frames_file'] = clip['input_file']
+        source_offsets = yuv_reader.frame_offsets(
+            clip['width'], clip['height'], 0,
+            yuv_reader.count_frames(clip['frames_file'], clip['width'],
+                                    clip['height']))
+
+    clip['input_total_frames'] = len(source_offsets)
+    if not args.preview:
+        prepare_window(args, clip, temp_dir, inputs, copy_window, header,
+                       source_offsets, args.frame_offset, args.num_frames)
+        return
+    windows = preview.plan_segments(clip['input_total_frames'],
+                                    args.frame_offset, args.preview_segments,
+                                    args.num_frames)
+    clip['segments'] = []
+    for (i, (frame_offset, num_frames)) in enumerate(windows):
+        segment = dict(clip,
+                       preview_segment=i + 1,
+                       preview_segments=len(windows),
+                       frame_window=(frame_offset, num_frames))
+        prepare_window(args, segment, temp_dir, inputs, copy_window, header,
+                       source_offsets, frame_offset, num_frames)
+        clip['segments'].append(segment)
+
+
+def prepare_window(args, clip, temp_dir, inputs, copy_window, header,
+                   source_offsets, frame_offset, num_frames):
+    # Prepares the frame window of a clip in the inputs read by the encoders.
+    size = "%dx%d" % (clip['width'], clip['height'])
+    frame_size = yuv_reader.frame_size(clip['width'], clip['height'])
+    (clip['frame_start'], clip['frame_count']) = yuv_reader.frame_window(
+        clip['input_total_frames'], frame_offset, num_frames)
+    clip['frame_offsets'] = source_offsets[clip['frame_start']:
+                                           clip['frame_start'] +
+                                           clip['frame_count']]
+    window = "%s-%d-%d" % (size, clip['frame_start'], clip['frame_count'])
+    copy_window_func = lambda window_file: yuv_reader.copy_frames(
+        clip['frames_file'], window_file, clip['frame_offsets'], frame_size)
+
+    if 'yuv' in inputs:
+        if header:
+            # Only the frame window is extracted from .y4m clips.
+            clip['yuv_file'] = prepared_file(args, clip, temp_dir,
+                                             "%s.yuv" % window,
+                                             copy_window_func)
+            clip['yuv_file_start'] = 0
+            clip['yuv_file_frames'] = clip['frame_count']
+        else:
+            clip['yuv_file'] = clip['frames_file']
+            clip['yuv_file_start'] = clip['frame_start']
+            clip['yuv_file_frames'] = clip['input_total_frames']
+        if not is_frame_window(clip):
+            clip['yuv_window_file'] = clip['yuv_file']
+        elif copy_window:
+            clip['yuv_window_file'] = prepared_file(args, clip, temp_dir,
+                                                    "%s.yuv" % window,
+                                                    copy_window_func)
+
+    if 'y4m' in inputs:
+        if header and clip['frame_count'] == clip['input_total_frames']:
+            clip['y4m_file'] = clip['input_file']
+        else:
+            header_line = header['line'] if header else \
+                y4m_reader.i420_header_line(clip['width'], clip['height'],
+                                            int(clip['fps'] + 0.5))
+            clip['y4m_file'] = prepared_file(
+                args, clip, temp_dir,
+                "%s-%d.y4m" % (window, int(clip['fps'] + 0.5)),
+                lambda y4m_file: y4m_reader.write_y4m(
+                    y4m_file, header_line, clip['frames_file'],
+                    clip['frame_offsets'], frame_size))
+
+    if args.chunked and any(encoder in chunking.CHUNKED_ENCODERS
+                            for (encoder, codec) in args.encoders):
+        cuts = None
+        if args.chunked == 'scene':
+            cuts = traced_call('detect scene cuts', 'prepare',
+                               {'clip': clip['input_file']},
+                               chunking.scene_cuts, clip['frames_file'],
+                               clip['width'], clip['height'],
+                               clip['frame_offsets'])
+        clip['chunks'] = chunking.plan_chunks(clip['frame_count'],
+                                              args.chunk_frames, cuts)
 
 
 def prepare_clips(args, temp_dir):
+    # Prepares up to --workers clips at a time. Yields (clip, error) for every
+    # clip as soon as it is ready, where error is None if preparation
+    # succeeded.
     clips = args.clips
-    non_yuv_clips = [clip for clip in clips if clip['file_type'] != '.yuv']
-
-    # Convert all non yuv clips to yuv using ffmpeg
-    if non_yuv_clips:
-        print("Converting %d clip%s to yuv..." %
-              (len(non_yuv_clips), "" if len(non_yuv_clips) == 1 else "s"))
-        for clip in non_yuv_clips:
-            (fd, yuv_file) = tempfile.mkstemp(dir=temp_dir,
-                                              suffix=".%d_%d.yuv" % (clip['width'], clip['height']))
-            os.close(fd)
-            with open(os.devnull, 'w') as devnull:
-                subprocess.check_call(
-                    ['ffmpeg', '-y', '-i', clip['input_file'], yuv_file], stdout=devnull, stderr=devnull)
-            clip['yuv_file'] = yuv_file
-
-    # Get sha1sum of file and other metadata
-    for clip in clips:
-        clip['sha1sum'] = subprocess.check_output(
-            ['sha1sum', clip['input_file']], encoding='utf-8').split(' ', 1)[0]
-        if 'yuv_file' not in clip:
-            clip['yuv_file'] = clip['input_file']
-        frame_size = int(6 * clip['width'] * clip['height'] / 4)
-        input_yuv_filesize = os.path.getsize(clip['yuv_file'])
-        clip['input_total_frames'] = input_yuv_filesize / frame_size
-        # Truncate file if necessary.
-        if args.frame_offset > 0 or args.num_frames > 0:
-            (fd, truncated_filename) = tempfile.mkstemp(
-                dir=temp_dir, suffix=".yuv")
-            blocksize = 2048 * 1024
-            total_filesize = args.num_frames * frame_size
-            with os.fdopen(fd, 'wb', blocksize) as truncated_file:
-                with open(clip['yuv_file'], 'rb') as original_file:
-                    original_file.seek(args.frame_offset * frame_size)
-                    while total_filesize > 0:
-                        data = original_file.read(
-                            blocksize if blocksize < total_filesize else total_filesize)
-                        truncated_file.write(data)
-                        total_filesize -= blocksize
-            clip['yuv_file'] = truncated_filename
-
-        (fd, y4m_file) = tempfile.mkstemp(dir=temp_dir, suffix='.y4m')
-        os.close(fd)
+    start_time = time.time()
+    inputs = set(
+        get_encoder_input(encoder) for (encoder, codec) in args.encoders)
+    # Encoders that can't select a frame window themselves read a copy of it.
+    copy_window = not all(
+        reads_frame_window(encoder) for (encoder, codec) in args.encoders)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.workers),
+            thread_name_prefix='prepare') as executor:
+        futures = {
+            executor.submit(tracing.profiled(prepare_clip), args, clip,
+                            temp_dir, inputs, copy_window): clip
+            for clip in clips
+        }
+        prepared_clips = 0
+        for future in concurrent.futures.as_completed(futures):
+            clip = futures[future]
+            prepared_clips += 1
+            try:
+                future.result()
+                error = None
+            except (subprocess.CalledProcessError, OSError,
+                    y4m_reader.Y4mError, clip_manifest.ManifestError) as e:
+                error = e
+            with thread_lock:
+                print("Prepared clip %d/%d: %s (%s)" %
+                      (prepared_clips, len(clips), clip['input_file'],
+                       "OK" if error is None else "ERROR"))
+                if error is not None:
+                    print(error)
+            yield (clip, error)
+    file_hashes.save()
+    if args.clip_store and args.clip_store_size is not None:
+        (evicted, total_bytes) = clip_store.evict(
+            args.clip_store, args.clip_store_size * 1e9, start_time)
+        with thread_lock:
+            print("Clip store: %.1f GB, evicted %d file%s." %
+                  (total_bytes / 1e9, evicted, "" if evicted == 1 else "s"))
+
+
+def job_preexec_fn(job):
+    if not args.pin_cores:
+        return None
+    return lambda: os.sched_setaffinity(0, job['cores'])
 
-        with open(os.devnull, 'w') as devnull:
-            subprocess.check_call(
-                ['ffmpeg', '-y', '-s', '%dx%d' % (clip['width'], clip['height']), '-r', str(int(clip['fps'] + 0.5)), '-pix_fmt', 'yuv420p', '-i', clip['yuv_file'], y4m_file],
-                stdout=devnull,
-                stderr=devnull
-            )
 
-        clip['y4m_file'] = y4m_file
+def decoder_command(job, temp_dir, encoded_file, decoded_file):
+    (fd, framestats_file) = tempfile.mkstemp(dir=temp_dir, suffix=".csv")
+    os.close(fd)
+    if job['codec'] in ['av1', 'vp8', 'vp9']:
+        decoder = binary_vars.AOM_DEC_BIN if job[
+            'codec'] == 'av1' else binary_vars.VPX_DEC_BIN
+        command = [
+            decoder, '--i420',
+            '--codec=%s' % job['codec'], '-o', decoded_file, encoded_file,
+            '--framestats=%s' % framestats_file
+        ]
+    elif job['codec'] == 'h264':
+        command = [binary_vars.H264_DEC_BIN, encoded_file, decoded_file]
+        # TODO(pbos): Generate H264 framestats.
+        framestats_file = None
+    return (command, framestats_file)
 
 
 def decode_file(job, temp_dir, encoded_file):
     (fd, decoded_file) = tempfile.mkstemp(dir=temp_dir, suffix=".yuv")
     os.close(fd)
-    (fd, framestats_file) = tempfile.mkstemp(dir=temp_dir, suffix=".csv")
-    os.close(fd)
+    (command, framestats_file) = decoder_command(job,
+                                                 scratch.small_dir(temp_dir),
+                                                 encoded_file, decoded_file)
+    with tracing.span('decode', 'decode',
+                      {'job': job_to_string(job)}) as span_args:
+        with open(os.devnull, 'w') as devnull:
+            process = process_control.start(command,
+                                            deadline=job.get('deadline'),
+                                            stdout=devnull,
+                                            stderr=devnull,
+                                            preexec_fn=job_preexec_fn(job))
+        span_args['pid'] = process.pid
+        usage = process_control.wait(process)
+    process_control.check(process)
+    return (decoded_file, framestats_file, usage)
+
+
+def feed_source_window(clip, fifo, consumer):
+    # Writes the frame window of the source clip into `fifo` from a thread.
+    # Every consumer gets a thread of its own so that a consumer waiting for
+    # its decoded input never holds up the source input of another.
+    def feed():
+        try:
+            with yuv_reader.FrameWindow(
+                    clip['frames_file'], clip['frame_offsets'],
+                    yuv_reader.frame_size(clip['width'],
+                                          clip['height'])) as window:
+                fifo_stream.tee(window, [fifo], [consumer])
+        except (OSError, EOFError):
+            # Don't leave the consumer waiting for its input forever.
+            consumer.kill()
+            raise
+
+    thread = threading.Thread(target=feed)
+    thread.daemon = True
+    thread.start()
+    return (thread, fifo)
+
+
+def finish_source_feed(feeder):
+    if feeder:
+        (thread, fifo) = feeder
+        thread.join()
+        shutil.rmtree(os.path.dirname(fifo))
+
+
+def start_metric_command(job, temp_dir, metric_command, decoded_file, stdout):
+    # Starts a metric command comparing the frame window of the source clip to
+    # `decoded_file`. Without a file holding exactly the window the source is
+    # fed through a FIFO instead of being copied. Returns the process and its
+    # source feeder, if any.
+    clip = job['clip']
+    if 'yuv_window_file' in clip:
+        source_file = clip['yuv_window_file']
+    else:
+        [source_file] = fifo_stream.make_fifos(temp_dir, 1)
+    process = process_control.start(metric_command(source_file,
+                                                   decoded_file),
+                                    deadline=job.get('deadline'),
+                                    stdout=stdout,
+                                    encoding='utf-8',
+                                    preexec_fn=job_preexec_fn(job))
+    feeder = None
+    if 'yuv_window_file' not in clip:
+        feeder = feed_source_window(clip, source_file, process)
+    return (process, feeder)
+
+
+def stream_decoded_file(job, temp_dir, encoded_file, metric_commands,
+                        metric_funcs):
+    # Decodes into a pipe and streams the decoded frames through a FIFO per
+    # metric, instead of writing a decoded file. `metric_commands` are
+    # functions building a metric command from the paths of its source and
+    # decoded inputs, `metric_funcs` compute metrics in-process from the path
+    # of the decoded input. Returns the output of each metric command, the
+    # result of each metric function, the decoder's frame stats and the
+    # resource usage of the decoder and of the metric commands.
+    fifos = fifo_stream.make_fifos(temp_dir,
+                                   len(metric_commands) + len(metric_funcs))
+    (command, framestats_file) = decoder_command(job, temp_dir, encoded_file,
+                                                 '/dev/stdout')
+    metric_processes = []
+    metric_outputs = []
+    source_feeders = []
+    for (metric_command, fifo) in zip(metric_commands, fifos):
+        # Outputs go to files as a consumer that fills its stdout pipe would
+        # stop reading its FIFO and stall the stream.
+        metric_outputs.append(tempfile.TemporaryFile(mode='w+', dir=temp_dir))
+        (process, feeder) = start_metric_command(job, temp_dir,
+                                                 metric_command, fifo,
+                                                 metric_outputs[-1])
+        metric_processes.append(process)
+        source_feeders.append(feeder)
+    metric_threads = [
+        fifo_stream.ThreadConsumer(metric_func, fifo) for (metric_func, fifo)
+        in zip(metric_funcs, fifos[len(metric_commands):])
+    ]
     with open(os.devnull, 'w') as devnull:
-        if job['codec'] in ['av1', 'vp8', 'vp9']:
-            decoder = binary_vars.AOM_DEC_BIN if job[
-                'codec'] == 'av1' else binary_vars.VPX_DEC_BIN
-            subprocess.check_call([
-                decoder, '--i420',
-                '--codec=%s' % job['codec'], '-o', decoded_file, encoded_file,
-                '--framestats=%s' % framestats_file
-            ],
-                                  stdout=devnull,
-                                  stderr=devnull,
-                                  encoding='utf-8')
-        elif job['codec'] == 'h264':
-            subprocess.check_call(
-                [binary_vars.H264_DEC_BIN, encoded_file, decoded_file],
-                stdout=devnull,
-                stderr=devnull,
-                encoding='utf-8')
-            # TODO(pbos): Generate H264 framestats.
-            framestats_file = None
-    return (decoded_file, framestats_file)
+        decoder = process_control.start(command,
+                                        deadline=job.get('deadline'),
+                                        stdout=subprocess.PIPE,
+                                        stderr=devnull,
+                                        preexec_fn=job_preexec_fn(job))
+    consumers = metric_processes + metric_threads
+    try:
+        fifo_stream.tee(decoder.stdout, fifos, consumers)
+    finally:
+        decoder.stdout.close()
+        decode_usage = process_control.wait(decoder)
+        metric_usage = resource_usage.combine(
+            [process_control.wait(process) for process in metric_processes])
+        for thread in metric_threads:
+            thread.wait()
+        for feeder in source_feeders:
+            finish_source_feed(feeder)
+    for process in [decoder] + metric_processes:
+        process_control.check(process)
+    for thread in metric_threads:
+        thread.check()
+    outputs = []
+    for metric_output in metric_outputs:
+        metric_output.seek(0)
+        outputs.append(metric_output.read())
+        metric_output.close()
+    for fifo in fifos:
+        shutil.rmtree(os.path.dirname(fifo))
+    return (outputs, [thread.result for thread in metric_threads],
+            framestats_file, decode_usage, metric_usage)
 
 
 def add_framestats(results_dict, framestats_file, statstype):
@@ -268,22 +678,91 @@ def add_framestats(results_dict, framestats_file, statstype):
                 results_dict[metric_key].append(statstype(value))
 
 
+def parse_tiny_ssim_output(output):
+    summary = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        (metric, value) = line.split(': ')
+        summary[metric] = float(value)
+    return summary
+
+
 def generate_metrics(results_dict, job, temp_dir, encoded_file):
-    (decoded_file, decoder_framestats) = decode_file(job, temp_dir,
-                                                     encoded_file['filename'])
     clip = job['clip']
     temporal_divide = 2**(job['num_temporal_layers'] - 1 -
                           encoded_file['temporal-layer'])
     temporal_skip = temporal_divide - 1
     # TODO(pbos): Perform SSIM on downscaled .yuv files for spatial layers.
-    (fd, metrics_framestats) = tempfile.mkstemp(dir=temp_dir, suffix=".csv")
-    os.close(fd)
-    ssim_results = subprocess.check_output([
-        binary_vars.TINY_SSIM_BIN, clip['yuv_file'], decoded_file,
-        "%dx%d" % (results_dict['width'], results_dict['height']),
-        str(temporal_skip), metrics_framestats
-    ],
-                                           encoding='utf-8').splitlines()
+    metric_commands = []
+    metric_funcs = []
+    if args.metrics_backend == 'tiny_ssim':
+        (fd, metrics_framestats) = tempfile.mkstemp(dir=temp_dir,
+                                                    suffix=".csv")
+        os.close(fd)
+        metric_commands.append(lambda source_file, decoded_file: [
+            binary_vars.TINY_SSIM_BIN, source_file, decoded_file,
+            "%dx%d" % (results_dict['width'], results_dict['height']),
+            str(temporal_skip), metrics_framestats
+        ])
+    else:
+        metric_funcs.append(lambda decoded_file: yuv_metrics.compute_metrics(
+            clip['frames_file'], decoded_file, results_dict['width'],
+            results_dict['height'], temporal_skip, clip['frame_offsets']))
+    if args.enable_vmaf:
+        (fd, vmaf_results_file) = tempfile.mkstemp(
+            dir=temp_dir,
+            suffix="%s-%s-%d.json" %
+            (job['encoder'], job['codec'], job['qp_value']))
+        os.close(fd)
+        metric_commands.append(lambda source_file, decoded_file: [
+            'vmaf/libvmaf/build/tools/vmafossexec', 'yuv420p',
+            str(results_dict['width']),
+            str(results_dict['height']), source_file, decoded_file,
+            'vmaf/model/vmaf_v0.6.1.pkl', '--log-fmt', 'json', '--log',
+            vmaf_results_file
+        ])
+
+    if args.stream_decoded:
+        (metric_outputs, metric_results, decoder_framestats, decode_usage,
+         metric_usage) = traced_call('stream decoded', 'metric',
+                                     {'job': job_to_string(job)},
+                                     stream_decoded_file, job, temp_dir,
+                                     encoded_file['filename'],
+                                     metric_commands, metric_funcs)
+        resource_usage.add_stats(results_dict, 'decode', decode_usage)
+    else:
+        decoded_file = encoded_file['decoded-file']
+        decoder_framestats = encoded_file['decoder-framestats']
+        metric_outputs = []
+        metric_usages = []
+        for metric_command in metric_commands:
+            with tracing.span('metric', 'metric',
+                              {'job': job_to_string(job)}) as span_args:
+                (process, feeder) = start_metric_command(
+                    job, temp_dir, metric_command, decoded_file,
+                    subprocess.PIPE)
+                span_args['pid'] = process.pid
+                span_args['tool'] = os.path.basename(process.args[0])
+                output = process.stdout.read()
+                process.stdout.close()
+                metric_usages.append(process_control.wait(process))
+                finish_source_feed(feeder)
+            process_control.check(process, output)
+            metric_outputs.append(output)
+        metric_usage = resource_usage.combine(metric_usages)
+        metric_results = [
+            traced_call('metric', 'metric', {
+                'job': job_to_string(job),
+                'tool': 'numpy'
+            }, metric_func, decoded_file) for metric_func in metric_funcs
+        ]
+        os.remove(decoded_file)
+    resource_usage.add_stats(results_dict, 'metric', metric_usage)
+    if args.metrics_backend == 'tiny_ssim':
+        ssim_summary = parse_tiny_ssim_output(metric_outputs[0])
+    else:
+        (ssim_summary, ssim_framestats) = metric_results[0]
 
     metric_map = {
         'AvgPSNR': 'avg-psnr',
@@ -300,10 +779,7 @@ def generate_metrics(results_dict, job, temp_dir, encoded_file):
         'SSIM-V': 'ssim-v',
         'VpxSSIM': 'vpx-ssim',
     }
-    for line in ssim_results:
-        if not line:
-            continue
-        (metric, value) = line.split(': ')
+    for (metric, value) in ssim_summary.items():
         if metric in metric_map:
             results_dict[metric_map[metric]] = float(value)
         elif metric == 'Nframes':
@@ -312,17 +788,14 @@ def generate_metrics(results_dict, job, temp_dir, encoded_file):
     results_dict['psnr-dmos'] = psnr_to_dmos(results_dict['avg-psnr'])
     if decoder_framestats:
         add_framestats(results_dict, decoder_framestats, int)
-    add_framestats(results_dict, metrics_framestats, float)
+    if args.metrics_backend == 'tiny_ssim':
+        add_framestats(results_dict, metrics_framestats, float)
+    else:
+        for (metric, values) in ssim_framestats.items():
+            results_dict['frame-%s' % metric] = values
 
     if args.enable_vmaf:
-        (fd, results_file) = tempfile.mkstemp(
-            dir=temp_dir,
-            suffix="%s-%s-%d.json" %
-            (job['encoder'], job['codec'], job['qp_value']))
-        os.close(fd)
-        vmaf_results = subprocess.check_output(['vmaf/libvmaf/build/tools/vmafossexec', 'yuv420p', str(results_dict['width']), str(
-            results_dict['height']), clip['yuv_file'], decoded_file, 'vmaf/model/vmaf_v0.6.1.pkl', '--log-fmt', 'json', '--log', results_file], encoding='utf-8')
-        with open(results_file, 'r') as results_file:
+        with open(vmaf_results_file, 'r') as results_file:
             vmaf_obj = json.load(results_file)
         results_dict['vmaf'] = float(vmaf_obj['VMAF score'])
 
@@ -348,34 +821,154 @@ def generate_metrics(results_dict, job, temp_dir, encoded_file):
     results_dict['bitrate-utilization'] = float(bitrate_used_bps)
 
 
+def decoder_binary(codec):
+    if codec == 'av1':
+        return binary_vars.AOM_DEC_BIN
+    if codec in ['vp8', 'vp9']:
+        return binary_vars.VPX_DEC_BIN
+    if codec == 'h264':
+        return binary_vars.H264_DEC_BIN
+    return None
+
+
+def job_binaries(job, command):
+    binaries = [decoder_binary(job['codec'])]
+    if args.metrics_backend == 'tiny_ssim':
+        binaries.append(binary_vars.TINY_SSIM_BIN)
+    if args.enable_vmaf:
+        binaries.append(binary_vars.VMAF_BIN)
+    binaries = [
+        find_absolute_path(False, binary) for binary in binaries if binary
+    ]
+    if args.metrics_backend == 'numpy':
+        binaries.append(os.path.abspath(yuv_metrics.__file__))
+    return [command[0]] + binaries
+
+
+def encoded_file_name(job, layer):
+    clip = job['clip']
+    param = job['qp_value'] if job['param'] == 'qp' else job[
+        'target_bitrates_kbps'][-1]
+    name = os.path.splitext(os.path.basename(clip['input_file']))[0]
+    if 'preview_segment' in clip:
+        name += "-%d-%d" % (clip['frame_start'], clip['frame_count'])
+    return "%s-%s-%s-%dsl%dtl-%d-sl%d-tl%d%s" % (
+        name, job['encoder'], job['codec'], job['num_spatial_layers'],
+        job['num_temporal_layers'], param, layer['spatial-layer'],
+        layer['temporal-layer'], os.path.splitext(layer['filename'])[1])
+
+
+def load_cached_results(job, cache_key, encoded_files, encoded_file_dir):
+    entry = result_cache.load_results(args.cache_dir,
+                                      cache_key,
+                                      need_bitstreams=encoded_file_dir
+                                      is not None)
+    if entry is None:
+        return None
+    results = entry['results']
+    for (i, results_dict) in enumerate(results):
+        # The same content may be cached under a different file name.
+        results_dict['input-file'] = os.path.basename(
+            job['clip']['input_file'])
+        label_preview(results_dict, job)
+        if encoded_file_dir:
+            result_cache.restore_bitstream(
+                args.cache_dir, cache_key, entry, i,
+                os.path.join(encoded_file_dir,
+                             encoded_file_name(job, encoded_files[i])))
+    return (results, entry['output'])
+
+
+def label_preview(results_dict, job):
+    clip = job['clip']
+    if 'preview_segment' in clip:
+        preview.label_results(results_dict, clip['preview_segment'],
+                              clip['preview_segments'], job['rate_point'])
+
+
+def run_encoder_passes(job, command):
+    # Runs the passes of an encoder command one after another. Returns the
+    # wall-clock time and resource usage of every pass, or None if a pass
+    # failed, together with the output of all passes.
+    passes = []
+    output = ''
+    for (i, pass_command) in enumerate(encoder_passes(command)):
+        start_time = time.time()
+        try:
+            process = process_control.start(pass_command,
+                                            deadline=job.get('deadline'),
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            encoding='utf-8',
+                                            preexec_fn=job_preexec_fn(job))
+        except OSError as e:
+            return (None, output + str(e))
+        output += process_control.read_output(process.stdout)
+        process.stdout.close()
+        usage = process_control.wait(process) or {}
+        end_time = time.time()
+        usage['wall-time-ms'] = (end_time - start_time) * 1000
+        tracing.add_span('encode pass %d' % (i + 1), 'encode', start_time,
+                         end_time, {
+                             'job': job_to_string(job),
+                             'pid': process.pid
+                         })
+        passes.append(usage)
+        if process.timed_out:
+            job['transient_failure'] = True
+            return (None, output + "Timed out after %.1f seconds.\n" %
+                    process.timeout)
+        if process.returncode != 0:
+            job['transient_failure'] = process.returncode < 0
+            return (None, output)
+    return (passes, output)
+
+
 def run_command(job, encoder_command, job_temp_dir, encoded_file_dir):
+    # Runs the encode stage of a job. Returns results that are completed by
+    # the decode and metric stages, or complete results for cached jobs.
     (command, encoded_files) = encoder_command
     clip = job['clip']
-    start_time = time.time()
-    try:
-        process = subprocess.Popen(' '.join(
-            shlex.quote(arg) if arg != '&&' else arg for arg in command),
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT,
-                                   encoding='utf-8',
-                                   shell=True)
-    except OSError as e:
-        return (None, "> %s\n%s" % (" ".join(command), e))
-    (output, _) = process.communicate()
-    actual_encode_ms = (time.time() - start_time) * 1000
-    input_yuv_filesize = os.path.getsize(clip['yuv_file'])
-    input_num_frames = int(input_yuv_filesize /
-                           (6 * clip['width'] * clip['height'] / 4))
-    target_encode_ms = float(input_num_frames) * 1000 / clip['fps']
-    if process.returncode != 0:
-        return (None, "> %s\n%s" % (" ".join(command), output))
+    if args.cache_dir:
+        (frame_offset, num_frames) = clip_window(args, clip)
+        cache_key = result_cache.cache_key(clip, frame_offset, num_frames,
+                                           command, job_temp_dir,
+                                           job_binaries(job, command),
+                                           args.enable_vmaf,
+                                           args.metrics_backend,
+                                           job_chunks(job))
+        job['cache_key'] = cache_key
+        cached = traced_call('cache lookup', 'cache',
+                             {'job': job_to_string(job)}, load_cached_results,
+                             job, cache_key, encoded_files, encoded_file_dir)
+        if cached is not None:
+            job['cached'] = True
+            return cached
+    if 'chunks' in job:
+        start_time = time.time()
+        (passes, output) = run_chunks(job, encoded_files, job_temp_dir)
+        if passes is None:
+            return (None, output)
+        # Chunks run side by side, the encode takes as long as all of them.
+        actual_encode_ms = (time.time() - start_time) * 1000
+    else:
+        if 'first_pass_key' in job:
+            (passes, output) = run_shared_first_pass(job, command,
+                                                     job_temp_dir)
+        else:
+            (passes, output) = run_encoder_passes(job, command)
+        if passes is None:
+            return (None, "> %s\n%s" % (" ".join(command), output))
+        actual_encode_ms = sum(
+            encode_pass['wall-time-ms'] for encode_pass in passes)
+    target_encode_ms = float(clip['frame_count']) * 1000 / clip['fps']
     results = [{} for i in range(len(encoded_files))]
     for i in range(len(results)):
         results_dict = results[i]
         results_dict['input-file'] = os.path.basename(clip['input_file'])
         results_dict['input-file-sha1sum'] = clip['sha1sum']
         results_dict['input-total-frames'] = clip['input_total_frames']
-        results_dict['frame-offset'] = args.frame_offset
+        results_dict['frame-offset'] = clip['frame_start']
         # results_dict['param'] = job['param']
         # results_dict['bitrate-config-kbps'] = job['target_bitrates_kbps']
         results_dict['layer-pattern'] = "%dsl%dtl" % (
@@ -389,29 +982,193 @@ def run_command(job, encoder_command, job_temp_dir, encoded_file_dir):
         results_dict['target-encode-time-ms'] = target_encode_ms
         results_dict[
             'encode-time-utilization'] = actual_encode_ms / target_encode_ms
+        resource_usage.add_stats(results_dict, 'encode',
+                                 resource_usage.combine(passes))
+        results_dict['encode-passes'] = passes
         layer = encoded_files[i]
 
         results_dict['temporal-layer'] = layer['temporal-layer']
         results_dict['spatial-layer'] = layer['spatial-layer']
+        label_preview(results_dict, job)
+        if 'chunks' in job:
+            chunking.label_results(results_dict, args.chunked,
+                                   len(job['chunks']))
+        if job.get('first_pass_reused'):
+            results_dict['first-pass-reused'] = True
+
+    return (results, output)
+
+
+def run_shared_first_pass(job, command, job_temp_dir):
+    # Runs a two-pass command whose first pass may be shared with other jobs
+    # with the same first pass. The job that reserved the first pass when it
+    # was started runs it, or restores its statistics from the result cache,
+    # and jobs with the same first pass are only started once it is done and
+    # copy its statistics. Returns the usage of the passes that this job ran,
+    # like run_encoder_passes().
+    (first_pass, second_pass) = encoder_passes(command)
+    stat_file = first_pass_stat_file(job['encoder'], first_pass)
+    key = job['first_pass_key']
+    shared = first_passes[key]
+    passes = []
+    output = ''
+    if job.get('runs_first_pass'):
+        try:
+            if not (args.cache_dir and result_cache.restore_first_pass(
+                    args.cache_dir, key, stat_file)):
+                (passes, output) = run_encoder_passes(job, first_pass)
+                if passes is None:
+                    return (None, output)
+                if args.cache_dir:
+                    result_cache.store_first_pass(args.cache_dir, key,
+                                                  stat_file)
+            shutil.copyfile(stat_file, shared['stat_file'])
+            shared['ok'] = True
+        finally:
+            finish_first_pass(job)
+    else:
+        shutil.copyfile(shared['stat_file'], stat_file)
+        job['first_pass_reused'] = True
+    (second_passes, second_output) = run_encoder_passes(job, second_pass)
+    if second_passes is None:
+        return (None, output + second_output)
+    return (passes + second_passes, output + second_output)
+
+
+def reserve_first_pass(job, job_temp_dir):
+    # Makes a started job run its first pass if no other job has run it or is
+    # running it. Must be called with thread_lock held.
+    key = job.get('first_pass_key')
+    if key is None or key in first_passes:
+        return
+    first_passes[key] = {
+        'ok': False,
+        'stat_file': os.path.join(os.path.dirname(job_temp_dir), key + '.stat')
+    }
+    job['runs_first_pass'] = True
+
+
+def finish_first_pass(job):
+    # Releases jobs held back until the first pass of the job was done, also if
+    # the job ended before running it, such as cached jobs.
+    if not job.pop('runs_first_pass', False):
+        return
+    with thread_lock:
+        key = job['first_pass_key']
+        if not first_passes[key]['ok']:
+            # The next job with this first pass runs it.
+            del first_passes[key]
+        thread_lock.notify_all()
+
+
+def job_chunks(job):
+    # Describes the chunks of chunked jobs for result cache keys.
+    if 'chunks' not in job:
+        return None
+    return [args.chunked, job['chunks']]
+
 
-        generate_metrics(results_dict, job, job_temp_dir, layer)
+def chunk_clip(job, start, count, chunk_dir):
+    # Returns a copy of the job's clip whose frame window is the frames
+    # [start, start + count) of the clip's window.
+    clip = job['clip']
+    chunk = dict(clip,
+                 frame_start=clip['frame_start'] + start,
+                 frame_count=count,
+                 frame_offsets=clip['frame_offsets'][start:start + count])
+    if 'yuv_file' in clip:
+        chunk['yuv_file_start'] = clip['yuv_file_start'] + start
+    if get_encoder_input(job['encoder']) == 'y4m':
+        # .y4m files only hold the window, every chunk gets its own.
+        chunk['y4m_file'] = os.path.join(chunk_dir, 'chunk.y4m')
+        y4m_reader.write_y4m(
+            chunk['y4m_file'],
+            y4m_reader.read_header(clip['y4m_file'])['line'],
+            clip['frames_file'], chunk['frame_offsets'],
+            yuv_reader.frame_size(clip['width'], clip['height']))
+    return chunk
+
+
+def encode_chunk(job, job_temp_dir, start, count):
+    # Encodes one chunk with the job's encoder settings. Returns the usage of
+    # every pass (None if a pass failed), the output and the encoded file.
+    chunk_dir = tempfile.mkdtemp(dir=job_temp_dir)
+    try:
+        chunk_job = dict(job, clip=chunk_clip(job, start, count, chunk_dir))
+    except (OSError, y4m_reader.Y4mError) as e:
+        return (None, str(e), None)
+    (command, encoded_files) = encoder_command(chunk_job, chunk_dir)
+    # Chunks are concatenated as IVF, whatever the job's container is.
+    command = command + chunking.IVF_PARAMS.get(job['encoder'], [])
+    (passes, output) = run_encoder_passes(job, command)
+    if passes is None:
+        output = "> %s\n%s" % (" ".join(command), output)
+    return (passes, output, encoded_files[0]['filename'])
+
+
+def run_chunks(job, encoded_files, job_temp_dir):
+    # Encodes the chunks of a job, up to --chunk-workers at a time on the
+    # job's cores, and concatenates them into the job's encoded file. Returns
+    # the usage of every pass summed over all chunks, or None if a chunk
+    # failed, together with the output of all chunks.
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.chunk_workers,
+            thread_name_prefix='chunk') as executor:
+        chunks = list(
+            executor.map(
+                lambda chunk: encode_chunk(job, job_temp_dir, *chunk),
+                job['chunks']))
+    output = ''.join(chunk_output for (_, chunk_output, _) in chunks)
+    if any(chunk_passes is None for (chunk_passes, _, _) in chunks):
+        return (None, output)
+    try:
+        with tracing.span('concatenate chunks', 'encode',
+                          {'job': job_to_string(job)}):
+            chunking.concatenate_ivf(
+                [encoded_file for (_, _, encoded_file) in chunks],
+                encoded_files[0]['filename'])
+    except (OSError, chunking.ChunkError) as e:
+        return (None, output + str(e))
+    passes = []
+    for chunk_passes in zip(*(p for (p, _, _) in chunks)):
+        encode_pass = resource_usage.combine(chunk_passes) or {}
+        encode_pass['wall-time-ms'] = sum(
+            chunk_pass['wall-time-ms'] for chunk_pass in chunk_passes)
+        passes.append(encode_pass)
+    for (_, _, encoded_file) in chunks:
+        shutil.rmtree(os.path.dirname(encoded_file))
+    return (passes, output)
+
+
+def decode_layers(job, encoder_command, job_temp_dir, results):
+    for (results_dict, layer) in zip(results, encoder_command[1]):
+        (layer['decoded-file'], layer['decoder-framestats'],
+         usage) = decode_file(job, job_temp_dir, layer['filename'])
+        resource_usage.add_stats(results_dict, 'decode', usage)
+
+
+def measure_layers(job, encoder_command, job_temp_dir, results):
+    for (results_dict, layer) in zip(results, encoder_command[1]):
+        generate_metrics(results_dict, job, scratch.small_dir(job_temp_dir),
+                         layer)
+
+
+def finish_job(job, encoder_command, job_temp_dir, results, output,
+               encoded_file_dir):
+    encoded_files = encoder_command[1]
+    if 'cache_key' in job:
+        result_cache.store_results(
+            args.cache_dir, job['cache_key'], results, output,
+            encoded_files if args.cache_bitstreams else None)
+
+    for layer in encoded_files:
         if encoded_file_dir:
-            param = job['qp_value'] if job['param'] == 'qp' else job[
-                'target_bitrates_kbps'][-1]
-            encoded_file_pattern = "%s-%s-%s-%dsl%dtl-%d-sl%d-tl%d%s" % (
-                os.path.splitext(os.path.basename(clip['input_file']))[0],
-                job['encoder'], job['codec'], job['num_spatial_layers'],
-                job['num_temporal_layers'], param, layer['spatial-layer'],
-                layer['temporal-layer'], os.path.splitext(layer['filename'])[1])
-            shutil.move(layer['filename'],
-                        os.path.join(encoded_file_dir, encoded_file_pattern))
+            shutil.move(
+                layer['filename'],
+                os.path.join(encoded_file_dir, encoded_file_name(job, layer)))
         else:
             os.remove(layer['filename'])
 
-    shutil.rmtree(job_temp_dir)
-
-    return (results, output)
-
 
 def find_qp():
     if args.single_datapoint:
@@ -456,106 +1213,604 @@ def split_temporal_bitrates_kbps(target_bitrate_kbps, num_temporal_layers):
     return bitrates_kbps
 
 
-def generate_jobs(args, temp_dir):
-    jobs = []
-    for clip in args.clips:
+def clip_window(args, clip):
+    # Returns the frame offset and number of frames selected from the clip.
+    return clip.get('frame_window', (args.frame_offset, args.num_frames))
 
-        params = find_bitrates(
-            clip['width'],
-            clip['height']) if args.enable_bitrate else find_qp()
 
-        for param in params:
-            for (encoder, codec) in args.encoders:
+def clip_job_count(args, clip):
+    # Preview segments are only planned once a clip is prepared, all of them
+    # are assumed until then.
+    segments = args.preview_segments if args.preview else 1
+    return len(clip_job_params(args, clip)) * segments
 
-                job = {
-                    'encoder': encoder,
-                    'codec': codec,
-                    'clip': clip,
-                    'num_spatial_layers': args.num_spatial_layers,
-                    'num_temporal_layers': args.num_temporal_layers,
-                }
-
-                if args.enable_bitrate:
-                    job.update({
-                        'param':
-                            'bitrate',
-                        'qp_value':
-                            -1,
-                        'target_bitrates_kbps':
-                            split_temporal_bitrates_kbps(
-                                param, args.num_temporal_layers)
-                    })
-                else:
-                    job.update({
-                        'param': 'qp',
-                        'qp_value': param,
-                        'target_bitrates_kbps': []
-                    })
-
-                job_temp_dir = tempfile.mkdtemp(dir=temp_dir)
-                (command, encoded_files) = get_encoder_command(job['encoder'])(
-                    job, job_temp_dir)
-                full_command = find_absolute_path(args.use_system_path,
-                                                  command[0])
-                command = [
-                    full_command if word == command[0] else word
-                    for word in command
-                ]
-                jobs.append((job, (command, encoded_files), job_temp_dir))
+
+def clip_params(args, clip):
+    params = find_bitrates(
+        clip['width'], clip['height']) if args.enable_bitrate else find_qp()
+    if args.rate_search:
+        # Searches start at both ends of the grid.
+        return [min(params), max(params)]
+    return params
+
+
+def job_shard_key(args, clip, encoder, codec, param):
+    return sharding.job_key(
+        clip, encoder, codec,
+        "%dsl%dtl" % (args.num_spatial_layers, args.num_temporal_layers), param)
+
+
+def clip_job_params(args, clip):
+    # Returns (param, encoder, codec) for every job of the clip that is part
+    # of this run's shard.
+    return [(param, encoder, codec)
+            for param in clip_params(args, clip)
+            for (encoder, codec) in args.encoders
+            if shard_jobs is None or
+            job_shard_key(args, clip, encoder, codec, param) in shard_jobs]
+
+
+def plan_shard(args):
+    # Partitions the jobs of all clips into --shard's number of shards.
+    # Costs are estimated without timing history, which differs between
+    # machines. Returns the fingerprint of the whole job matrix and the keys
+    # of the jobs in this run's shard.
+    (shard, num_shards) = args.shard
+    weighted_keys = []
+    for clip in args.clips:
+        if clip['probed_frames'] is not None:
+            num_frames = yuv_reader.frame_window(clip['probed_frames'],
+                                                 args.frame_offset,
+                                                 args.num_frames)[1]
+        else:
+            num_frames = args.num_frames
+        megapixel_frames = clip['width'] * clip['height'] * max(num_frames,
+                                                                1) / 1000000.0
+        for param in clip_params(args, clip):
+            for (encoder, codec) in args.encoders:
+                weight = job_scheduler.encoder_weight(
+                    {
+                        'encoder': encoder,
+                        'codec': codec
+                    }, {})
+                weighted_keys.append(
+                    (job_shard_key(args, clip, encoder, codec, param),
+                     megapixel_frames * weight))
+    shards = sharding.assign_shards(weighted_keys, num_shards)
+    return (sharding.matrix_id(shards.keys()),
+            set(key for (key, index) in shards.items() if index == shard))
+
+
+def generate_jobs(args, clip, job_params=None):
+    # Returns the jobs of `job_params`, (param, encoder, codec) tuples that
+    # default to the clip's jobs in this run.
+    jobs = []
+    if job_params is None:
+        job_params = clip_job_params(args, clip)
+    for (param, encoder, codec) in job_params:
+        job = {
+            'encoder': encoder,
+            'codec': codec,
+            'clip': clip,
+            'num_spatial_layers': args.num_spatial_layers,
+            'num_temporal_layers': args.num_temporal_layers,
+            'shard_key': job_shard_key(args, clip, encoder, codec, param),
+            'rate_point': param,
+        }
+        job.update(rate_params(args, param))
+
+        if 'chunks' in clip and encoder in chunking.CHUNKED_ENCODERS:
+            job['chunks'] = clip['chunks']
+
+        job_temp_dir = scratch.plan_dir()
+        command = encoder_command(job, job_temp_dir)
+        if 'chunks' in job:
+            command = (command[0], chunking.ivf_encoded_files(command[1]))
+        if args.reuse_first_pass and encoder in FIRST_PASS_STAT_ARGS and \
+                'chunks' not in job:
+            (frame_offset, num_frames) = clip_window(args, clip)
+            job['first_pass_key'] = result_cache.first_pass_key(
+                clip, frame_offset, num_frames,
+                encoder_passes(command[0])[0], job_temp_dir)
+        scratch.park(job_temp_dir)
+        jobs.append((job, command, job_temp_dir))
     return jobs
 
 
-def start_daemon(func):
-    t = threading.Thread(target=func)
+def rate_params(args, param):
+    # Job fields of a QP or target bitrate.
+    if args.enable_bitrate:
+        return {
+            'param':
+                'bitrate',
+            'qp_value':
+                -1,
+            'target_bitrates_kbps':
+                split_temporal_bitrates_kbps(param, args.num_temporal_layers)
+        }
+    return {'param': 'qp', 'qp_value': param, 'target_bitrates_kbps': []}
+
+
+def encoder_command(job, job_temp_dir):
+    (command, encoded_files) = get_encoder_command(job['encoder'])(
+        job, job_temp_dir)
+    full_command = find_absolute_path(args.use_system_path, command[0])
+    command = [
+        full_command if word == command[0] else word for word in command
+    ]
+    return (command, encoded_files)
+
+
+def start_daemon(func, name=None):
+    t = threading.Thread(target=tracing.profiled(func), name=name)
     t.daemon = True
     t.start()
     return t
 
 
 def job_to_string(job):
+    clip = job['clip']
     param = ":".join(str(i) for i in job['target_bitrates_kbps']
                     ) if job['param'] == 'bitrate' else job['qp_value']
+    clip_name = os.path.basename(clip['input_file'])
+    if 'preview_segment' in clip:
+        clip_name += "[%d:%d]" % (clip['frame_start'],
+                                  clip['frame_start'] + clip['frame_count'])
+    if 'chunks' in job:
+        clip_name += " %s-chunks:%d" % (args.chunked, args.chunk_frames)
     return "%s:%s %dsl%dtl %s %s" % (
         job['encoder'], job['codec'], job['num_spatial_layers'],
-        job['num_temporal_layers'], param,
-        os.path.basename(job['clip']['input_file']))
+        job['num_temporal_layers'], param, clip_name)
+
+
+def acquire_cores(num_cores):
+    global free_cores
+    with thread_lock:
+        while len(free_cores) < num_cores:
+            thread_lock.wait()
+        cores = free_cores[-num_cores:]
+        del free_cores[-num_cores:]
+    return cores
+
+
+def release_cores(cores):
+    global free_cores
+    with thread_lock:
+        free_cores += cores
+        thread_lock.notify_all()
+
+
+def stage_deadline(timeout):
+    return None if timeout is None else time.time() + timeout
+
+
+def run_stage(stage_func,
+              job,
+              command,
+              job_temp_dir,
+              results,
+              num_cores=1,
+              timeout=None):
+    # Runs a decode or metric stage of a job on reserved cores, killing its
+    # processes after `timeout` seconds. Returns an error message if the stage
+    # failed.
+    with tracing.span('wait for cores', tracing.WAIT_CATEGORY):
+        job['cores'] = acquire_cores(num_cores)
+    start_time = time.time()
+    job['deadline'] = stage_deadline(timeout)
+    try:
+        with tracing.span(stage_func.__name__.replace('_', ' '), 'stage',
+                          {'job': job_to_string(job)}):
+            stage_func(job, command, job_temp_dir, results)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        job['transient_failure'] = process_control.is_transient(e)
+        return "> %s\n%s" % (" ".join(str(arg) for arg in e.cmd), e.output
+                              if e.output else e)
+    except OSError as e:
+        return str(e)
+    finally:
+        job['job_seconds'] += time.time() - start_time
+        release_cores(job['cores'])
+    return None
 
 
-def worker():
-    global args
-    global jobs
-    global current_job
-    global has_errored
-    global total_jobs
-    pp = pprint.PrettyPrinter(indent=2)
+def encode_worker():
+    global free_cores
+    global active_jobs
     while True:
+        wait_start = time.time()
         with thread_lock:
-            if not jobs:
-                return
-            (job, command, job_temp_dir) = jobs.pop()
+            while True:
+                if process_control.cancelled:
+                    return
+                # Running jobs may be retried, or lead to more rate points.
+                if not jobs and not preparing_clips and not active_jobs and \
+                        not rate_search_running():
+                    return
+                if shared_queue:
+                    next_job = claim_fitting_job()
+                else:
+                    next_job = job_scheduler.pop_fitting_job(
+                        jobs, len(free_cores), scratch.available_bytes(),
+                        first_pass_ready)
+                if next_job:
+                    break
+                # Wait for running jobs to release enough cores or scratch
+                # space or to be retried, or for more clips to be prepared or
+                # rate points to be searched. Jobs held by other workers are
+                # polled for in case their workers went stale.
+                thread_lock.wait(
+                    work_queue.POLL_SECONDS if shared_queue else None)
+            (job, command, job_temp_dir) = next_job
+            job['cores'] = [free_cores.pop() for i in range(job['core_demand'])]
+            scratch.admit(job_temp_dir, job['scratch_bytes'])
+            reserve_first_pass(job, job_temp_dir)
+            active_jobs += 1
+
+        start_time = time.time()
+        tracing.add_span('wait for job', tracing.WAIT_CATEGORY, wait_start,
+                         start_time)
+        job['deadline'] = stage_deadline(args.encode_timeout)
+        try:
+            with tracing.span('encode', 'encode',
+                              {'job': job_to_string(job)}):
+                (results, output) = run_command(job, command, job_temp_dir,
+                                                args.encoded_file_dir)
+        except OSError as e:
+            # Such as failing to restore cached files, the job fails but the
+            # worker keeps running.
+            (results, output) = (None, str(e))
+        finally:
+            job['job_seconds'] = time.time() - start_time
+            release_cores(job['cores'])
+            finish_first_pass(job)
+
+        if results is None or job.get('cached'):
+            report_job(job, command, job_temp_dir, results, output)
+            continue
+        with tracing.span('wait for queue', tracing.WAIT_CATEGORY):
+            if args.stream_decoded:
+                # Decoding is part of the metric stage when streaming.
+                metric_queue.put((job, command, job_temp_dir, results, output))
+            else:
+                decode_queue.put((job, command, job_temp_dir, results, output))
 
-        (results, error) = run_command(job, command, job_temp_dir,
-                                       args.encoded_file_dir)
 
-        job_str = job_to_string(job)
+def decode_worker():
+    while True:
+        with tracing.span('wait for queue', tracing.WAIT_CATEGORY):
+            task = decode_queue.get()
+        if task is None:
+            return
+        (job, command, job_temp_dir, results, output) = task
+        error = run_stage(decode_layers,
+                          job,
+                          command,
+                          job_temp_dir,
+                          results,
+                          timeout=args.decode_timeout)
+        if error:
+            report_job(job, command, job_temp_dir, None, error)
+        else:
+            with tracing.span('wait for queue', tracing.WAIT_CATEGORY):
+                metric_queue.put(task)
+
+
+def metric_worker():
+    while True:
+        with tracing.span('wait for queue', tracing.WAIT_CATEGORY):
+            task = metric_queue.get()
+        if task is None:
+            return
+        (job, command, job_temp_dir, results, output) = task
+        # The decoder runs next to the metric tools when streaming.
+        num_cores = 1
+        if args.stream_decoded:
+            num_cores = min(3 if args.enable_vmaf else 2, args.core_budget)
+        error = run_stage(measure_layers, job, command, job_temp_dir, results,
+                          num_cores, args.metric_timeout)
+        if error:
+            report_job(job, command, job_temp_dir, None, error)
+            continue
+        try:
+            finish_job(job, command, job_temp_dir, results, output,
+                       args.encoded_file_dir)
+        except OSError as e:
+            report_job(job, command, job_temp_dir, None, str(e))
+            continue
+        report_job(job, command, job_temp_dir, results, output)
+
+
+def retry_job(job, command, job_temp_dir, error):
+    # Puts a job that failed in a way that may not happen again back in line.
+    # Must be called with thread_lock held.
+    global active_jobs
+    job['attempt'] = job.get('attempt', 0) + 1
+    print("[%d/%d] %s (RETRY %d/%d)" % (current_job, total_jobs,
+                                        job_to_string(job), job['attempt'],
+                                        args.retries))
+    print(error)
+    scratch.release(job_temp_dir, job['scratch_bytes'])
+    active_jobs -= 1
+    job.pop('first_pass_reused', None)
+    job.pop('transient_failure', None)
+    jobs[:] = job_scheduler.longest_first(jobs +
+                                          [(job, command, job_temp_dir)])
+    thread_lock.notify_all()
+
+
+def report_job(job, command, job_temp_dir, results, error):
+    global current_job
+    global has_errored
+    global active_jobs
+    job_str = job_to_string(job)
+
+    with thread_lock, tracing.span('report', 'output', {'job': job_str}):
+        if process_control.cancelled:
+            # Processes of the job were killed, it runs again on --resume.
+            return
+        run_ok = results is not None
+        if not run_ok and job.get('transient_failure') and \
+                job.get('attempt', 0) < args.retries:
+            retry_job(job, command, job_temp_dir, error)
+            return
+        current_job += 1
+        status = "OK" if run_ok else "ERROR"
+        if job.get('cached'):
+            status = "CACHED"
+        print("[%d/%d] %s (%s)" % (current_job, total_jobs, job_str, status))
+        if not run_ok:
+            has_errored = True
+            print(error)
+        else:
+            if not job.get('cached'):
+                (frame_offset, num_frames) = clip_window(args, job['clip'])
+                job_scheduler.record_timing(timing_history, job,
+                                            frame_offset, num_frames,
+                                            job['job_seconds'])
+            for result in results:
+                results_io.write_result(out_file, result, args.out_format)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+            job_journal.append_entry(
+                journal_file, job_str,
+                journal_command(job, command, job_temp_dir), out_file.tell(),
+                job['shard_key'])
+        if shared_queue and not shared_queue.finish(
+                job['shard_key'], results, None if run_ok else error):
+            print("Job was reclaimed by another worker, dropped its results "
+                  "from the work queue.")
+        scratch.release(job_temp_dir, job['scratch_bytes'])
+        active_jobs -= 1
+        # Workers may wait for scratch space.
+        thread_lock.notify_all()
+        if id(job['clip']) in rate_searches:
+            continue_rate_search(job, results)
+
+
+def journal_command(job, encoder_command, job_temp_dir):
+    # Temporary paths differ between runs, use the same stable form of the
+    # command as the result cache.
+    return result_cache.normalize_command(encoder_command[0], job_temp_dir,
+                                          job['clip'])
+
+
+def work_queue_config(args):
+    # Options that change the results of a job with a given key.
+    config = {
+        'frame-offset': args.frame_offset,
+        'num-frames': args.num_frames,
+        'enable-bitrate': args.enable_bitrate,
+        'single-datapoint': args.single_datapoint,
+        'enable-vmaf': args.enable_vmaf,
+        'metrics-backend': args.metrics_backend,
+    }
+    if args.chunked:
+        config['chunked'] = [args.chunked, args.chunk_frames]
+    return config
+
+
+def open_output():
+    # Returns the output and journal files, as well as the journal keys of
+    # jobs that are already finished.
+    if not args.resume or not os.path.isfile(args.out):
+        return (open(args.out, 'w'), open(args.journal, 'w'), set())
+
+    (finished, out_offset) = job_journal.load_journal(args.journal)
+    if os.path.getsize(args.out) < out_offset:
+        sys.exit("ERROR: '%s' is shorter than recorded in '%s', cannot resume."
+                 % (args.out, args.journal))
+    # Drop results that were written after the last journaled job, as well
+    # as the closing bracket of a previously completed run.
+    os.truncate(args.out, out_offset)
+    print("Resuming, skipping finished jobs...")
+    return (open(args.out, 'a'), open(args.journal, 'a'), finished)
+
+
+def remaining_jobs(clip_jobs, finished):
+    remaining = []
+    for (job, command, job_temp_dir) in clip_jobs:
+        if job_journal.journal_key(
+                job_to_string(job),
+                journal_command(job, command, job_temp_dir)) not in finished:
+            remaining.append((job, command, job_temp_dir))
+    return remaining
+
+
+def unfinished_queue_jobs(clip_jobs):
+    # Publishes jobs to the work queue and returns those that no worker has
+    # finished yet.
+    keys = [job['shard_key'] for (job, _, _) in clip_jobs]
+    shared_queue.publish(keys)
+    states = shared_queue.states(keys)
+    unfinished = []
+    for (job, command, job_temp_dir) in clip_jobs:
+        if states.get(job['shard_key']) not in [
+                work_queue.DONE, work_queue.FAILED
+        ]:
+            unfinished.append((job, command, job_temp_dir))
+    return unfinished
+
+
+def claim_fitting_job():
+    # Claims the most expensive job that fits in the free cores and scratch
+    # space from the work queue. Jobs finished by other workers are dropped,
+    # jobs held by other workers are kept as they are reclaimed if their
+    # worker goes stale. Must be called with thread_lock held.
+    global total_jobs
+    for i in reversed(range(len(jobs))):
+        (job, command, job_temp_dir) = jobs[i]
+        if job['core_demand'] > len(free_cores) or \
+                job['scratch_bytes'] > scratch.available_bytes() or \
+                not first_pass_ready(job):
+            continue
+        # Retried jobs are still claimed by this worker.
+        if job.get('attempt') or shared_queue.claim(job['shard_key']):
+            return jobs.pop(i)
+        state = shared_queue.states([job['shard_key']]).get(job['shard_key'])
+        if state in [work_queue.DONE, work_queue.FAILED]:
+            del jobs[i]
+            total_jobs -= 1
+    return None
 
-        with thread_lock:
-            current_job += 1
-            run_ok = results is not None
-            print(
-                "[%d/%d] %s (%s)" %
-                (current_job, total_jobs, job_str, "OK" if run_ok else "ERROR"))
-            if not run_ok:
-                has_errored = True
-                print(error)
-            else:
-                for result in results:
-                    args.out.write(pp.pformat(result))
-                    args.out.write(',\n')
-                args.out.flush()
 
+def first_pass_ready(job):
+    # Jobs whose first pass another job is running wait for it without
+    # holding cores. Must be called with thread_lock held.
+    shared = first_passes.get(job.get('first_pass_key'))
+    return shared is None or shared['ok']
 
-thread_lock = threading.Lock()
+
+def heartbeat_worker():
+    while True:
+        time.sleep(work_queue.HEARTBEAT_SECONDS)
+        shared_queue.heartbeat()
+
+
+def rate_search_running():
+    return any(not search.done() for search in rate_searches.values())
+
+
+def search_jobs(search, clip, job_params):
+    # Returns the jobs of the rate points a search asks for. Points finished
+    # by an interrupted run are fed back to the search right away.
+    clip_jobs = []
+    while job_params:
+        new_jobs = generate_jobs(args, clip, job_params)
+        job_params = []
+        for (job, command, job_temp_dir) in new_jobs:
+            key = job_journal.journal_key(
+                job_to_string(job), journal_command(job, command,
+                                                    job_temp_dir))
+            if key not in resumed_results:
+                clip_jobs.append((job, command, job_temp_dir))
+                continue
+            job_params += search.add_result(
+                job['rate_point'], job['encoder'], job['codec'],
+                rate_search.result_quality(resumed_results[key]))
+    return clip_jobs
+
+
+def continue_rate_search(job, results):
+    # Adds the jobs of the next rate points of a job's clip. Must be called
+    # with thread_lock held.
+    global total_jobs
+    search = rate_searches[id(job['clip'])]
+    job_params = search.add_result(job['rate_point'], job['encoder'],
+                                   job['codec'],
+                                   rate_search.result_quality(results))
+    clip_jobs = search_jobs(search, job['clip'], job_params)
+    schedule_jobs(clip_jobs)
+    total_jobs += len(clip_jobs)
+    jobs[:] = job_scheduler.longest_first(jobs + clip_jobs)
+    # Workers wait for searches to finish before exiting.
+    thread_lock.notify_all()
+
+
+def schedule_jobs(clip_jobs):
+    for (job, command, job_temp_dir) in clip_jobs:
+        (frame_offset, num_frames) = clip_window(args, job['clip'])
+        job['estimated_cost'] = job_scheduler.estimate_cost(
+            job, frame_offset, num_frames, timing_history)
+        job['core_demand'] = job_scheduler.core_demand(
+            job, command[0], args.core_budget)
+        job['scratch_bytes'] = job_scratch_bytes(job)
+
+
+def job_scratch_bytes(job):
+    # Estimated size of the files in a job's directory.
+    clip = job['clip']
+    raw_bytes = clip['frame_count'] * yuv_reader.frame_size(
+        clip['width'], clip['height'])
+    # Every layer is decoded, unless decoded frames are streamed.
+    decoded_layers = 0 if args.stream_decoded else \
+        job['num_spatial_layers'] * job['num_temporal_layers']
+    copies = 0
+    if 'chunks' in job:
+        # Chunks are encoded before being concatenated, and chunks of encoders
+        # that read .y4m files read copies of the frames.
+        copies = scratch_space.ENCODED_FRACTION
+        if get_encoder_input(job['encoder']) == 'y4m':
+            copies += 1
+    return scratch_space.estimate_bytes(raw_bytes, decoded_layers, copies)
+
+
+def dispatch_clips(temp_dir, finished):
+    # Adds the jobs of every clip to the job list as soon as the clip is
+    # prepared, so that encoding starts before all clips are ready. Returns
+    # all dispatched jobs.
+    global total_jobs
+    global has_errored
+    global preparing_clips
+    dispatched_jobs = []
+    for (clip, error) in prepare_clips(args, temp_dir):
+        num_clip_jobs = clip_job_count(args, clip)
+        if error is not None:
+            with thread_lock:
+                has_errored = True
+                total_jobs -= num_clip_jobs
+            continue
+        if args.rate_search:
+            search = rate_search.ClipSearch(args.encoders,
+                                            clip_params(args, clip),
+                                            args.rate_points,
+                                            args.enable_bitrate)
+            with thread_lock:
+                rate_searches[id(clip)] = search
+                clip_jobs = search_jobs(search, clip, search.start())
+        else:
+            clip_jobs = []
+            for segment in clip.get('segments', [clip]):
+                clip_jobs += remaining_jobs(
+                    generate_jobs(args, segment), finished)
+        if shared_queue and clip_jobs:
+            clip_jobs = unfinished_queue_jobs(clip_jobs)
+        schedule_jobs(clip_jobs)
+        dispatched_jobs += clip_jobs
+        with thread_lock:
+            total_jobs -= num_clip_jobs - len(clip_jobs)
+            jobs[:] = job_scheduler.longest_first(jobs + clip_jobs)
+            thread_lock.notify_all()
+    with thread_lock:
+        preparing_clips = False
+        thread_lock.notify_all()
+    return dispatched_jobs
+
+
+thread_lock = threading.Condition()
+# Keys of the jobs to run when running a single shard.
+shard_jobs = None
+# Work queue shared with other workers when running with --worker.
+shared_queue = None
+# Rate searches of clips by clip id, and results of jobs finished by an
+# interrupted run by journal key, with --rate-search.
+rate_searches = {}
+resumed_results = {}
+# First passes shared between rate points with --reuse-first-pass, by first
+# pass key.
+first_passes = {}
+# Jobs admitted to run that haven't been reported yet.
+active_jobs = 0
 
 
 def main():
@@ -564,25 +1819,96 @@ def main():
     global total_jobs
     global current_job
     global has_errored
+    global out_file
+    global journal_file
+    global timing_history
+    global free_cores
+    global decode_queue
+    global metric_queue
+    global preparing_clips
+    global shard_jobs
+    global shared_queue
+    global scratch
 
     temp_dir = tempfile.mkdtemp()
 
     args = parser.parse_args()
-    prepare_clips(args, temp_dir)
-    jobs = generate_jobs(args, temp_dir)
-    total_jobs = len(jobs)
+    scratch = scratch_space.ScratchSpace(
+        temp_dir, args.scratch_budget and args.scratch_budget * 1e9,
+        args.scratch_small_dir)
+    if args.trace:
+        tracing.enable()
+    if args.profile:
+        tracing.enable_profiling()
+    if args.clip_manifest:
+        try:
+            entries = clip_manifest.load(args.clip_manifest)
+        except (OSError, clip_manifest.ManifestError) as e:
+            parser.error("can't load clip manifest: %s" % e)
+        tags = args.clip_tags.split(',') if args.clip_tags else []
+        entries = clip_manifest.filter_tags(entries, tags)
+        args.clips += [clip_manifest.entry_clip(entry) for entry in entries]
+    if not args.clips:
+        parser.error('no clips given, supply clips or --clip-manifest')
+    if args.worker and not args.queue_dir:
+        parser.error('--worker requires --queue-dir')
+    if args.worker and args.shard:
+        parser.error('--worker and --shard are exclusive')
+    if args.shard or args.worker:
+        duplicates = sharding.duplicate_clip_names(args.clips)
+        if duplicates:
+            parser.error('jobs of --shard and --worker runs are identified by '
+                         'clip file names, which must be unique: %s' %
+                         ', '.join(duplicates))
+    if args.rate_search and (args.shard or args.worker or
+                             args.single_datapoint):
+        parser.error('--rate-search picks rate points as results come in, '
+                     "it can't be combined with --shard, --worker or "
+                     '--single-datapoint')
+    if args.preview and (args.shard or args.worker or args.rate_search):
+        parser.error("--preview can't be combined with --shard, --worker or "
+                     '--rate-search')
+    if args.preview and args.num_frames <= 0:
+        args.num_frames = preview.DEFAULT_SEGMENT_FRAMES
+    if args.journal is None:
+        args.journal = args.out + '.journal'
+    args.out_format = results_io.output_format(args.out, args.out_format)
+    if args.hash_cache:
+        file_hashes.load(args.hash_cache)
+    if args.clip_manifest:
+        clip_manifest.add_hashes(entries)
+    if args.decode_workers is None:
+        args.decode_workers = max(1, args.workers // 2)
+    if args.metric_workers is None:
+        args.metric_workers = max(1, args.workers // 2)
+    if args.shard:
+        (matrix, shard_jobs) = plan_shard(args)
+        args.clips = [
+            clip for clip in args.clips if clip_job_params(args, clip)
+        ]
+    total_jobs = sum(clip_job_count(args, clip) for clip in args.clips)
     current_job = 0
     has_errored = False
 
     if args.dump_commands:
-        for (job, (command, encoded_files), job_temp_dir) in jobs:
-            current_job += 1
-            print("[%d/%d] %s" % (current_job, total_jobs, job_to_string(job)))
-            print("> %s" % " ".join(command))
-            print()
-
+        errors = {
+            id(clip): error for (clip, error) in prepare_clips(args, temp_dir)
+        }
+        for clip in args.clips:
+            if errors[id(clip)] is not None:
+                continue
+            for segment in clip.get('segments', [clip]):
+                for (job, (command, encoded_files),
+                     job_temp_dir) in generate_jobs(args, segment):
+                    current_job += 1
+                    print("[%d/%d] %s" %
+                          (current_job, total_jobs, job_to_string(job)))
+                    print("> %s" % " ".join(command))
+                    print()
+
+        scratch.cleanup()
         shutil.rmtree(temp_dir)
-        return 0
+        return 1 if any(errors.values()) else 0
 
     # Make sure commands for quality metrics are present.
     find_absolute_path(False, binary_vars.TINY_SSIM_BIN)
@@ -596,15 +1922,96 @@ def main():
     if args.enable_vmaf:
         find_absolute_path(False, binary_vars.VMAF_BIN)
 
-    print("[0/%d] Running jobs..." % total_jobs)
+    if args.worker:
+        try:
+            shared_queue = work_queue.WorkQueue(args.queue_dir,
+                                                work_queue_config(args))
+        except work_queue.WorkQueueError as e:
+            sys.exit("ERROR: %s" % e)
+        start_daemon(heartbeat_worker, 'heartbeat')
+
+    (out_file, journal_file, finished) = open_output()
+    if args.rate_search and finished:
+        for (entry, results) in job_journal.read_results(
+                args.out, args.journal):
+            resumed_results[job_journal.journal_key(
+                entry['job'], entry['command'])] = results
+    if args.shard:
+        sharding.write_plan(sharding.plan_filename(args.out), args.shard[0],
+                            args.shard[1], matrix, shard_jobs)
+    timing_history = job_scheduler.load_history(args.timing_history)
 
-    args.out.write('[')
-
-    workers = [start_daemon(worker) for i in range(args.workers)]
-    [t.join() for t in workers]
+    print("[0/%d] Running jobs..." % total_jobs)
 
-    args.out.write(']\n')
+    if out_file.tell() == 0:
+        results_io.write_header(out_file, args.out_format)
+        out_file.flush()
 
+    jobs = []
+    preparing_clips = True
+    free_cores = job_scheduler.core_slots(args.core_budget)
+    start_time = time.time()
+    # Encoding, decoding and metric computation run in separate worker pools
+    # connected by bounded queues, so that encoders keep running while
+    # earlier jobs are decoded and measured. Encode workers start on the jobs
+    # of each clip as soon as it is prepared.
+    decode_queue = queue.Queue(maxsize=2 * args.decode_workers)
+    metric_queue = queue.Queue(maxsize=2 * args.metric_workers)
+    encode_workers = [
+        start_daemon(encode_worker, 'encode-%d' % i)
+        for i in range(args.workers)
+    ]
+    decode_workers = [
+        start_daemon(decode_worker, 'decode-%d' % i)
+        for i in range(args.decode_workers)
+    ]
+    metric_workers = [
+        start_daemon(metric_worker, 'metric-%d' % i)
+        for i in range(args.metric_workers)
+    ]
+    try:
+        dispatched_jobs = tracing.profiled(dispatch_clips)(temp_dir, finished)
+        # Predicted as if all clips had been prepared at the start.
+        predicted_makespan = job_scheduler.predict_makespan(
+            [(job['estimated_cost'], job['core_demand'])
+             for (job, _, _) in reversed(job_scheduler.longest_first(
+                 dispatched_jobs))], args.workers, args.core_budget)
+        [t.join() for t in encode_workers]
+        [decode_queue.put(None) for t in decode_workers]
+        [t.join() for t in decode_workers]
+        [metric_queue.put(None) for t in metric_workers]
+        [t.join() for t in metric_workers]
+    except KeyboardInterrupt:
+        # Results of finished jobs are journaled, holding thread_lock keeps
+        # workers from reporting jobs whose processes are being killed.
+        with thread_lock:
+            process_control.cancel()
+            print("Interrupted, killed running jobs. Continue with --resume.")
+            out_file.close()
+            journal_file.close()
+            scratch.cleanup()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return 130
+    print("Predicted makespan: %.1fs, actual makespan: %.1fs" %
+          (predicted_makespan, time.time() - start_time))
+    job_scheduler.save_history(args.timing_history, timing_history)
+    file_hashes.save()
+    if args.trace:
+        tracing.save(args.trace)
+        tracing.print_summary()
+    if args.profile:
+        tracing.save_profile(args.profile)
+
+    results_io.write_footer(out_file, args.out_format)
+    out_file.close()
+    journal_file.close()
+    if shared_queue:
+        shared_queue.close()
+    if args.preview:
+        print("Estimate metrics and BD-rates of the preview with: "
+              "./preview_report.py %s" % args.out)
+
+    scratch.cleanup()
     shutil.rmtree(temp_dir)
     return 1 if has_errored else 0
 
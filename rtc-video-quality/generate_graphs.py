@@ -14,7 +14,6 @@
 # limitations under the License.
 
 import argparse
-import ast
 from pathlib import Path
 from visual_metrics import HandleFiles
 from collections import OrderedDict
@@ -22,6 +21,10 @@ import matplotlib.pyplot as plt
 import os
 import sys
 import re
+import chunking
+import preview
+import resource_usage
+import results_io
 
 layer_regex_pattern = re.compile(r"^(\d)sl(\d)tl$")
 
@@ -46,7 +49,7 @@ def formats(formats_list):
 parser = argparse.ArgumentParser(description='Generate graphs from data files.')
 parser.add_argument('graph_files',
                     nargs='+',
-                    metavar='graph_file.txt',
+                    metavar='graph_file.txt|graph_file.jsonl',
                     type=argparse.FileType('r'))
 parser.add_argument('--out-dir', required=True, type=writable_dir)
 parser.add_argument('--formats',
@@ -54,6 +57,9 @@ parser.add_argument('--formats',
                     metavar='png,svg',
                     help='comma-separated list of output formats',
                     default=['png', 'svg'])
+parser.add_argument('--resource-usage',
+                    action='store_true',
+                    help='report CPU time, peak memory and context switches')
 
 
 def split_data(graph_data, attribute):
@@ -69,7 +75,7 @@ def split_data(graph_data, attribute):
 def normalize_bitrate_config_string(config):
     return ":".join([str(int(x * 100.0 / config[-1])) for x in config])
 
-def generate_stt(data, output_dir=''):
+def generate_stt(data, output_dir='', show_resource_usage=False):
 
   metrics = [
           'vpx-ssim',
@@ -90,6 +96,8 @@ def generate_stt(data, output_dir=''):
           'vmaf',
           'psnr-dmos'
         ]
+  if show_resource_usage:
+    metrics += resource_usage.report_fields(data)
   encoder_codecs = set([(item['encoder'], item['codec']) for item in data])
   videos = set([item['input-file'] for item in data])
 
@@ -178,8 +186,28 @@ def main():
     graph_data = []
     generate_images = False
     for f in args.graph_files:
-        graph_data += ast.literal_eval(f.read())
-    generate_stt(graph_data, args.out_dir)
+        for result in results_io.read_results(f):
+            if preview.is_segment(result):
+                # Segments of a clip would be graphed as rate points of one
+                # curve.
+                sys.exit("ERROR: '%s' contains results of --preview segments, "
+                         "estimate results of the whole clips with "
+                         "./preview_report.py --out=estimates.txt %s and graph "
+                         "those instead." % (f.name, f.name))
+            if args.resource_usage:
+                result.update(resource_usage.flatten_passes(result))
+            # Chunked encodes are graphed as encoders of their own.
+            result['encoder'] = chunking.encoder_label(result)
+            if not generate_images:
+                # Per-frame data is only used for graph images and makes up
+                # most of the size of a result.
+                result = {
+                    key: value
+                    for (key, value) in result.items()
+                    if not isinstance(value, list)
+                }
+            graph_data.append(result)
+    generate_stt(graph_data, args.out_dir, args.resource_usage)
     #Generate images defined above, constant (change to true if images of graphs are wanted.)
     if not generate_images:
         return
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Generates (or regenerates) a clip manifest for use with
+# `generate_data.py --clip-manifest` from the clips found in directories. Tags
+# of clips already in the manifest are kept.
+
+import argparse
+import os
+import subprocess
+import sys
+
+import clip_manifest
+import file_hashes
+
+parser = argparse.ArgumentParser(
+    description='Generate a clip manifest from directories of clips.')
+parser.add_argument('directories', nargs='+', metavar='DIR')
+parser.add_argument('--out',
+                    required=True,
+                    metavar='manifest.json',
+                    help='written as CSV if ending in .csv')
+parser.add_argument('--tags',
+                    default='',
+                    help='comma-separated tags for clips new to the manifest')
+parser.add_argument('--yuv-fps',
+                    type=float,
+                    default=None,
+                    help='frame rate of .yuv clips, skipped otherwise')
+parser.add_argument('--hash-cache', default=None, metavar='sha1sums.json')
+
+
+def main():
+    args = parser.parse_args()
+    if args.hash_cache:
+        file_hashes.load(args.hash_cache)
+    previous_tags = {}
+    if os.path.isfile(args.out):
+        previous_entries = clip_manifest.load(args.out)
+        clip_manifest.add_hashes(previous_entries)
+        for entry in previous_entries:
+            previous_tags[entry['path']] = entry['tags']
+    new_tags = [tag for tag in args.tags.split(',') if tag]
+
+    entries = []
+    failed = False
+    for directory in args.directories:
+        for path in clip_manifest.find_clips(directory):
+            try:
+                entry = clip_manifest.probe_entry(path, args.yuv_fps)
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                print("%s (ERROR)\n%s" % (path, e))
+                failed = True
+                continue
+            if not entry:
+                print("%s (SKIPPED)" % path)
+                continue
+            entry['tags'] = previous_tags.get(entry['path'], new_tags)
+            entries.append(entry)
+            print("%s (OK)" % path)
+
+    clip_manifest.save(args.out, entries)
+    file_hashes.save()
+    print("Wrote %d clips to '%s'." % (len(entries), args.out))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
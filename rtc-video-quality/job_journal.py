@@ -0,0 +1,75 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Append-only journal of finished jobs. Every line is a JSON object naming a
+# job and the size the output file had after the job's results were written
+# to it, which lets an interrupted run drop partially-written results and
+# continue where it left off.
+
+import json
+import os
+
+import results_io
+
+
+def journal_key(job_str, command):
+    return "%s\n%s" % (job_str, " ".join(command))
+
+
+def read_entries(filename):
+    # Yields the entries of a journal, up to a partially written last line.
+    with open(filename) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line may be partially written if the run was killed.
+                break
+            yield entry
+
+
+def read_results(out_filename, journal_filename):
+    # Yields (entry, results) for every journaled job of an output file.
+    with open(out_filename, 'rb') as f:
+        data = f.read()
+    out_format = 'python' if data.lstrip().startswith(b'[') else 'jsonl'
+    out_offset = 0
+    for entry in read_entries(journal_filename):
+        text = data[out_offset:entry['out-offset']].decode('utf-8')
+        out_offset = entry['out-offset']
+        yield (entry, results_io.parse_results(text, out_format))
+
+
+def load_journal(filename):
+    finished = set()
+    out_offset = 0
+    if not os.path.isfile(filename):
+        return (finished, out_offset)
+    for entry in read_entries(filename):
+        finished.add(journal_key(entry['job'], entry['command']))
+        out_offset = max(out_offset, entry['out-offset'])
+    return (finished, out_offset)
+
+
+def append_entry(journal_file, job_str, command, out_offset, key):
+    # `key` identifies the job across shards (see sharding.py).
+    journal_file.write(
+        json.dumps({
+            'job': job_str,
+            'command': command,
+            'out-offset': out_offset,
+            'key': key
+        }) + '\n')
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
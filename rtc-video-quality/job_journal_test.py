@@ -0,0 +1,59 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import job_journal
+import results_io
+
+
+def write_run(tmp_path, keys):
+    out = str(tmp_path / 'out.jsonl')
+    journal = out + '.journal'
+    with open(out, 'w') as out_file, open(journal, 'w') as journal_file:
+        for key in keys:
+            results_io.write_result(out_file, {'job': key}, 'jsonl')
+            out_file.flush()
+            job_journal.append_entry(journal_file, key, ['enc', key],
+                                     out_file.tell(), key)
+    return (out, journal)
+
+
+def test_read_results(tmp_path):
+    (out, journal) = write_run(tmp_path, ['a', 'b'])
+    entries = list(job_journal.read_results(out, journal))
+    assert [entry['key'] for (entry, _) in entries] == ['a', 'b']
+    assert [results for (_, results) in entries] == [[{
+        'job': 'a'
+    }], [{
+        'job': 'b'
+    }]]
+
+
+def test_torn_last_line(tmp_path):
+    (out, journal) = write_run(tmp_path, ['a', 'b'])
+    with open(journal) as f:
+        lines = f.readlines()
+    # The run died while writing the entry of 'b', and results after the
+    # last complete entry are dropped on resume.
+    with open(journal, 'w') as f:
+        f.write(lines[0] + lines[1][:len(lines[1]) // 2])
+    (finished, out_offset) = job_journal.load_journal(journal)
+    assert finished == {job_journal.journal_key('a', ['enc', 'a'])}
+    with open(out) as f:
+        assert out_offset == len(f.readline())
+    assert [entry['key'] for entry in job_journal.read_entries(journal)
+           ] == ['a']
+
+
+def test_missing_journal(tmp_path):
+    assert job_journal.load_journal(str(tmp_path / 'none')) == (set(), 0)
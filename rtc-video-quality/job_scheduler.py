@@ -0,0 +1,166 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Job cost estimation and ordering. The cost of a job is estimated in seconds
+# as pixels * frames * a per-encoder weight. Weights start out as rough
+# defaults and are replaced by measured timings from earlier runs when a
+# timing history is available.
+
+import heapq
+import json
+import os
+
+from encoder_commands import ALL_CORES, get_encoder_threads
+
+# Seconds per megapixel-frame for a job (encode, decode and metrics) on a
+# single worker. These are only starting points, measured timings replace them.
+DEFAULT_ENCODER_WEIGHTS = {
+    'aom-good': 1.0,
+    'aom-rt': 0.05,
+    'aom-all_intra': 0.3,
+    'aom-offline': 2.0,
+    'rav1e-1pass': 0.3,
+    'rav1e-rt': 0.05,
+    'rav1e-all_intra': 0.3,
+    'rav1e-offline': 1.0,
+    'svt-1pass': 0.1,
+    'svt-rt': 0.05,
+    'svt-all_intra': 0.3,
+    'svt-offline': 1.0,
+    'openh264': 0.02,
+    'libvpx-rt': 0.03,
+    'yami': 0.02,
+}
+DEFAULT_WEIGHT = 0.5
+
+# Number of samples after which older timings stop dominating new ones.
+MAX_HISTORY_SAMPLES = 20
+
+
+def history_key(job):
+    return "%s:%s" % (job['encoder'], job['codec'])
+
+
+def load_history(filename):
+    if not filename or not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_history(filename, history):
+    if not filename:
+        return
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+    os.replace(temp_filename, filename)
+
+
+def job_frames(job, frame_offset, num_frames):
+    if num_frames > 0:
+        return num_frames
+    return max(job['clip']['input_total_frames'] - frame_offset, 1)
+
+
+def job_megapixel_frames(job, frame_offset, num_frames):
+    clip = job['clip']
+    return clip['width'] * clip['height'] * job_frames(
+        job, frame_offset, num_frames) / 1000000.0
+
+
+def encoder_weight(job, history):
+    entry = history.get(history_key(job))
+    if entry:
+        return entry['seconds-per-megapixel-frame']
+    return DEFAULT_ENCODER_WEIGHTS.get(job['encoder'], DEFAULT_WEIGHT)
+
+
+def estimate_cost(job, frame_offset, num_frames, history):
+    return job_megapixel_frames(job, frame_offset,
+                                num_frames) * encoder_weight(job, history)
+
+
+def record_timing(history, job, frame_offset, num_frames, seconds):
+    weight = seconds / job_megapixel_frames(job, frame_offset, num_frames)
+    entry = history.setdefault(history_key(job), {
+        'seconds-per-megapixel-frame': weight,
+        'samples': 0
+    })
+    samples = min(entry['samples'], MAX_HISTORY_SAMPLES - 1)
+    entry['seconds-per-megapixel-frame'] = (
+        entry['seconds-per-megapixel-frame'] * samples + weight) / (samples + 1)
+    entry['samples'] += 1
+
+
+def longest_first(jobs):
+    # Workers pop jobs from the end of the list, so sort in increasing cost.
+    return sorted(jobs, key=lambda job: job[0]['estimated_cost'])
+
+
+def predict_makespan(jobs, num_workers, core_budget):
+    # Simulates the worker pool on (cost, core demand) pairs given in dispatch
+    # order. Like the workers, it starts the first job that fits in the free
+    # cores whenever a worker is idle.
+    pending = list(jobs)
+    running = []
+    now = 0.0
+    num_free_cores = core_budget
+    while pending or running:
+        fitting = [i for (i, (cost, demand)) in enumerate(pending)
+                   if demand <= num_free_cores]
+        if fitting and len(running) < max(num_workers, 1):
+            (cost, demand) = pending.pop(fitting[0])
+            num_free_cores -= demand
+            heapq.heappush(running, (now + cost, demand))
+            continue
+        (now, demand) = heapq.heappop(running)
+        num_free_cores += demand
+    return now
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def core_slots(core_budget):
+    # One slot per core in the budget, named by the core it is pinned to. A
+    # budget larger than the number of cores shares cores between slots.
+    cores = available_cores()
+    return [cores[i % len(cores)] for i in range(core_budget)]
+
+
+def core_demand(job, command, core_budget):
+    threads = get_encoder_threads(job['encoder'], command)
+    if threads == ALL_CORES:
+        return core_budget
+    return min(threads, core_budget)
+
+
+def pop_fitting_job(jobs,
+                    num_free_cores,
+                    free_scratch_bytes=float('inf'),
+                    ready=None):
+    # Pops the most expensive job whose core demand fits in the free cores and
+    # whose scratch space fits in the free scratch space, skipping jobs for
+    # which `ready` returns False.
+    for i in reversed(range(len(jobs))):
+        job = jobs[i][0]
+        if job['core_demand'] <= num_free_cores and \
+                job.get('scratch_bytes', 0) <= free_scratch_bytes and \
+                (ready is None or ready(job)):
+            return jobs.pop(i)
+    return None
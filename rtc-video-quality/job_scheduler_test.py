@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import job_scheduler
+
+
+def make_job(encoder, cost=1.0, core_demand=1, scratch_bytes=0, width=640):
+    job = {
+        'encoder': encoder,
+        'codec': 'av1',
+        'clip': {
+            'width': width,
+            'height': 480,
+            'input_total_frames': 100
+        },
+        'estimated_cost': cost,
+        'core_demand': core_demand,
+        'scratch_bytes': scratch_bytes,
+    }
+    return (job, [encoder], None)
+
+
+def test_longest_first():
+    jobs = job_scheduler.longest_first(
+        [make_job('a', 2.0), make_job('b', 5.0), make_job('c', 1.0)])
+    # Workers pop from the end of the list.
+    popped = [job_scheduler.pop_fitting_job(jobs, 1)[0]['encoder']
+              for i in range(3)]
+    assert popped == ['b', 'a', 'c']
+    assert job_scheduler.pop_fitting_job(jobs, 1) is None
+
+
+def test_pop_fitting_job_skips_jobs_that_dont_fit():
+    jobs = job_scheduler.longest_first([
+        make_job('small', 1.0),
+        make_job('scratch', 2.0, scratch_bytes=100),
+        make_job('wide', 3.0, core_demand=4),
+        make_job('held', 4.0),
+    ])
+    ready = lambda job: job['encoder'] != 'held'
+    (job, _, _) = job_scheduler.pop_fitting_job(jobs, 2, 50, ready)
+    assert job['encoder'] == 'small'
+    (job, _, _) = job_scheduler.pop_fitting_job(jobs, 2, 100, ready)
+    assert job['encoder'] == 'scratch'
+    (job, _, _) = job_scheduler.pop_fitting_job(jobs, 4, 0, ready)
+    assert job['encoder'] == 'wide'
+    assert job_scheduler.pop_fitting_job(jobs, 4, 0, ready) is None
+
+
+def test_estimate_cost_uses_history():
+    (job, _, _) = make_job('svt-offline')
+    history = {}
+    default_cost = job_scheduler.estimate_cost(job, 0, 10, history)
+    assert default_cost == pytest.approx(
+        0.64 * 0.48 * 10 * job_scheduler.DEFAULT_ENCODER_WEIGHTS['svt-offline'])
+    job_scheduler.record_timing(history, job, 0, 10, default_cost * 3)
+    assert job_scheduler.estimate_cost(job, 0, 10,
+                                       history) == pytest.approx(default_cost *
+                                                                 3)
+
+
+def test_core_demand():
+    (job, _, _) = make_job('svt-offline')
+    assert job_scheduler.core_demand(job, ['SvtAv1EncApp', '--lp', '3'],
+                                     8) == 3
+    # Without --lp the encoder uses all cores, whatever the budget is.
+    assert job_scheduler.core_demand(job, ['SvtAv1EncApp'], 6) == 6
+    (job, _, _) = make_job('aom-good')
+    assert job_scheduler.core_demand(job, ['aomenc', '--threads=16'], 8) == 8
+
+
+def test_predict_makespan():
+    # Two workers, the wide job waits for both cores.
+    assert job_scheduler.predict_makespan([(2.0, 1), (1.0, 1), (3.0, 2)], 2,
+                                          2) == pytest.approx(5.0)
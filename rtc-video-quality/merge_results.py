@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Merges the outputs of runs of `generate_data.py --shard I/N` into a single
+# output file. The results of every job are located through the journal of its
+# shard, and the shard plans are used to check that all shards and jobs are
+# present and that no job was run twice. Exits with an error if any are
+# missing or duplicated, after writing everything that was found.
+#
+# With --queue-dir, the results of a work queue shared by `generate_data.py
+# --worker` runs are exported instead, and jobs that aren't done yet or failed
+# are reported as missing.
+
+import argparse
+import os
+import sys
+
+import job_journal
+import results_io
+import sharding
+import work_queue
+
+parser = argparse.ArgumentParser(
+    description='Merge outputs of sharded or work queue generate_data.py runs.')
+parser.add_argument('shard_outputs',
+                    nargs='*',
+                    metavar='output.txt',
+                    help='shard output, with its .journal and .shard files')
+parser.add_argument('--out', required=True, metavar='merged.txt')
+parser.add_argument('--queue-dir',
+                    default=None,
+                    metavar='DIR',
+                    help='export results of the work queue in DIR')
+parser.add_argument('--out-format',
+                    default=None,
+                    choices=results_io.OUTPUT_FORMATS,
+                    help="defaults to 'jsonl' for .jsonl files, else 'python'")
+
+
+def job_results(shard_output):
+    # Yields (job key, results) for every journaled job of a shard output.
+    for (entry, results) in job_journal.read_results(
+            shard_output, shard_output + '.journal'):
+        yield (entry.get('key'), results)
+
+
+def queue_results(queue_dir, problems):
+    # Yields (job key, results) for every done job of a work queue and adds
+    # the other jobs to `problems`.
+    queue = work_queue.WorkQueue(queue_dir)
+    for (key, state, results, error) in queue.jobs():
+        if state == work_queue.DONE:
+            yield (key, results)
+        elif state == work_queue.FAILED:
+            problems.append("Failed job: %s\n%s" % (key, error))
+        else:
+            problems.append("Job is %s: %s" % (state, key))
+    queue.close()
+
+
+def main():
+    args = parser.parse_args()
+    args.out_format = results_io.output_format(args.out, args.out_format)
+    if not args.shard_outputs and not args.queue_dir:
+        parser.error('no shard outputs given, supply them or --queue-dir')
+    if args.queue_dir and not os.path.isfile(
+            os.path.join(args.queue_dir, work_queue.QUEUE_FILENAME)):
+        sys.exit("ERROR: No work queue in '%s'." % args.queue_dir)
+    plans = {}
+    for shard_output in args.shard_outputs:
+        plans[shard_output] = sharding.load_plan(
+            sharding.plan_filename(shard_output))
+
+    problems = []
+    matrices = set(
+        (plan['matrix'], plan['num-shards']) for plan in plans.values())
+    if len(matrices) > 1:
+        sys.exit("ERROR: Shards are from different job matrices.")
+    num_shards = plans[args.shard_outputs[0]]['num-shards'] if plans else 0
+    shard_outputs = {}
+    for (shard_output, plan) in plans.items():
+        shard_outputs.setdefault(plan['shard'], []).append(shard_output)
+    for shard in range(1, num_shards + 1):
+        if shard not in shard_outputs:
+            problems.append("Shard %d/%d is missing." % (shard, num_shards))
+        elif len(shard_outputs[shard]) > 1:
+            problems.append("Shard %d/%d is given more than once: %s" %
+                            (shard, num_shards, ', '.join(
+                                shard_outputs[shard])))
+
+    merged_jobs = set()
+    num_results = 0
+    with open(args.out, 'w') as out_file:
+        results_io.write_header(out_file, args.out_format)
+        sources = [(shard_output, job_results(shard_output))
+                   for shard_output in args.shard_outputs]
+        if args.queue_dir:
+            sources.append((args.queue_dir,
+                            queue_results(args.queue_dir, problems)))
+        for (source, source_results) in sources:
+            for (key, results) in source_results:
+                if key is None:
+                    sys.exit("ERROR: '%s' was not written by a sharded run." %
+                             source)
+                if key in merged_jobs:
+                    problems.append("Duplicate job: %s" % key)
+                    continue
+                merged_jobs.add(key)
+                for result in results:
+                    results_io.write_result(out_file, result, args.out_format)
+                    num_results += 1
+            for key in plans.get(source, {}).get('jobs', []):
+                if key not in merged_jobs:
+                    problems.append("Missing job: %s" % key)
+        results_io.write_footer(out_file, args.out_format)
+
+    print("Merged %d results of %d jobs into '%s'." %
+          (num_results, len(merged_jobs), args.out))
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+
+import job_journal
+import merge_results
+import results_io
+import sharding
+
+MATRIX = 'matrix'
+
+
+def write_shard(tmp_path, name, shard, num_shards, planned, finished):
+    # Writes a shard output with results of the `finished` job keys, its
+    # journal and a plan of the `planned` job keys.
+    out = str(tmp_path / name)
+    with open(out, 'w') as out_file, \
+            open(out + '.journal', 'w') as journal_file:
+        results_io.write_header(out_file, 'jsonl')
+        for key in finished:
+            results_io.write_result(out_file, {'job': key}, 'jsonl')
+            out_file.flush()
+            job_journal.append_entry(journal_file, key, ['enc', key],
+                                     out_file.tell(), key)
+    sharding.write_plan(sharding.plan_filename(out), shard, num_shards,
+                        MATRIX, planned)
+    return out
+
+
+def merge(monkeypatch, tmp_path, *outputs):
+    merged = str(tmp_path / 'merged.jsonl')
+    monkeypatch.setattr(sys, 'argv',
+                        ['merge_results.py', '--out', merged] + list(outputs))
+    returncode = merge_results.main()
+    with open(merged) as f:
+        jobs = [json.loads(line)['job'] for line in f]
+    return (returncode, jobs)
+
+
+def test_merge(monkeypatch, tmp_path, capsys):
+    first = write_shard(tmp_path, '1.jsonl', 1, 2, ['a', 'b'], ['a', 'b'])
+    second = write_shard(tmp_path, '2.jsonl', 2, 2, ['c'], ['c'])
+    assert merge(monkeypatch, tmp_path, first, second) == (0, ['a', 'b', 'c'])
+    assert 'Merged 3 results of 3 jobs' in capsys.readouterr().out
+
+
+def test_merge_reports_missing_jobs_and_shards(monkeypatch, tmp_path,
+                                               capsys):
+    first = write_shard(tmp_path, '1.jsonl', 1, 3, ['a', 'b'], ['a'])
+    second = write_shard(tmp_path, '2.jsonl', 2, 3, ['c'], ['c'])
+    assert merge(monkeypatch, tmp_path, first, second) == (1, ['a', 'c'])
+    out = capsys.readouterr().out
+    assert 'Missing job: b' in out
+    assert 'Shard 3/3 is missing.' in out
+
+
+def test_merge_reports_duplicate_jobs(monkeypatch, tmp_path, capsys):
+    first = write_shard(tmp_path, '1.jsonl', 1, 2, ['a', 'b'], ['a', 'b'])
+    # A job that ran in both shards is only kept once.
+    second = write_shard(tmp_path, '2.jsonl', 2, 2, ['c'], ['c', 'b'])
+    assert merge(monkeypatch, tmp_path, first, second) == (1, ['a', 'b', 'c'])
+    assert 'Duplicate job: b' in capsys.readouterr().out
+
+
+def test_merge_reports_repeated_shards(monkeypatch, tmp_path, capsys):
+    first = write_shard(tmp_path, '1.jsonl', 1, 2, ['a'], ['a'])
+    again = write_shard(tmp_path, '1b.jsonl', 1, 2, ['a'], [])
+    second = write_shard(tmp_path, '2.jsonl', 2, 2, ['c'], ['c'])
+    assert merge(monkeypatch, tmp_path, first, again, second)[0] == 1
+    assert 'Shard 1/2 is given more than once' in capsys.readouterr().out
@@ -0,0 +1,168 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Quick previews that encode a few short segments spread across every clip
+# instead of the whole clip. Results of segments are labeled with
+# 'preview-segment', 'preview-segments' and 'preview-param' (the QP or target
+# bitrate). Estimates for the whole clip are the means over the segments of a
+# rate point, labeled with 'preview-estimate' and with the standard error of
+# every estimated metric in '<metric>-stderr'.
+
+import math
+
+DEFAULT_SEGMENTS = 4
+# Frames per segment when --num-frames isn't given.
+DEFAULT_SEGMENT_FRAMES = 30
+
+# Metrics that are estimated as the mean over segments.
+ESTIMATED_METRICS = [
+    'avg-psnr', 'avg-psnr-y', 'avg-psnr-u', 'avg-psnr-v', 'glb-psnr',
+    'glb-psnr-y', 'glb-psnr-u', 'glb-psnr-v', 'ssim', 'ssim-y', 'ssim-u',
+    'ssim-v', 'vpx-ssim', 'vmaf', 'psnr-dmos', 'actual-bitrate-bps',
+    'bitrate-utilization', 'encode-time-utilization'
+]
+# Fields that are the same for all segments of a rate point.
+SHARED_FIELDS = [
+    'input-file', 'input-file-sha1sum', 'input-total-frames', 'layer-pattern',
+    'encoder', 'codec', 'width', 'height', 'fps', 'spatial-layer',
+    'temporal-layer', 'layer-width', 'layer-height', 'layer-fps',
+    'preview-param'
+]
+PEAK = 255.0
+
+
+def plan_segments(total_frames, frame_offset, num_segments, segment_frames):
+    # Returns (start, count) of up to `num_segments` segments of
+    # `segment_frames` frames, each centered in an equal part of the frames
+    # from `frame_offset` on. Clips too short for that many separate segments
+    # are covered by a single segment of all frames.
+    start = min(max(frame_offset, 0), total_frames)
+    available = total_frames - start
+    if available <= segment_frames * num_segments:
+        return [(start, available)]
+    part = float(available) / num_segments
+    return [(start + int((i + 0.5) * part - segment_frames / 2.0),
+             segment_frames) for i in range(num_segments)]
+
+
+def label_results(results_dict, segment, num_segments, param):
+    results_dict['preview-segment'] = segment
+    results_dict['preview-segments'] = num_segments
+    results_dict['preview-param'] = param
+
+
+def is_segment(results_dict):
+    return 'preview-segment' in results_dict
+
+
+def group_key(results_dict):
+    return tuple(results_dict.get(field) for field in SHARED_FIELDS)
+
+
+def group_segments(results):
+    # Returns lists of the segment results of every rate point and layer.
+    groups = {}
+    for results_dict in results:
+        if is_segment(results_dict):
+            groups.setdefault(group_key(results_dict), []).append(results_dict)
+    return list(groups.values())
+
+
+def mean_and_stderr(values, weights):
+    # Weighted mean, and the standard error of the mean from the spread
+    # between segments (None for a single segment).
+    total_weight = float(sum(weights))
+    mean = sum(v * w for (v, w) in zip(values, weights)) / total_weight
+    if len(values) < 2:
+        return (mean, None)
+    variance = sum(
+        (v - mean)**2 for v in values) / (len(values) - 1)
+    return (mean, math.sqrt(variance / len(values)))
+
+
+def estimate(segment_results):
+    # Returns the estimated result of the whole clip from the results of its
+    # segments at one rate point.
+    estimate = {
+        field: segment_results[0][field]
+        for field in SHARED_FIELDS
+        if field in segment_results[0]
+    }
+    frames = [r.get('frame-count', 1) for r in segment_results]
+    for metric in ESTIMATED_METRICS:
+        if not all(metric in r for r in segment_results):
+            continue
+        values = [r[metric] for r in segment_results]
+        if metric.startswith('glb-'):
+            # Global PSNR is the PSNR of the mean squared error of all frames.
+            errors = [PEAK**2 / 10**(v / 10.0) for v in values]
+            mean_error = mean_and_stderr(errors, frames)[0]
+            stderr = mean_and_stderr(values, frames)[1]
+            mean = 10 * math.log10(PEAK**2 / mean_error)
+        else:
+            (mean, stderr) = mean_and_stderr(values, frames)
+        estimate[metric] = mean
+        if stderr is not None:
+            estimate[metric + '-stderr'] = stderr
+    estimate['frame-count'] = sum(frames)
+    estimate['preview-estimate'] = True
+    estimate['preview-segments'] = len(segment_results)
+    return estimate
+
+
+def estimate_results(results):
+    return [estimate(segments) for segments in group_segments(results)]
+
+
+def top_layer(results):
+    # Results of the full-resolution, full-framerate layer.
+    layer = max((r['spatial-layer'], r['temporal-layer']) for r in results)
+    return [
+        r for r in results if (r['spatial-layer'], r['temporal-layer']) == layer
+    ]
+
+
+def curve(segment_groups, metric, skip_segment=None):
+    # Returns (bitrate, metric) points of one encoder from the segment results
+    # of its rate points, optionally leaving out one segment.
+    points = []
+    for segments in segment_groups:
+        segments = [
+            r for r in segments if r['preview-segment'] != skip_segment
+        ]
+        if not segments or not all(metric in r for r in segments):
+            continue
+        result = estimate(segments)
+        points.append((result['actual-bitrate-bps'], result[metric]))
+    return points
+
+
+def bd_rate_estimate(bd_rate_func, baseline_groups, groups, metric):
+    # Returns the BD-rate (in percent) of an encoder's segment results against
+    # the baseline's, and its jackknife standard error from leaving out one
+    # segment at a time (None for a single segment).
+    bd_rate = bd_rate_func(curve(baseline_groups, metric),
+                           curve(groups, metric))
+    segments = sorted(
+        set(r['preview-segment'] for results in groups for r in results))
+    if len(segments) < 2:
+        return (bd_rate, None)
+    partial = [
+        bd_rate_func(curve(baseline_groups, metric, segment),
+                     curve(groups, metric, segment)) for segment in segments
+    ]
+    mean = sum(partial) / len(partial)
+    n = len(partial)
+    return (bd_rate,
+            math.sqrt(float(n - 1) / n * sum((b - mean)**2 for b in partial)))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Reports the estimated metrics and BD-rates of `generate_data.py --preview`
+# runs, with their standard errors, and optionally writes the estimated
+# results for generate_graphs.py.
+
+import argparse
+import sys
+
+import preview
+import results_io
+from visual_metrics import bdrate2
+
+parser = argparse.ArgumentParser(
+    description='Estimate metrics and BD-rate from preview segments.')
+parser.add_argument('preview_outputs',
+                    nargs='+',
+                    metavar='output.txt',
+                    help='output of generate_data.py --preview')
+parser.add_argument('--baseline',
+                    default=None,
+                    metavar='ENCODER:CODEC',
+                    help='encoder to compute BD-rates against, defaults to '
+                    'the first one in alphabetical order')
+parser.add_argument('--metric', default='avg-psnr')
+parser.add_argument('--out',
+                    default=None,
+                    metavar='estimates.txt',
+                    help='write the estimated results')
+parser.add_argument('--out-format',
+                    default=None,
+                    choices=results_io.OUTPUT_FORMATS,
+                    help="defaults to 'jsonl' for .jsonl files, else 'python'")
+
+
+def format_estimate(result, metric, scale=1.0):
+    if metric not in result:
+        return '-'
+    if metric + '-stderr' not in result:
+        return "%.2f" % (result[metric] * scale)
+    return "%.2f +- %.2f" % (result[metric] * scale,
+                             result[metric + '-stderr'] * scale)
+
+
+def encoder_name(results_dict):
+    return "%s:%s" % (results_dict['encoder'], results_dict['codec'])
+
+
+def main():
+    args = parser.parse_args()
+    results = []
+    for filename in args.preview_outputs:
+        with open(filename) as f:
+            results += [
+                r for r in results_io.read_results(f) if preview.is_segment(r)
+            ]
+    if not results:
+        sys.exit("ERROR: No preview results found.")
+
+    clips = {}
+    for results_dict in results:
+        clips.setdefault(
+            (results_dict['input-file'], results_dict['layer-pattern']),
+            []).append(results_dict)
+    bd_rates = {}
+    for ((input_file, layer_pattern), clip_results) in sorted(clips.items()):
+        encoders = {}
+        for segments in preview.group_segments(
+                preview.top_layer(clip_results)):
+            encoders.setdefault(encoder_name(segments[0]), []).append(segments)
+        baseline = args.baseline or sorted(encoders)[0]
+        print("%s %s:" % (input_file, layer_pattern))
+        for (encoder, groups) in sorted(encoders.items()):
+            for estimate in sorted(
+                    (preview.estimate(segments) for segments in groups),
+                    key=lambda r: r['actual-bitrate-bps']):
+                print("  %-20s %6s  %s kbps  %s %s" %
+                      (encoder, estimate['preview-param'],
+                       format_estimate(estimate, 'actual-bitrate-bps',
+                                       0.001), args.metric,
+                       format_estimate(estimate, args.metric)))
+        if baseline not in encoders:
+            print("  No results of baseline %s." % baseline)
+            continue
+        for (encoder, groups) in sorted(encoders.items()):
+            if encoder == baseline:
+                continue
+            (bd_rate, stderr) = preview.bd_rate_estimate(
+                bdrate2, encoders[baseline], groups, args.metric)
+            bd_rates.setdefault(encoder, []).append((bd_rate, stderr or 0.0))
+            print("  %s BD-rate vs %s: %+.2f%%%s" %
+                  (encoder, baseline, bd_rate,
+                   " +- %.2f%%" % stderr if stderr is not None else ""))
+    if len(clips) > 1:
+        print("Mean over clips:")
+        for (encoder, clip_bd_rates) in sorted(bd_rates.items()):
+            n = len(clip_bd_rates)
+            print("  %s BD-rate: %+.2f%% +- %.2f%% (%d clips)" %
+                  (encoder, sum(b for (b, _) in clip_bd_rates) / n,
+                   sum(s**2 for (_, s) in clip_bd_rates)**0.5 / n, n))
+
+    if args.out:
+        args.out_format = results_io.output_format(args.out, args.out_format)
+        with open(args.out, 'w') as out_file:
+            results_io.write_header(out_file, args.out_format)
+            for estimate in preview.estimate_results(results):
+                results_io.write_result(out_file, estimate, args.out_format)
+            results_io.write_footer(out_file, args.out_format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import pytest
+
+import preview
+
+
+def test_plan_segments():
+    # Four segments of 10 frames centered in quarters of the 100 frames.
+    assert preview.plan_segments(100, 0, 4, 10) == [(7, 10), (32, 10),
+                                                    (57, 10), (82, 10)]
+    # Segments are spread over the frames after the offset.
+    assert preview.plan_segments(120, 20, 2, 10) == [(40, 10), (90, 10)]
+
+
+def test_plan_segments_of_short_clips():
+    assert preview.plan_segments(40, 0, 4, 10) == [(0, 40)]
+    assert preview.plan_segments(40, 30, 4, 10) == [(30, 10)]
+    assert preview.plan_segments(40, 50, 4, 10) == [(40, 0)]
+
+
+def segment_result(segment, param, bitrate, psnr, frames=10):
+    results_dict = {
+        'encoder': 'aom-rt',
+        'spatial-layer': 0,
+        'temporal-layer': 0,
+        'frame-count': frames,
+        'actual-bitrate-bps': bitrate,
+        'avg-psnr': psnr,
+        'glb-psnr': psnr,
+    }
+    preview.label_results(results_dict, segment, 2, param)
+    return results_dict
+
+
+def test_estimate_results():
+    results = [
+        segment_result(1, 30, 1000, 40.0),
+        segment_result(2, 30, 3000, 30.0, frames=30),
+        segment_result(1, 40, 500, 35.0),
+        {'encoder': 'aom-rt', 'avg-psnr': 50.0},
+    ]
+    estimates = preview.estimate_results(results)
+    assert len(estimates) == 2
+    estimate = estimates[0]
+    assert estimate['preview-param'] == 30
+    assert estimate['frame-count'] == 40
+    assert estimate['actual-bitrate-bps'] == pytest.approx(2500)
+    assert estimate['avg-psnr'] == pytest.approx(32.5)
+    # The spread of the segments around the frame-weighted mean.
+    assert estimate['avg-psnr-stderr'] == pytest.approx(
+        math.sqrt((7.5**2 + 2.5**2) / 2))
+    # Global PSNR is averaged as mean squared error.
+    errors = [255.0**2 / 10**4, 255.0**2 / 10**3]
+    assert estimate['glb-psnr'] == pytest.approx(
+        10 * math.log10(255.0**2 / ((errors[0] * 10 + errors[1] * 30) / 40)))
+    # A single segment has no standard error.
+    assert 'avg-psnr-stderr' not in estimates[1]
+    assert estimates[1]['preview-estimate']
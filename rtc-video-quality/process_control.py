@@ -0,0 +1,122 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Child processes of jobs. Every process runs in a process group of its own,
+# so that killing it when its stage times out or when the run is interrupted
+# also kills any processes it started. Processes are killed at the deadline
+# they are started with, and no processes are started once the run is
+# cancelled.
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import resource_usage
+
+# Only the end of the output of a process is kept beyond this many characters.
+MAX_OUTPUT_CHARS = 64 * 1024
+READ_CHARS = 4096
+
+lock = threading.Lock()
+processes = set()
+cancelled = False
+
+
+class CancelledError(OSError):
+    pass
+
+
+def start(command, deadline=None, **kwargs):
+    # Starts a subprocess.Popen process that is killed at `deadline` (a
+    # time.time() value) unless it's waited for with wait() before.
+    timeout = None if deadline is None else max(deadline - time.time(), 0)
+    with lock:
+        if cancelled:
+            raise CancelledError("The run was interrupted.")
+        process = subprocess.Popen(command, start_new_session=True, **kwargs)
+        processes.add(process)
+    process.timed_out = False
+    process.timeout = timeout
+    process.timer = None
+    if timeout is not None:
+        process.timer = threading.Timer(timeout, kill, [process, True])
+        process.timer.daemon = True
+        process.timer.start()
+    return process
+
+
+def kill(process, timed_out=False):
+    if timed_out:
+        process.timed_out = True
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def wait(process):
+    # Waits for a process like resource_usage.wait() and stops watching it.
+    usage = resource_usage.wait(process)
+    if process.timer:
+        process.timer.cancel()
+    with lock:
+        processes.discard(process)
+    return usage
+
+
+def check(process, output=None):
+    # Raises if a waited for process timed out or failed.
+    if process.timed_out:
+        raise subprocess.TimeoutExpired(process.args, process.timeout, output)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args,
+                                            output)
+
+
+def is_transient(error):
+    # Timeouts and processes killed by a signal (including ones killed by
+    # the OOM killer) may succeed when run again.
+    if isinstance(error, subprocess.TimeoutExpired):
+        return True
+    return isinstance(error, subprocess.CalledProcessError) and \
+        error.returncode < 0
+
+
+def read_output(stream):
+    # Reads a text stream to its end, keeping the last MAX_OUTPUT_CHARS.
+    output = ''
+    dropped = 0
+    while True:
+        data = stream.read(READ_CHARS)
+        if not data:
+            break
+        output += data
+        if len(output) > MAX_OUTPUT_CHARS:
+            dropped += len(output) - MAX_OUTPUT_CHARS
+            output = output[-MAX_OUTPUT_CHARS:]
+    if dropped:
+        output = "[%d characters of output dropped]\n%s" % (dropped, output)
+    return output
+
+
+def cancel():
+    # Kills all running processes and refuses to start new ones.
+    global cancelled
+    with lock:
+        cancelled = True
+        running = list(processes)
+    for process in running:
+        kill(process)
@@ -0,0 +1,95 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import time
+
+import pytest
+
+import process_control
+
+
+@pytest.fixture(autouse=True)
+def processes(monkeypatch):
+    monkeypatch.setattr(process_control, 'processes', set())
+    monkeypatch.setattr(process_control, 'cancelled', False)
+
+
+def start_with_child(deadline=None):
+    # Starts a shell that starts a child of its own, and returns the shell and
+    # the PID of its child.
+    process = process_control.start(['sh', '-c', 'sleep 30 & echo $!; wait'],
+                                    deadline=deadline,
+                                    stdout=subprocess.PIPE,
+                                    encoding='utf-8')
+    return (process, int(process.stdout.readline()))
+
+
+def is_dead(pid):
+    # Killed processes may linger as zombies until they are reaped.
+    for i in range(100):
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                if f.read().split(')')[-1].split()[0] == 'Z':
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_timeout_kills_process_group():
+    (process, child) = start_with_child(deadline=time.time() + 0.5)
+    assert process_control.read_output(process.stdout) == ''
+    assert process_control.wait(process)
+    assert process.returncode == -9
+    assert is_dead(child)
+    with pytest.raises(subprocess.TimeoutExpired) as e:
+        process_control.check(process, 'output')
+    # Jobs that timed out are retried.
+    assert process_control.is_transient(e.value)
+    assert process_control.processes == set()
+
+
+def test_failures():
+    process = process_control.start(['sh', '-c', 'exit 2'],
+                                    deadline=time.time() + 30)
+    process_control.wait(process)
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        process_control.check(process)
+    assert not process_control.is_transient(e.value)
+    # Such as processes killed by the OOM killer.
+    assert process_control.is_transient(
+        subprocess.CalledProcessError(-9, ['encoder']))
+
+
+def test_cancel():
+    (process, child) = start_with_child()
+    process_control.cancel()
+    process_control.wait(process)
+    assert process.returncode == -9
+    assert not process.timed_out
+    assert is_dead(child)
+    with pytest.raises(process_control.CancelledError):
+        process_control.start(['true'])
+
+
+def test_read_output_keeps_the_end(monkeypatch):
+    monkeypatch.setattr(process_control, 'MAX_OUTPUT_CHARS', 10)
+    process = subprocess.Popen(['printf', '0123456789abcdef'],
+                               stdout=subprocess.PIPE,
+                               encoding='utf-8')
+    assert process_control.read_output(
+        process.stdout) == "[6 characters of output dropped]\n6789abcdef"
+    process.wait()
@@ -0,0 +1,164 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Adaptive selection of rate points (QPs or target bitrates) per clip. Instead
+# of encoding a fixed grid, every encoder is first encoded at both ends of the
+# parameter range. The quality range all encoders reach (where their RD curves
+# overlap, which is what BD-rate compares) is then split into evenly spaced
+# quality anchors, and every encoder gets a rate point interpolated to hit
+# each anchor. Points are refined until every anchor is hit within a tolerance
+# or can't be hit any closer, or the encoder runs out of encodes.
+
+import math
+
+# Metric of the top layer that anchors are placed on.
+QUALITY_METRIC = 'avg-psnr'
+# Anchors are hit when a point is within this fraction of the anchor spacing.
+ANCHOR_TOLERANCE = 0.25
+# Encodes per encoder beyond the two range ends and one per anchor.
+EXTRA_ENCODES = 2
+
+
+def result_quality(results):
+    # Quality of the full-resolution, full-framerate layer of a job, or None
+    # if the job failed.
+    if not results:
+        return None
+    top_layer = max(results,
+                    key=lambda r: (r['spatial-layer'], r['temporal-layer']))
+    return top_layer.get(QUALITY_METRIC)
+
+
+class ClipSearch(object):
+
+    def __init__(self, encoders, bounds, num_points, log_scale):
+        # `encoders` are (encoder, codec) pairs and `bounds` the smallest and
+        # largest integer parameter. Every encoder aims for `num_points`
+        # points, including the range ends. Bitrates are interpolated on a log
+        # scale.
+        self.encoders = encoders
+        self.bounds = bounds
+        self.num_points = num_points
+        self.log_scale = log_scale
+        self.points = dict((encoder, {}) for encoder in encoders)
+        self.pending = set()
+        self.anchors = None
+        self.missed_anchors = dict((encoder, set()) for encoder in encoders)
+
+    def start(self):
+        # Returns the (param, encoder, codec) of the first jobs to run.
+        return self.request([(param, encoder)
+                             for encoder in self.encoders
+                             for param in self.bounds])
+
+    def request(self, params):
+        for (param, encoder) in params:
+            self.pending.add((param, encoder))
+        return [(param, encoder, codec)
+                for (param, (encoder, codec)) in params]
+
+    def add_result(self, param, encoder, codec, quality):
+        # Records the quality (None if the job failed) of a job and returns
+        # the (param, encoder, codec) of the next jobs to run.
+        encoder = (encoder, codec)
+        self.pending.discard((param, encoder))
+        self.points[encoder][param] = quality
+        if self.anchors is not None:
+            return self.request(self.next_params(encoder))
+        if self.pending:
+            return []
+        # All range ends are in, every encoder can start on the anchors.
+        self.place_anchors()
+        params = []
+        for encoder in self.encoders:
+            params += self.next_params(encoder)
+        return self.request(params)
+
+    def done(self):
+        return not self.pending
+
+    def place_anchors(self):
+        # Spreads anchors evenly over the quality range all encoders reach.
+        self.anchors = []
+        ranges = []
+        for encoder in self.encoders:
+            qualities = [
+                q for q in self.points[encoder].values() if q is not None
+            ]
+            if len(qualities) < 2:
+                # Encoders that failed at the range ends aren't searched.
+                continue
+            ranges.append((min(qualities), max(qualities)))
+        if not ranges or self.num_points < 3:
+            return
+        low = max(r[0] for r in ranges)
+        high = min(r[1] for r in ranges)
+        if low >= high:
+            # The curves don't overlap, there is nothing to compare.
+            return
+        self.spacing = (high - low) / (self.num_points - 1)
+        self.anchors = [
+            low + self.spacing * i for i in range(1, self.num_points - 1)
+        ]
+
+    def next_params(self, encoder):
+        # Returns (param, encoder) for the anchors the encoder hasn't hit yet.
+        points = self.points[encoder]
+        measured = [(param, q)
+                    for (param, q) in points.items()
+                    if q is not None]
+        if len(measured) < 2:
+            return []
+        budget = len(self.bounds) + len(self.anchors) + EXTRA_ENCODES
+        encodes = len(points) + len(
+            [p for (p, e) in self.pending if e == encoder])
+        params = []
+        for anchor in self.anchors:
+            if encodes >= budget:
+                break
+            if self.anchor_hit(measured, anchor) or \
+                    anchor in self.missed_anchors[encoder]:
+                continue
+            param = self.interpolate(measured, anchor)
+            if param is None or param in points:
+                # No integer parameter left that gets closer.
+                self.missed_anchors[encoder].add(anchor)
+                continue
+            if (param, encoder) in self.pending or (param, encoder) in params:
+                continue
+            params.append((param, encoder))
+            encodes += 1
+        return params
+
+    def anchor_hit(self, measured, anchor):
+        return any(abs(q - anchor) <= self.spacing * ANCHOR_TOLERANCE
+                   for (_, q) in measured)
+
+    def scale(self, param):
+        return math.log(param) if self.log_scale else float(param)
+
+    def interpolate(self, measured, anchor):
+        # Returns an integer parameter strictly between the two measured
+        # points that bracket the anchor's quality, or None if there is none.
+        measured = sorted(measured)
+        for ((param1, q1), (param2, q2)) in zip(measured, measured[1:]):
+            if min(q1, q2) <= anchor <= max(q1, q2) and q1 != q2:
+                if param2 - param1 < 2:
+                    return None
+                position = (anchor - q1) / (q2 - q1)
+                value = self.scale(param1) + position * (self.scale(param2) -
+                                                         self.scale(param1))
+                param = int(round(math.exp(value) if self.log_scale else value))
+                return min(max(param, param1 + 1), param2 - 1)
+        return None
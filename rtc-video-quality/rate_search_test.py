@@ -0,0 +1,90 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import rate_search
+
+ENCODERS = [('aom-rt', 'av1'), ('svt-rt', 'av1')]
+
+
+def run_search(search, quality):
+    # Runs jobs in the order they are requested, with `quality` giving the
+    # quality of (param, encoder) or None for failed jobs.
+    queue = search.start()
+    while queue:
+        (param, encoder, codec) = queue.pop(0)
+        queue += search.add_result(param, encoder, codec,
+                                   quality(param, encoder))
+    assert search.done()
+
+
+def test_search_hits_anchors():
+    search = rate_search.ClipSearch(ENCODERS, [10, 60], 5, False)
+    # QP lowers quality linearly, svt-rt is 2 dB worse.
+    offsets = {'aom-rt': 0.0, 'svt-rt': -2.0}
+    run_search(search,
+               lambda param, encoder: 50.0 - 0.5 * param + offsets[encoder])
+    # The overlapping quality range is [20, 43], 3 anchors between its ends.
+    assert search.anchors == [25.75, 31.5, 37.25]
+    for encoder in ENCODERS:
+        points = search.points[encoder]
+        assert 10 in points and 60 in points
+        assert len(points) <= 2 + len(search.anchors) + \
+            rate_search.EXTRA_ENCODES
+        for anchor in search.anchors:
+            assert search.anchor_hit(list(points.items()), anchor)
+
+
+def test_search_log_scale_bitrates():
+    search = rate_search.ClipSearch(ENCODERS[:1], [100, 1600], 4, True)
+    # Quality grows with the logarithm of the bitrate, so log-scale
+    # interpolation hits anchors on the first try.
+    run_search(
+        search,
+        lambda param, encoder: 30.0 + 3.0 * math.log2(param / 100.0))
+    assert sorted(search.points[ENCODERS[0]]) == [100, 252, 635, 1600]
+
+
+def test_failed_encoder_isnt_searched():
+    search = rate_search.ClipSearch(ENCODERS, [10, 60], 5, False)
+    run_search(
+        search, lambda param, encoder: None
+        if encoder == 'svt-rt' else 50.0 - 0.5 * param)
+    assert sorted(search.points[ENCODERS[1]]) == [10, 60]
+    assert len(search.points[ENCODERS[0]]) > 2
+
+
+def test_no_overlap_places_no_anchors():
+    search = rate_search.ClipSearch(ENCODERS, [10, 60], 5, False)
+    offsets = {'aom-rt': 0.0, 'svt-rt': -40.0}
+    run_search(search,
+               lambda param, encoder: 50.0 - 0.5 * param + offsets[encoder])
+    assert search.anchors == []
+    for encoder in ENCODERS:
+        assert sorted(search.points[encoder]) == [10, 60]
+
+
+def test_result_quality_uses_top_layer():
+    results = [{
+        'spatial-layer': 0,
+        'temporal-layer': 1,
+        'avg-psnr': 35.0
+    }, {
+        'spatial-layer': 0,
+        'temporal-layer': 0,
+        'avg-psnr': 30.0
+    }]
+    assert rate_search.result_quality(results) == 35.0
+    assert rate_search.result_quality(None) is None
@@ -0,0 +1,106 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Resource accounting of child processes. Processes are reaped with os.wait4()
+# to get their CPU time, peak memory use and context switches, which unlike
+# wall-clock time aren't inflated by other processes competing for the
+# machine.
+
+import os
+
+# Result fields, prefixed by the stage ('encode', 'decode' or 'metric').
+USAGE_FIELDS = [
+    'user-time-ms', 'system-time-ms', 'peak-rss-kb',
+    'voluntary-context-switches', 'involuntary-context-switches'
+]
+
+
+def usage_stats(rusage):
+    return {
+        'user-time-ms': rusage.ru_utime * 1000,
+        'system-time-ms': rusage.ru_stime * 1000,
+        # ru_maxrss is in kilobytes on Linux.
+        'peak-rss-kb': rusage.ru_maxrss,
+        'voluntary-context-switches': rusage.ru_nvcsw,
+        'involuntary-context-switches': rusage.ru_nivcsw,
+    }
+
+
+def exit_code(status):
+    # Matches Popen.returncode, negative for processes killed by a signal.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait(process):
+    # Waits for a subprocess.Popen process and returns its resource usage, or
+    # None if it was already reaped elsewhere (such as by Popen.kill()).
+    # Output pipes of the process must be drained before waiting.
+    if process.returncode is not None:
+        return None
+    try:
+        (_, status, rusage) = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        process.wait()
+        return None
+    process.returncode = exit_code(status)
+    return usage_stats(rusage)
+
+
+def combine(stats_list):
+    # Sums the usage of processes run one after another or side by side. Peak
+    # memory use is the largest peak of any process.
+    stats_list = [stats for stats in stats_list if stats]
+    if not stats_list:
+        return None
+    combined = {}
+    for field in USAGE_FIELDS:
+        values = [stats[field] for stats in stats_list]
+        combined[field] = max(values) if field == 'peak-rss-kb' else sum(values)
+    return combined
+
+
+def add_stats(results_dict, stage, stats):
+    if not stats:
+        return
+    for field in USAGE_FIELDS:
+        results_dict['%s-%s' % (stage, field)] = stats[field]
+
+
+def flatten_passes(results_dict):
+    # Returns the usage of every encoder pass of a result as flat fields
+    # ('encode-pass1-user-time-ms', ...) for reports that only show numbers.
+    fields = {}
+    for (i, stats) in enumerate(results_dict.get('encode-passes', [])):
+        for (field, value) in stats.items():
+            fields['encode-pass%d-%s' % (i + 1, field)] = value
+    return fields
+
+
+def report_fields(results):
+    # Returns the usage fields present in any of `results`, in report order.
+    # Encoder passes are expected to be flattened with flatten_passes().
+    keys = set()
+    for results_dict in results:
+        keys.update(results_dict)
+    stages = ['encode', 'decode', 'metric']
+    while 'encode-pass%d-wall-time-ms' % (len(stages) - 2) in keys:
+        stages.append('encode-pass%d' % (len(stages) - 2))
+    fields = [
+        '%s-%s' % (stage, field)
+        for stage in stages
+        for field in USAGE_FIELDS + ['wall-time-ms']
+    ]
+    return [field for field in fields if field in keys]
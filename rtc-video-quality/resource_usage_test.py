@@ -0,0 +1,69 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+
+import resource_usage
+
+
+def test_wait_captures_child_usage():
+    # Busy-loops for a while and allocates memory that is touched.
+    process = subprocess.Popen([
+        sys.executable, '-c',
+        'import time\n'
+        'data = bytearray(64 * 1024 * 1024)\n'
+        'end = time.process_time() + 0.2\n'
+        'while time.process_time() < end: pass\n'
+    ])
+    stats = resource_usage.wait(process)
+    assert process.returncode == 0
+    assert sorted(stats) == sorted(resource_usage.USAGE_FIELDS)
+    assert stats['user-time-ms'] + stats['system-time-ms'] >= 150
+    assert stats['peak-rss-kb'] >= 64 * 1024
+    # Already reaped.
+    assert resource_usage.wait(process) is None
+
+
+def test_wait_exit_codes():
+    process = subprocess.Popen(['sh', '-c', 'exit 3'])
+    assert resource_usage.wait(process)
+    assert process.returncode == 3
+    process = subprocess.Popen(['sleep', '10'])
+    process.kill()
+    resource_usage.wait(process)
+    assert process.returncode == -9
+
+
+def test_combine_and_report():
+    first = dict.fromkeys(resource_usage.USAGE_FIELDS, 1)
+    second = dict.fromkeys(resource_usage.USAGE_FIELDS, 2)
+    combined = resource_usage.combine([first, None, second])
+    assert combined['user-time-ms'] == 3
+    assert combined['peak-rss-kb'] == 2
+    assert resource_usage.combine([None]) is None
+    results_dict = {
+        'encode-passes': [dict(first, **{'wall-time-ms': 5})],
+        'decode-wall-time-ms': 1,
+    }
+    resource_usage.add_stats(results_dict, 'decode', combined)
+    results_dict.update(resource_usage.flatten_passes(results_dict))
+    assert results_dict['encode-pass1-wall-time-ms'] == 5
+    assert resource_usage.report_fields([results_dict]) == [
+        'decode-' + field
+        for field in resource_usage.USAGE_FIELDS + ['wall-time-ms']
+    ] + [
+        'encode-pass1-' + field
+        for field in resource_usage.USAGE_FIELDS + ['wall-time-ms']
+    ]
@@ -0,0 +1,161 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Persistent on-disk cache of per-job results. Entries are keyed by the content
+# of everything that can influence a job's output: the input clip, the frame
+# window, the encoder command and the binaries used to encode, decode and
+# measure it. First-pass statistics of two-pass encoders are cached next to
+# the results, keyed by the first pass alone.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import file_hashes
+
+CACHE_VERSION = 1
+
+
+def binary_fingerprint(binary):
+    # Digests are remembered per path and modification time, so binaries are
+    # only hashed again after they are rebuilt.
+    return file_hashes.sha1(binary)
+
+
+def normalize_command(command, job_temp_dir, clip):
+    # Temporary paths differ between runs. Replace them with stable
+    # placeholders so that identical jobs map to identical keys.
+    temp_path_pattern = re.compile(re.escape(job_temp_dir) + r"/[^\s=]*")
+    temp_paths = {}
+
+    def replace_temp_path(match):
+        path = match.group(0)
+        if path not in temp_paths:
+            temp_paths[path] = "$JOB_DIR/%d%s" % (len(temp_paths),
+                                                  os.path.splitext(path)[1])
+        return temp_paths[path]
+
+    normalized = []
+    for word in command:
+        for (key, placeholder) in [('yuv_window_file', '$YUV_WINDOW_FILE'),
+                                   ('yuv_file', '$YUV_FILE'),
+                                   ('y4m_file', '$Y4M_FILE')]:
+            if key in clip:
+                word = word.replace(clip[key], placeholder)
+        normalized.append(temp_path_pattern.sub(replace_temp_path, word))
+    return normalized
+
+
+def cache_key(clip, frame_offset, num_frames, command, job_temp_dir,
+              binaries, enable_vmaf, metrics_backend, chunks=None):
+    # `chunks` describes how chunked encodes split the window, the keys of
+    # monolithic encodes don't depend on it.
+    key = {
+        'version': CACHE_VERSION,
+        'input-file-sha1sum': clip['sha1sum'],
+        'frame-offset': frame_offset,
+        'num-frames': num_frames,
+        'command': normalize_command(command, job_temp_dir, clip),
+        'binaries': sorted(binary_fingerprint(binary) for binary in binaries),
+        'enable-vmaf': enable_vmaf,
+        'metrics-backend': metrics_backend,
+    }
+    if chunks is not None:
+        key['chunks'] = chunks
+    return hashlib.sha1(json.dumps(key,
+                                   sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def first_pass_key(clip, frame_offset, num_frames, first_pass,
+                   job_temp_dir):
+    # Key of the statistics of an encoder's first pass, which are shared by
+    # all jobs whose first pass is the same.
+    key = {
+        'version': CACHE_VERSION,
+        'input-file-sha1sum': clip['sha1sum'],
+        'frame-offset': frame_offset,
+        'num-frames': num_frames,
+        'first-pass': normalize_command(first_pass, job_temp_dir, clip),
+        'binary': binary_fingerprint(first_pass[0]),
+    }
+    return hashlib.sha1(json.dumps(key,
+                                   sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def entry_path(cache_dir, key, suffix='.json'):
+    return os.path.join(cache_dir, key[:2], key + suffix)
+
+
+def atomic_write(filename, write_func, mode='w'):
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    (fd, temp_filename) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_func(f)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def load_results(cache_dir, key, need_bitstreams=False):
+    try:
+        with open(entry_path(cache_dir, key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if need_bitstreams and (
+            len(entry['bitstreams']) != len(entry['results']) or not all(
+                os.path.isfile(entry_path(cache_dir, key, bitstream))
+                for bitstream in entry['bitstreams'])):
+        return None
+    return entry
+
+
+def store_results(cache_dir, key, results, output, encoded_files=None):
+    bitstreams = []
+    for (i, layer) in enumerate(encoded_files or []):
+        bitstream = "-%d%s" % (i, os.path.splitext(layer['filename'])[1])
+        with open(layer['filename'], 'rb') as encoded_file:
+            atomic_write(entry_path(cache_dir, key, bitstream),
+                         lambda f: shutil.copyfileobj(encoded_file, f),
+                         mode='wb')
+        bitstreams.append(bitstream)
+    entry = {'results': results, 'output': output, 'bitstreams': bitstreams}
+    atomic_write(entry_path(cache_dir, key), lambda f: json.dump(entry, f))
+
+
+def restore_bitstream(cache_dir, key, entry, index, destination):
+    shutil.copyfile(entry_path(cache_dir, key, entry['bitstreams'][index]),
+                    destination)
+
+
+def store_first_pass(cache_dir, key, stat_file):
+    with open(stat_file, 'rb') as stats:
+        atomic_write(entry_path(cache_dir, key, '.stat'),
+                     lambda f: shutil.copyfileobj(stats, f),
+                     mode='wb')
+
+
+def restore_first_pass(cache_dir, key, destination):
+    # Returns whether the statistics were cached.
+    try:
+        shutil.copyfile(entry_path(cache_dir, key, '.stat'), destination)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,93 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import file_hashes
+import result_cache
+
+
+@pytest.fixture
+def binary(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_hashes, 'hashes', {})
+    binary = tmp_path / 'encoder'
+    binary.write_bytes(b'v1')
+    return str(binary)
+
+
+def key(clip, binary, job_temp_dir, param='30', **kwargs):
+    command = [binary, '--qp=' + param, '-o', job_temp_dir + '/out.ivf']
+    return result_cache.cache_key(clip, 0, 10, command, job_temp_dir,
+                                  [binary], False, 'tiny_ssim', **kwargs)
+
+
+def test_key_ignores_temp_paths(binary):
+    clip = {'sha1sum': 'abc', 'yuv_file': '/tmp/run1/clip.yuv'}
+    other_run = {'sha1sum': 'abc', 'yuv_file': '/tmp/run2/clip.yuv'}
+    assert key(clip, binary, '/tmp/run1/job') == key(other_run, binary,
+                                                     '/tmp/run2/job')
+    assert result_cache.normalize_command(
+        [binary, '/tmp/run1/clip.yuv', '--o=/tmp/run1/job/a/out.ivf'],
+        '/tmp/run1/job', clip) == [binary, '$YUV_FILE', '--o=$JOB_DIR/0.ivf']
+
+
+def test_key_invalidation(binary, tmp_path):
+    clip = {'sha1sum': 'abc'}
+    job_temp_dir = str(tmp_path / 'job')
+    original = key(clip, binary, job_temp_dir)
+    assert key({'sha1sum': 'def'}, binary, job_temp_dir) != original
+    assert key(clip, binary, job_temp_dir, param='31') != original
+    assert key(clip, binary, job_temp_dir, chunks=['fixed', 2]) != original
+    with open(binary, 'wb') as f:
+        f.write(b'v2 rebuilt')
+    assert key(clip, binary, job_temp_dir) != original
+
+
+def test_store_and_load(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    encoded = tmp_path / 'out.ivf'
+    encoded.write_bytes(b'bitstream')
+    results = [{'avg-psnr': 40.0}]
+    assert result_cache.load_results(cache_dir, 'ab12') is None
+    result_cache.store_results(cache_dir, 'ab12', results, 'output',
+                               [{'filename': str(encoded)}])
+    entry = result_cache.load_results(cache_dir, 'ab12', need_bitstreams=True)
+    assert entry['results'] == results
+    restored = str(tmp_path / 'restored.ivf')
+    result_cache.restore_bitstream(cache_dir, 'ab12', entry, 0, restored)
+    with open(restored, 'rb') as f:
+        assert f.read() == b'bitstream'
+    # Entries stored without bitstreams can't restore encoded files.
+    result_cache.store_results(cache_dir, 'cd34', results, 'output')
+    assert result_cache.load_results(cache_dir, 'cd34')
+    assert result_cache.load_results(cache_dir, 'cd34',
+                                     need_bitstreams=True) is None
+
+
+def test_first_pass_key(binary, tmp_path):
+    clip = {'sha1sum': 'abc'}
+
+    def first_pass_key(job_temp_dir, frame_offset=0, param='30'):
+        first_pass = [
+            binary, '--pass=1', '--qp=' + param, '--stats',
+            job_temp_dir + '/first.stat'
+        ]
+        return result_cache.first_pass_key(clip, frame_offset, 10,
+                                           first_pass, job_temp_dir)
+
+    job_temp_dir = str(tmp_path / 'job')
+    key = first_pass_key(job_temp_dir)
+    assert key == first_pass_key(str(tmp_path / 'other-job'))
+    assert key != first_pass_key(job_temp_dir, param='31')
+    assert key != first_pass_key(job_temp_dir, frame_offset=5)
@@ -0,0 +1,85 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Reading and writing of result files produced by generate_data.py. Two formats
+# are supported: 'python', a single Python list literal of result dictionaries,
+# and 'jsonl', one JSON object per line.
+
+import ast
+import json
+import pprint
+
+OUTPUT_FORMATS = ['python', 'jsonl']
+
+pp = pprint.PrettyPrinter(indent=2)
+
+
+def output_format(filename, out_format=None):
+    if out_format:
+        return out_format
+    return 'jsonl' if filename.endswith('.jsonl') else 'python'
+
+
+def write_header(out_file, out_format):
+    if out_format == 'python':
+        out_file.write('[')
+
+
+def write_footer(out_file, out_format):
+    if out_format == 'python':
+        out_file.write(']\n')
+
+
+def write_result(out_file, result, out_format):
+    if out_format == 'jsonl':
+        out_file.write(json.dumps(result, sort_keys=True))
+        out_file.write('\n')
+    else:
+        out_file.write(pp.pformat(result))
+        out_file.write(',\n')
+
+
+def read_results(f):
+    # Yields result dictionaries one at a time. JSON Lines files are streamed,
+    # Python literals have to be parsed as a whole.
+    first_char = ''
+    while not first_char.strip():
+        first_char = f.read(1)
+        if not first_char:
+            return
+    if first_char == '[':
+        for result in ast.literal_eval(first_char + f.read()):
+            yield result
+        return
+    for line in lines_with_prefix(first_char, f):
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_results(text, out_format):
+    # Parses the results written in between two points of an output file,
+    # such as the results of a single job.
+    if out_format == 'python':
+        text = text.strip()
+        if text.startswith('['):
+            text = text[1:]
+        if text.endswith(']'):
+            text = text[:-1]
+        return ast.literal_eval('[' + text + ']')
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def lines_with_prefix(prefix, f):
+    yield prefix + f.readline()
+    yield from f
@@ -0,0 +1,91 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Scratch space of the jobs of a run. Commands of jobs are planned in a job
+# directory that is removed again right away, and only created for real when
+# the job is admitted to run. Job directories are deleted with everything
+# left in them when the job ends, whether it succeeded or failed. Jobs are
+# admitted while their estimated scratch needs fit in a budget. Small
+# intermediates can be kept apart, for instance on a tmpfs. Callers
+# synchronize admitting and releasing jobs.
+
+import itertools
+import os
+import shutil
+import tempfile
+
+# Encoded files are estimated at this fraction of the size of the raw frames.
+ENCODED_FRACTION = 0.1
+
+
+def estimate_bytes(raw_bytes, decoded_layers, copies=0):
+    # Scratch bytes of a job that encodes `raw_bytes` of frames, keeps
+    # `decoded_layers` decoded files of at most that size and writes `copies`
+    # other copies of the frames.
+    return int(raw_bytes * (decoded_layers + copies + ENCODED_FRACTION))
+
+
+class ScratchSpace(object):
+
+    def __init__(self, directory, budget_bytes=None, small_directory=None):
+        # `budget_bytes` of None admits all jobs. Small intermediates are
+        # placed next to large ones when `small_directory` is None.
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.small_directory = small_directory and tempfile.mkdtemp(
+            dir=small_directory)
+        self.reserved_bytes = 0
+        self.job_ids = itertools.count()
+
+    def plan_dir(self):
+        # Returns a new job directory to plan a job's commands in, which is
+        # removed by park() until the job is admitted.
+        job_dir = os.path.join(self.directory, 'job-%d' % next(self.job_ids))
+        os.mkdir(job_dir)
+        return job_dir
+
+    def park(self, job_dir):
+        shutil.rmtree(job_dir)
+
+    def available_bytes(self):
+        # Bytes that a job can be admitted with. A job that needs more than
+        # the whole budget runs when no other job holds scratch space.
+        if self.budget_bytes is None or not self.reserved_bytes:
+            return float('inf')
+        return self.budget_bytes - self.reserved_bytes
+
+    def admit(self, job_dir, need_bytes):
+        self.reserved_bytes += need_bytes
+        os.makedirs(job_dir, exist_ok=True)
+
+    def small_dir(self, job_dir):
+        # Directory for the small intermediates of a job.
+        if not self.small_directory:
+            return job_dir
+        small_dir = os.path.join(self.small_directory,
+                                 os.path.basename(job_dir))
+        os.makedirs(small_dir, exist_ok=True)
+        return small_dir
+
+    def release(self, job_dir, need_bytes):
+        self.reserved_bytes -= need_bytes
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if self.small_directory:
+            shutil.rmtree(os.path.join(self.small_directory,
+                                       os.path.basename(job_dir)),
+                          ignore_errors=True)
+
+    def cleanup(self):
+        if self.small_directory:
+            shutil.rmtree(self.small_directory, ignore_errors=True)
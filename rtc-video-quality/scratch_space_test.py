@@ -0,0 +1,72 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import scratch_space
+
+
+def test_estimate_bytes():
+    assert scratch_space.estimate_bytes(1000, 2) == 2100
+    assert scratch_space.estimate_bytes(1000, 1, copies=1) == 2100
+
+
+def test_budget_accounting(tmp_path):
+    scratch = scratch_space.ScratchSpace(str(tmp_path), budget_bytes=100)
+    assert scratch.available_bytes() == float('inf')
+    first = scratch.plan_dir()
+    second = scratch.plan_dir()
+    assert first != second
+    scratch.park(first)
+    scratch.park(second)
+    assert not os.path.exists(first)
+    scratch.admit(first, 60)
+    assert os.path.isdir(first)
+    assert scratch.available_bytes() == 40
+    scratch.admit(second, 40)
+    assert scratch.available_bytes() == 0
+    with open(os.path.join(first, 'decoded.yuv'), 'w') as f:
+        f.write('frames')
+    scratch.release(first, 60)
+    assert not os.path.exists(first)
+    assert scratch.available_bytes() == 60
+    scratch.release(second, 40)
+    # Jobs larger than the budget run alone.
+    assert scratch.available_bytes() == float('inf')
+
+
+def test_unlimited_budget(tmp_path):
+    scratch = scratch_space.ScratchSpace(str(tmp_path))
+    scratch.admit(scratch.plan_dir(), 10**12)
+    assert scratch.available_bytes() == float('inf')
+
+
+def test_small_intermediates(tmp_path):
+    (tmp_path / 'jobs').mkdir()
+    (tmp_path / 'tmpfs').mkdir()
+    scratch = scratch_space.ScratchSpace(str(tmp_path / 'jobs'),
+                                         small_directory=str(tmp_path /
+                                                             'tmpfs'))
+    job_dir = scratch.plan_dir()
+    small_dir = scratch.small_dir(job_dir)
+    assert os.path.isdir(small_dir)
+    assert small_dir.startswith(str(tmp_path / 'tmpfs'))
+    scratch.release(job_dir, 0)
+    assert not os.path.exists(small_dir)
+    scratch.cleanup()
+    assert os.listdir(str(tmp_path / 'tmpfs')) == []
+    # Without a small directory, intermediates stay in the job directory.
+    scratch = scratch_space.ScratchSpace(str(tmp_path / 'jobs'))
+    job_dir = scratch.plan_dir()
+    assert scratch.small_dir(job_dir) == job_dir
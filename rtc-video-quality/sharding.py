@@ -0,0 +1,89 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Partitioning of a job matrix into shards that are run separately (such as on
+# different machines) and merged afterwards. Jobs are assigned to shards by
+# estimated cost so that shards take about as long. The assignment only
+# depends on the command line and the clips, so every shard computes the same
+# partitioning on its own. Every shard writes a plan listing its jobs next to
+# its output, which is used to check for missing jobs when merging.
+
+import collections
+import hashlib
+import json
+import os
+
+
+def clip_name(clip):
+    # Machines may mount the clips at different paths, clips are identified
+    # by their file name.
+    return os.path.basename(clip['input_file'])
+
+
+def duplicate_clip_names(clips):
+    counts = collections.Counter(clip_name(clip) for clip in clips)
+    return sorted(name for (name, count) in counts.items() if count > 1)
+
+
+def job_key(clip, encoder, codec, layer_pattern, param):
+    # Identifies a job across shards and machines, independent of temporary
+    # paths and of where the clips are stored.
+    return "%s %s:%s %s %s" % (clip_name(clip), encoder, codec, layer_pattern,
+                               param)
+
+
+def assign_shards(weighted_keys, num_shards):
+    # Assigns (key, cost) pairs to shards 1..num_shards, most expensive first
+    # to the shard with the least cost so far. Ties are broken by key and
+    # shard index so that the assignment is deterministic. Returns a dict of
+    # shard index by key.
+    shard_costs = [(0.0, shard) for shard in range(1, num_shards + 1)]
+    shards = {}
+    for (key, cost) in sorted(weighted_keys,
+                              key=lambda entry: (-entry[1], entry[0])):
+        (shard_cost, shard) = min(shard_costs)
+        shard_costs[shard - 1] = (shard_cost + cost, shard)
+        shards[key] = shard
+    return shards
+
+
+def matrix_id(keys):
+    # Fingerprint of the whole job matrix, to detect merging shards of
+    # different runs.
+    sha1 = hashlib.sha1()
+    for key in sorted(keys):
+        sha1.update(key.encode('utf-8') + b'\n')
+    return sha1.hexdigest()
+
+
+def plan_filename(out_filename):
+    return out_filename + '.shard'
+
+
+def write_plan(filename, shard, num_shards, matrix, keys):
+    with open(filename, 'w') as f:
+        json.dump(
+            {
+                'shard': shard,
+                'num-shards': num_shards,
+                'matrix': matrix,
+                'jobs': sorted(keys),
+            },
+            f,
+            indent=2)
+
+
+def load_plan(filename):
+    with open(filename) as f:
+        return json.load(f)
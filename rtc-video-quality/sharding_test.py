@@ -0,0 +1,71 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import sharding
+
+
+def weighted_keys():
+    return [("clip%d.y4m aom-rt:av1 1sl1tl %d" % (clip, param),
+             float(clip % 3 + 1)) for clip in range(5)
+            for param in [35, 40, 45, 48]]
+
+
+def test_assign_shards_is_deterministic():
+    keys = weighted_keys()
+    expected = sharding.assign_shards(keys, 3)
+    for seed in range(5):
+        shuffled = list(keys)
+        random.Random(seed).shuffle(shuffled)
+        assert sharding.assign_shards(shuffled, 3) == expected
+
+
+def test_assign_shards_covers_and_balances():
+    keys = weighted_keys()
+    shards = sharding.assign_shards(keys, 3)
+    assert set(shards) == set(key for (key, _) in keys)
+    assert set(shards.values()) == {1, 2, 3}
+    costs = {}
+    for (key, cost) in keys:
+        costs[shards[key]] = costs.get(shards[key], 0.0) + cost
+    # Greedy assignment keeps shards within the most expensive job.
+    assert max(costs.values()) - min(costs.values()) <= max(
+        cost for (_, cost) in keys)
+
+
+def test_assign_shards_ties():
+    # Equal costs are assigned in key order.
+    shards = sharding.assign_shards([('b', 1.0), ('a', 1.0), ('c', 1.0)], 2)
+    assert shards == {'a': 1, 'b': 2, 'c': 1}
+
+
+def test_job_key_ignores_clip_directory():
+    keys = [
+        sharding.job_key({'input_file': path}, 'aom-rt', 'av1', '1sl1tl', 40)
+        for path in ['/mnt/a/clips/foo.y4m', 'clips/foo.y4m', 'foo.y4m']
+    ]
+    assert len(set(keys)) == 1
+    assert sharding.duplicate_clip_names([{
+        'input_file': 'a/foo.y4m'
+    }, {
+        'input_file': 'b/foo.y4m'
+    }, {
+        'input_file': 'b/bar.y4m'
+    }]) == ['foo.y4m']
+
+
+def test_matrix_id_ignores_order():
+    assert sharding.matrix_id(['a', 'b']) == sharding.matrix_id(['b', 'a'])
+    assert sharding.matrix_id(['a', 'b']) != sharding.matrix_id(['a', 'c'])
@@ -0,0 +1,186 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tracing and profiling of runs. Spans of work and of waiting are recorded per
+# thread and written in the Chrome trace event format, which can be viewed in
+# Perfetto (https://ui.perfetto.dev) or chrome://tracing. Python code can also
+# be profiled with cProfile in every thread.
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import time
+
+# Spans in this category are time spent waiting, not working.
+WAIT_CATEGORY = 'wait'
+
+enabled = False
+start_time = time.time()
+events = []
+thread_names = {}
+trace_lock = threading.Lock()
+depth = threading.local()
+
+profiling = False
+profiles = []
+
+
+def enable():
+    global enabled
+    global start_time
+    enabled = True
+    start_time = time.time()
+
+
+def add_span(name, category, span_start, span_end, args=None):
+    # Records a span that started and ended at the given time.time() values.
+    if not enabled:
+        return
+    thread = threading.current_thread()
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': (span_start - start_time) * 1000000,
+        'dur': (span_end - span_start) * 1000000,
+        'pid': os.getpid(),
+        'tid': thread.ident,
+        'args': args or {},
+        # Only spans that aren't part of another count towards utilization.
+        'top_level': getattr(depth, 'value', 0) == 0,
+    }
+    with trace_lock:
+        thread_names[thread.ident] = thread.name
+        events.append(event)
+
+
+@contextlib.contextmanager
+def span(name, category, args=None):
+    # Records the time spent in the block as a span. `args` are shown with the
+    # span and may be updated in the block (for instance with process IDs).
+    if not enabled:
+        yield args
+        return
+    span_start = time.time()
+    depth.value = getattr(depth, 'value', 0) + 1
+    try:
+        yield args
+    finally:
+        depth.value -= 1
+        add_span(name, category, span_start, time.time(), args)
+
+
+def save(filename):
+    with trace_lock:
+        trace_events = [{
+            key: value for (key, value) in event.items() if key != 'top_level'
+        } for event in events]
+        for (tid, name) in thread_names.items():
+            trace_events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {
+                    'name': name
+                },
+            })
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def pool_name(thread_name):
+    # Worker threads are named '<pool>-<index>' or '<pool>_<index>'.
+    return re.sub(r'[-_]\d+$', '', thread_name)
+
+
+def print_summary(num_slowest=10):
+    # Prints how busy every pool of workers was and the slowest spans that
+    # aren't part of another span.
+    elapsed = (time.time() - start_time) * 1000000
+    pools = {}
+    with trace_lock:
+        for event in events:
+            pool = pools.setdefault(pool_name(thread_names[event['tid']]), {
+                'threads': set(),
+                'busy': 0,
+                'waiting': 0
+            })
+            pool['threads'].add(event['tid'])
+            if not event['top_level']:
+                continue
+            if event['cat'] == WAIT_CATEGORY:
+                pool['waiting'] += event['dur']
+            else:
+                pool['busy'] += event['dur']
+        slowest = sorted([
+            event for event in events
+            if event['top_level'] and event['cat'] != WAIT_CATEGORY
+        ],
+            key=lambda event: event['dur'],
+            reverse=True)[:num_slowest]
+    print("Worker utilization:")
+    for (name, pool) in sorted(pools.items()):
+        available = elapsed * len(pool['threads'])
+        print("  %-10s %2d threads, %5.1f%% busy, %5.1f%% waiting" %
+              (name, len(pool['threads']), 100 * pool['busy'] / available,
+               100 * pool['waiting'] / available))
+    print("Slowest stages:")
+    for event in slowest:
+        print("  %8.1fs %-12s %s" % (event['dur'] / 1000000, event['name'],
+                                    event['args'].get('job', '')))
+
+
+def enable_profiling():
+    global profiling
+    profiling = True
+
+
+def profiled(func):
+    # Returns `func` wrapped to be profiled in the thread it runs in, as
+    # cProfile only profiles the thread that enabled it.
+    if not profiling:
+        return func
+
+    def profiled_func(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one profiler at a time, which then profiles
+            # all threads.
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with trace_lock:
+                profiles.append(profile)
+
+    return profiled_func
+
+
+def save_profile(filename):
+    # Writes the combined profile of all threads, to be read with pstats.
+    with trace_lock:
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+    stats.dump_stats(filename)
@@ -0,0 +1,93 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pstats
+import threading
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def trace(monkeypatch):
+    monkeypatch.setattr(tracing, 'enabled', False)
+    monkeypatch.setattr(tracing, 'events', [])
+    monkeypatch.setattr(tracing, 'thread_names', {})
+    monkeypatch.setattr(tracing, 'profiling', False)
+    monkeypatch.setattr(tracing, 'profiles', [])
+
+
+def test_disabled():
+    with tracing.span('encode', 'encode', {'job': 'a'}) as args:
+        assert args == {'job': 'a'}
+    tracing.add_span('wait for job', tracing.WAIT_CATEGORY, 0, 1)
+    assert tracing.events == []
+
+
+def test_nested_spans(tmp_path):
+    tracing.enable()
+    with tracing.span('encode', 'encode', {'job': 'a'}) as args:
+        with tracing.span('hash', 'prepare'):
+            pass
+        args['pid'] = 123
+    assert [(event['name'], event['top_level']) for event in tracing.events
+           ] == [('hash', False), ('encode', True)]
+    filename = str(tmp_path / 'trace.json')
+    tracing.save(filename)
+    with open(filename) as f:
+        trace = json.load(f)['traceEvents']
+    assert trace[1]['args'] == {'job': 'a', 'pid': 123}
+    assert 'top_level' not in trace[1]
+    assert trace[2] == {
+        'name': 'thread_name',
+        'ph': 'M',
+        'pid': trace[1]['pid'],
+        'tid': threading.get_ident(),
+        'args': {
+            'name': threading.current_thread().name
+        },
+    }
+
+
+def test_summary(capsys):
+    tracing.enable()
+    start = tracing.start_time
+
+    def worker():
+        tracing.add_span('wait for job', tracing.WAIT_CATEGORY, start,
+                         start + 1)
+        tracing.add_span('encode', 'encode', start + 1, start + 3,
+                         {'job': 'slow job'})
+
+    thread = threading.Thread(target=worker, name='encode-1')
+    thread.start()
+    thread.join()
+    tracing.print_summary()
+    output = capsys.readouterr().out
+    assert 'encode      1 threads' in output
+    assert '2.0s encode       slow job' in output
+    assert tracing.pool_name('ThreadPoolExecutor-0_3') == 'ThreadPoolExecutor-0'
+
+
+def test_profiled(tmp_path):
+    func = lambda: sum(range(1000))
+    assert tracing.profiled(func) is func
+    tracing.enable_profiling()
+    assert tracing.profiled(func)() == sum(range(1000))
+    filename = str(tmp_path / 'profile.out')
+    tracing.save_profile(filename)
+    if tracing.profiles:
+        assert pstats.Stats(filename).total_calls > 0
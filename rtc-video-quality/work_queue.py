@@ -0,0 +1,141 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Work queue shared by any number of worker processes, on one or more hosts,
+# through a SQLite database in a shared directory. Workers publish the jobs of
+# their clips, claim jobs one at a time and store the results of finished jobs
+# in the database. Workers heartbeat while they hold jobs and jobs of workers
+# that stop heartbeating are claimed again by others. Jobs are identified by
+# the same keys as shards (see sharding.py).
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUE_FILENAME = 'queue.sqlite3'
+# Workers update their heartbeat this often while holding jobs, and their
+# jobs are reclaimed when it is older than STALE_SECONDS. Heartbeats are
+# compared across hosts, which requires synchronized clocks.
+HEARTBEAT_SECONDS = 10
+STALE_SECONDS = 60
+# How often idle workers check for jobs that became claimable.
+POLL_SECONDS = 5
+# Seconds to wait for other workers to release the database.
+LOCK_TIMEOUT_SECONDS = 60
+
+# Job states.
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueueError(Exception):
+    pass
+
+
+def worker_id():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+
+    def __init__(self, directory, config=None):
+        # `config` describes the options that affect results and must be the
+        # same for all workers of a queue, it isn't checked if None.
+        self.worker = worker_id()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, QUEUE_FILENAME),
+                                  timeout=LOCK_TIMEOUT_SECONDS,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        with self.lock:
+            self.db.execute("CREATE TABLE IF NOT EXISTS config "
+                            "(name TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, "
+                "state TEXT, worker TEXT, heartbeat REAL, results TEXT, "
+                "error TEXT)")
+            if config is None:
+                return
+            config_json = json.dumps(config, sort_keys=True)
+            self.db.execute(
+                "INSERT OR IGNORE INTO config VALUES ('config', ?)",
+                (config_json,))
+            (queue_config,) = self.db.execute(
+                "SELECT value FROM config WHERE name = 'config'").fetchone()
+        if queue_config != config_json:
+            raise WorkQueueError(
+                "Options differ from the queue's: %s" % queue_config)
+
+    def publish(self, keys):
+        # Adds jobs that aren't in the queue yet.
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany(
+                "INSERT OR IGNORE INTO jobs (key, state) VALUES (?, ?)",
+                [(key, PENDING) for key in keys])
+            self.db.execute("COMMIT")
+
+    def states(self, keys):
+        with self.lock:
+            return dict(
+                self.db.execute(
+                    "SELECT key, state FROM jobs WHERE key IN (%s)" %
+                    ','.join('?' * len(keys)), list(keys)).fetchall())
+
+    def claim(self, key):
+        # Claims a pending job, or a running job whose worker went stale.
+        # Returns whether the job was claimed.
+        now = time.time()
+        with self.lock:
+            return self.db.execute(
+                "UPDATE jobs SET state = ?, worker = ?, heartbeat = ? "
+                "WHERE key = ? AND (state = ? OR "
+                "(state = ? AND heartbeat < ?))",
+                (RUNNING, self.worker, now, key, PENDING, RUNNING,
+                 now - STALE_SECONDS)).rowcount == 1
+
+    def heartbeat(self):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE worker = ? AND state = ?",
+                (time.time(), self.worker, RUNNING))
+
+    def finish(self, key, results, error):
+        # Stores the results (or error) of a claimed job. Returns False if the
+        # job was reclaimed by another worker in the meantime.
+        state = FAILED if results is None else DONE
+        with self.lock:
+            return self.db.execute(
+                "UPDATE jobs SET state = ?, results = ?, error = ? "
+                "WHERE key = ? AND worker = ? AND state = ?",
+                (state, json.dumps(results), error, key, self.worker,
+                 RUNNING)).rowcount == 1
+
+    def jobs(self):
+        # Returns (key, state, results, error) of all jobs, ordered by key.
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT key, state, results, error FROM jobs ORDER BY key"
+            ).fetchall()
+        return [(key, state, json.loads(results) if results else None, error)
+                for (key, state, results, error) in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+import work_queue
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two workers sharing a queue, as if they were separate processes.
+    queues = []
+    for worker in ['host-1', 'host-2']:
+        queue = work_queue.WorkQueue(str(tmp_path), {'encoders': 'aom-rt'})
+        queue.worker = worker
+        queues.append(queue)
+    yield queues
+    for queue in queues:
+        queue.close()
+
+
+def test_claim_once(workers):
+    (first, second) = workers
+    first.publish(['a', 'b'])
+    second.publish(['b', 'c'])
+    assert first.states(['a', 'b', 'c', 'd']) == {
+        'a': work_queue.PENDING,
+        'b': work_queue.PENDING,
+        'c': work_queue.PENDING
+    }
+    assert first.claim('b')
+    assert not second.claim('b')
+    assert second.claim('c')
+    assert first.finish('b', [{'avg-psnr': 40.0}], None)
+    assert second.finish('c', None, 'encoder crashed')
+    assert not first.claim('b')
+    assert first.jobs() == [
+        ('a', work_queue.PENDING, None, None),
+        ('b', work_queue.DONE, [{'avg-psnr': 40.0}], None),
+        ('c', work_queue.FAILED, None, 'encoder crashed'),
+    ]
+
+
+def test_stale_jobs_are_requeued(workers, monkeypatch):
+    (first, second) = workers
+    first.publish(['a'])
+    assert first.claim('a')
+    now = time.time()
+    # The first worker keeps heartbeating for a while, then stops.
+    monkeypatch.setattr(time, 'time',
+                        lambda: now + work_queue.STALE_SECONDS - 1)
+    first.heartbeat()
+    monkeypatch.setattr(time, 'time',
+                        lambda: now + 2 * work_queue.STALE_SECONDS - 2)
+    assert not second.claim('a')
+    monkeypatch.setattr(time, 'time',
+                        lambda: now + 2 * work_queue.STALE_SECONDS)
+    assert second.claim('a')
+    # The first worker's late results are dropped.
+    assert not first.finish('a', [{}], None)
+    assert second.finish('a', [{'avg-psnr': 41.0}], None)
+    assert second.jobs()[0][2] == [{'avg-psnr': 41.0}]
+
+
+def test_config_mismatch(tmp_path, workers):
+    with pytest.raises(work_queue.WorkQueueError):
+        work_queue.WorkQueue(str(tmp_path), {'encoders': 'svt-rt'})
+    # Such as merge_results.py, which only reads results.
+    work_queue.WorkQueue(str(tmp_path)).close()
@@ -0,0 +1,145 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Native reading and writing of YUV4MPEG2 (.y4m) files. A .y4m file is a header
+# line followed by frames, each of which is a 'FRAME' line followed by raw
+# planar frame data. Frames are located through an index of their data offsets
+# so that windows of frames can be read without converting the whole file.
+
+import os
+
+import yuv_reader
+
+SIGNATURE = b'YUV4MPEG2'
+FRAME_SIGNATURE = b'FRAME'
+# Header lines are short, this only bounds reading a corrupt file.
+MAX_LINE_LENGTH = 4096
+
+# 8-bit 4:2:0 color spaces, which only differ in chroma siting.
+I420_COLORSPACES = ['420', '420jpeg', '420paldv', '420mpeg2']
+# Other 8-bit color spaces, by their yuv_reader pixel format.
+COLORSPACE_PIXEL_FORMATS = {'422': 'yuv422p', '444': 'yuv444p'}
+
+
+class Y4mError(ValueError):
+    pass
+
+
+def read_line(f):
+    line = f.readline(MAX_LINE_LENGTH)
+    if line and not line.endswith(b'\n'):
+        raise Y4mError("Line too long or truncated: %r" % line[:80])
+    return line
+
+
+def parse_header(f):
+    # Returns the header parameters of an open .y4m file, keyed by their tag
+    # letter, with 'W', 'H' and 'F' parsed into numbers.
+    line = read_line(f)
+    fields = line.split()
+    if not fields or fields[0] != SIGNATURE:
+        raise Y4mError("Missing %s signature." % SIGNATURE.decode())
+    header = {'line': line, 'length': len(line), 'C': '420jpeg'}
+    for field in fields[1:]:
+        field = field.decode('ascii')
+        header[field[0]] = field[1:]
+    try:
+        header['W'] = int(header['W'])
+        header['H'] = int(header['H'])
+        (numerator, denominator) = header['F'].split(':')
+        header['F'] = float(numerator) / float(denominator)
+    except (KeyError, ValueError, ZeroDivisionError):
+        raise Y4mError("Invalid or missing frame size or rate: %r" % line)
+    return header
+
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        return parse_header(f)
+
+
+def is_i420(header):
+    return header['C'] in I420_COLORSPACES
+
+
+def pixel_format(header):
+    # Returns the yuv_reader pixel format of the frames, or None for color
+    # spaces that aren't read natively (such as high bit depths).
+    if is_i420(header):
+        return 'yuv420p'
+    return COLORSPACE_PIXEL_FORMATS.get(header['C'])
+
+
+def frame_index(filename, header):
+    # Returns the byte offsets of the data of all complete frames.
+    size = yuv_reader.frame_size(header['W'], header['H'], pixel_format(header))
+    file_size = os.path.getsize(filename)
+    offsets = []
+    with open(filename, 'rb') as f:
+        position = header['length']
+        while True:
+            f.seek(position)
+            line = read_line(f)
+            if not line:
+                break
+            if not line.startswith(FRAME_SIGNATURE):
+                raise Y4mError("Missing %s marker at byte %d." %
+                               (FRAME_SIGNATURE.decode(), position))
+            offset = position + len(line)
+            if offset + size > file_size:
+                break
+            offsets.append(offset)
+            position = offset + size
+    return offsets
+
+
+def count_frames(filename, header):
+    # Returns the number of complete frames, or None if the pixel format isn't
+    # known. Files where every frame has a bare 'FRAME' marker (as written by
+    # most tools) are counted from their size, other files are indexed.
+    pix_fmt = pixel_format(header)
+    if not pix_fmt:
+        return None
+    marker = FRAME_SIGNATURE + b'\n'
+    stride = len(marker) + yuv_reader.frame_size(header['W'], header['H'],
+                                                 pix_fmt)
+    num_frames = (os.path.getsize(filename) - header['length']) // stride
+    if num_frames == 0:
+        return 0
+    with open(filename, 'rb') as f:
+        for position in [0, (num_frames - 1) * stride]:
+            f.seek(header['length'] + position)
+            if f.read(len(marker)) != marker:
+                return len(frame_index(filename, header))
+    return num_frames
+
+
+def write_y4m(out_filename, header_line, filename, offsets, size):
+    # Writes the frames at `offsets` of `filename` as a .y4m file.
+    with yuv_reader.FrameWindow(filename, offsets, size) as window:
+        with open(out_filename, 'wb') as out_file:
+            out_file.write(header_line)
+            for i in range(len(offsets)):
+                out_file.write(FRAME_SIGNATURE + b'\n')
+                remaining = size
+                while remaining:
+                    data = window.read(remaining)
+                    out_file.write(data)
+                    remaining -= len(data)
+
+
+def i420_header_line(width, height, fps):
+    # Matches the header ffmpeg writes for yuv420p input.
+    return b'%s W%d H%d F%d:1 Ip A0:0 C420jpeg XYSCSS=420JPEG\n' % (
+        SIGNATURE, width, height, fps)
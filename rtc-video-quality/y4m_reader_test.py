@@ -0,0 +1,106 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import pytest
+
+import y4m_reader
+import yuv_reader
+
+
+def write_y4m(path, header, frames, frame_lines=None):
+    # Writes frames of bytes, each after its own 'FRAME...' line.
+    with open(path, 'wb') as f:
+        f.write(header)
+        for (i, frame) in enumerate(frames):
+            f.write(frame_lines[i] if frame_lines else b'FRAME\n')
+            f.write(frame)
+    return str(path)
+
+
+def test_parse_header():
+    header = y4m_reader.parse_header(
+        io.BytesIO(b'YUV4MPEG2 W17 H9 F30000:1001 Ip A1:1\nFRAME\n'))
+    assert header['W'] == 17
+    assert header['H'] == 9
+    assert header['F'] == pytest.approx(29.97, abs=0.001)
+    assert header['I'] == 'p'
+    # The color space defaults to 4:2:0.
+    assert header['C'] == '420jpeg'
+    assert header['length'] == len(b'YUV4MPEG2 W17 H9 F30000:1001 Ip A1:1\n')
+    assert y4m_reader.pixel_format(header) == 'yuv420p'
+
+
+def test_parse_header_color_spaces():
+    for (colorspace, pix_fmt) in [(b'420mpeg2', 'yuv420p'),
+                                  (b'444', 'yuv444p'), (b'420p10', None)]:
+        header = y4m_reader.parse_header(
+            io.BytesIO(b'YUV4MPEG2 W2 H2 F25:1 C%s\n' % colorspace))
+        assert y4m_reader.pixel_format(header) == pix_fmt
+
+
+@pytest.mark.parametrize('line', [
+    b'YUV4MPEG W2 H2 F25:1\n',
+    b'YUV4MPEG2 W2 F25:1\n',
+    b'YUV4MPEG2 W2 H2 F25:0\n',
+    b'YUV4MPEG2 W2 H2\n',
+    b'YUV4MPEG2 W2 H2 F25:1',
+    b'',
+])
+def test_parse_header_errors(line):
+    with pytest.raises(y4m_reader.Y4mError):
+        y4m_reader.parse_header(io.BytesIO(line))
+
+
+def test_frame_index(tmp_path):
+    size = yuv_reader.frame_size(5, 3)
+    header = b'YUV4MPEG2 W5 H3 F30:1\n'
+    frames = [bytes([i]) * size for i in range(3)]
+    # Frame lines may carry parameters of their own.
+    frame_lines = [b'FRAME\n', b'FRAME Ixyz\n', b'FRAME\n']
+    filename = write_y4m(tmp_path / 'clip.y4m', header, frames, frame_lines)
+    # A truncated last frame isn't indexed.
+    with open(filename, 'ab') as f:
+        f.write(b'FRAME\n' + b'\x03' * (size - 1))
+    parsed = y4m_reader.read_header(filename)
+    offsets = y4m_reader.frame_index(filename, parsed)
+    expected = []
+    position = len(header)
+    for line in frame_lines:
+        expected.append(position + len(line))
+        position += len(line) + size
+    assert offsets == expected
+    with open(filename, 'rb') as f:
+        for (i, offset) in enumerate(offsets):
+            f.seek(offset)
+            assert f.read(size) == frames[i]
+    assert y4m_reader.count_frames(filename, parsed) == 3
+
+
+def test_frame_index_missing_marker(tmp_path):
+    size = yuv_reader.frame_size(2, 2)
+    filename = write_y4m(tmp_path / 'clip.y4m', b'YUV4MPEG2 W2 H2 F30:1\n',
+                         [b'\0' * size, b'\0' * size],
+                         [b'FRAME\n', b'FRAMX\n'])
+    with pytest.raises(y4m_reader.Y4mError):
+        y4m_reader.frame_index(filename, y4m_reader.read_header(filename))
+
+
+def test_count_frames_from_size(tmp_path):
+    size = yuv_reader.frame_size(3, 3)
+    filename = write_y4m(tmp_path / 'clip.y4m', b'YUV4MPEG2 W3 H3 F30:1\n',
+                         [b'\1' * size] * 4)
+    assert y4m_reader.count_frames(filename,
+                                   y4m_reader.read_header(filename)) == 4
@@ -0,0 +1,163 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# In-process PSNR and SSIM computation for I420 files, computing the same
+# metrics as libvpx's tools/tiny_ssim. Frames are processed in batches with
+# the per-window statistics of a batch computed at once.
+
+import math
+
+import numpy as np
+
+from yuv_reader import plane_sizes, read_frame_batches
+
+MAX_PSNR = 100.0
+PEAK = 255.0
+
+# SSIM constants from tiny_ssim, (0.01 * 255)^2 and (0.03 * 255)^2 scaled by
+# 64^2 for 8x8 windows.
+SSIM_C1 = 26634
+SSIM_C2 = 239708
+
+# Number of luma pixels processed at once, bounds memory use for large frames.
+BATCH_PIXELS = 1 << 23
+
+
+def batch_frames(width, height):
+    return max(1, BATCH_PIXELS // (width * height))
+
+
+def split_planes(frames, width, height):
+    planes = []
+    offset = 0
+    for (w, h) in plane_sizes(width, height):
+        planes.append(frames[:, offset:offset + w * h].reshape(-1, h, w))
+        offset += w * h
+    return planes
+
+
+def mse_to_psnr(samples, sse):
+    # Mirrors tiny_ssim, which computes PSNR from the total squared error.
+    if sse <= 0:
+        return MAX_PSNR
+    return min(10.0 * math.log10(PEAK * PEAK * samples / sse), MAX_PSNR)
+
+
+def plane_sse(source, decoded):
+    diff = source.astype(np.int32) - decoded.astype(np.int32)
+    return (diff * diff).reshape(len(diff), -1).sum(axis=1, dtype=np.int64)
+
+
+def window_sums(values):
+    # Sums over 8x8 windows starting at every 4th pixel in both directions, by
+    # summing 4x4 blocks and then adding up 2x2 neighboring blocks.
+    (n, h, w) = values.shape
+    blocks = values[:, :h // 4 * 4, :w // 4 * 4].reshape(
+        n, h // 4, 4, w // 4, 4).sum(axis=(2, 4), dtype=np.int64)
+    return (blocks[:, :-1, :-1] + blocks[:, 1:, :-1] + blocks[:, :-1, 1:] +
+            blocks[:, 1:, 1:])
+
+
+def plane_ssim(source, decoded):
+    # Average SSIM over overlapping 8x8 windows for each frame in a batch.
+    # Per-pixel products fit in 32 bits, window sums are 64-bit.
+    s = source.astype(np.int32)
+    r = decoded.astype(np.int32)
+    sum_s = window_sums(s)
+    sum_r = window_sums(r)
+    sum_sq_s = window_sums(s * s)
+    sum_sq_r = window_sums(r * r)
+    sum_sxr = window_sums(s * r)
+    count = 64
+    ssim_n = (2 * sum_s * sum_r + SSIM_C1) * (2 * count * sum_sxr -
+                                               2 * sum_s * sum_r + SSIM_C2)
+    ssim_d = (sum_s * sum_s + sum_r * sum_r + SSIM_C1) * (
+        count * sum_sq_s - sum_s * sum_s + count * sum_sq_r - sum_r * sum_r +
+        SSIM_C2)
+    ssim = ssim_n / ssim_d.astype(np.float64)
+    return ssim.reshape(len(ssim), -1).mean(axis=1)
+
+
+def compute_metrics(source_file,
+                    decoded_file,
+                    width,
+                    height,
+                    temporal_skip=0,
+                    source_offsets=None):
+    # Compares `decoded_file` to the frames of `source_file` at the byte
+    # offsets `source_offsets` (all frames of a raw file by default). Returns a
+    # summary keyed like tiny_ssim output ('AvgPSNR', 'SSIM-Y', 'Nframes', ...)
+    # and per-frame values keyed like tiny_ssim's framestats columns ('psnr',
+    # 'ssim-y', ...).
+    samples = [w * h for (w, h) in plane_sizes(width, height)]
+    frame_stats = {
+        key: [] for key in [
+            'ssim', 'ssim-y', 'ssim-u', 'ssim-v', 'psnr', 'psnr-y', 'psnr-u',
+            'psnr-v'
+        ]
+    }
+    total_sse = [0, 0, 0]
+    batch_size = batch_frames(width, height)
+    source_batches = read_frame_batches(source_file,
+                                        width,
+                                        height,
+                                        source_offsets,
+                                        skip=temporal_skip,
+                                        batch_size=batch_size)
+    for decoded_frames in read_frame_batches(decoded_file,
+                                             width,
+                                             height,
+                                             batch_size=batch_size):
+        source_frames = next(source_batches, None)
+        if source_frames is None:
+            break
+        num_frames = min(len(source_frames), len(decoded_frames))
+        source_planes = split_planes(source_frames[:num_frames], width, height)
+        decoded_planes = split_planes(decoded_frames[:num_frames], width,
+                                      height)
+        sse = [plane_sse(s, d) for (s, d) in zip(source_planes, decoded_planes)]
+        ssim = [
+            plane_ssim(s, d) for (s, d) in zip(source_planes, decoded_planes)
+        ]
+        for i in range(num_frames):
+            frame_sse = [int(plane[i]) for plane in sse]
+            for (plane, name) in enumerate(['y', 'u', 'v']):
+                frame_stats['psnr-' + name].append(
+                    mse_to_psnr(samples[plane], frame_sse[plane]))
+                frame_stats['ssim-' + name].append(float(ssim[plane][i]))
+                total_sse[plane] += frame_sse[plane]
+            frame_stats['psnr'].append(
+                mse_to_psnr(sum(samples), sum(frame_sse)))
+            frame_stats['ssim'].append(0.8 * frame_stats['ssim-y'][-1] + 0.1 *
+                                       (frame_stats['ssim-u'][-1] +
+                                        frame_stats['ssim-v'][-1]))
+        if num_frames < len(decoded_frames):
+            break
+
+    num_frames = len(frame_stats['psnr'])
+    summary = {'Nframes': num_frames}
+    if num_frames == 0:
+        return (summary, frame_stats)
+    mean = lambda values: sum(values) / len(values)
+    summary['AvgPSNR'] = mean(frame_stats['psnr'])
+    summary['GlbPSNR'] = mse_to_psnr(
+        sum(samples) * num_frames, sum(total_sse))
+    summary['SSIM'] = mean(frame_stats['ssim'])
+    for (plane, name) in enumerate(['Y', 'U', 'V']):
+        summary['AvgPSNR-' + name] = mean(frame_stats['psnr-' + name.lower()])
+        summary['GlbPSNR-' + name] = mse_to_psnr(samples[plane] * num_frames,
+                                                 total_sse[plane])
+        summary['SSIM-' + name] = mean(frame_stats['ssim-' + name.lower()])
+    summary['VpxSSIM'] = 100 * math.pow(summary['SSIM'], 8.0)
+    return (summary, frame_stats)
@@ -0,0 +1,153 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the NumPy metrics backend to a straight port of the loops of
+# libvpx's tools/tiny_ssim.c on frames with odd sizes. benchmark_metrics.py
+# compares it to a built tiny_ssim binary.
+
+import math
+
+import numpy as np
+import pytest
+
+import yuv_metrics
+
+
+def tiny_ssim_8x8(s, r, x, y):
+    # ssim_8x8() and similarity() of tiny_ssim.c for 8-bit input.
+    sum_s = sum_r = sum_sq_s = sum_sq_r = sum_sxr = 0
+    for i in range(y, y + 8):
+        for j in range(x, x + 8):
+            sum_s += s[i][j]
+            sum_r += r[i][j]
+            sum_sq_s += s[i][j] * s[i][j]
+            sum_sq_r += r[i][j] * r[i][j]
+            sum_sxr += s[i][j] * r[i][j]
+    count = 64
+    c1 = (26634 * count * count) >> 12
+    c2 = (239708 * count * count) >> 12
+    ssim_n = (2 * sum_s * sum_r + c1) * (2 * count * sum_sxr -
+                                         2 * sum_s * sum_r + c2)
+    ssim_d = (sum_s * sum_s + sum_r * sum_r + c1) * (
+        count * sum_sq_s - sum_s * sum_s + count * sum_sq_r - sum_r * sum_r +
+        c2)
+    return ssim_n * 1.0 / ssim_d
+
+
+def tiny_ssim_plane(s, r, width, height):
+    # ssim2() of tiny_ssim.c: 8x8 windows at every 4th pixel.
+    total = 0.0
+    samples = 0
+    for y in range(0, height - 7, 4):
+        for x in range(0, width - 7, 4):
+            total += tiny_ssim_8x8(s, r, x, y)
+            samples += 1
+    return total / samples
+
+
+def tiny_ssim_psnr(samples, sse):
+    if sse <= 0:
+        return 100.0
+    return min(10.0 * math.log10(255.0 * 255.0 * samples / sse), 100.0)
+
+
+def reference_frame_stats(source, decoded, width, height):
+    # Per-frame stats of one frame pair, given as flat lists of I420 bytes.
+    stats = {}
+    sse = []
+    offset = 0
+    uv_width = (width + 1) // 2
+    uv_height = (height + 1) // 2
+    for (name, w, h) in [('y', width, height), ('u', uv_width, uv_height),
+                         ('v', uv_width, uv_height)]:
+        s = [source[offset + i * w:offset + (i + 1) * w] for i in range(h)]
+        r = [decoded[offset + i * w:offset + (i + 1) * w] for i in range(h)]
+        offset += w * h
+        plane_sse = sum((a - b) * (a - b)
+                        for (row_s, row_r) in zip(s, r)
+                        for (a, b) in zip(row_s, row_r))
+        sse.append(plane_sse)
+        stats['psnr-' + name] = tiny_ssim_psnr(w * h, plane_sse)
+        stats['ssim-' + name] = tiny_ssim_plane(s, r, w, h)
+    stats['psnr'] = tiny_ssim_psnr(width * height + 2 * uv_width * uv_height,
+                                   sum(sse))
+    stats['ssim'] = 0.8 * stats['ssim-y'] + 0.1 * (stats['ssim-u'] +
+                                                    stats['ssim-v'])
+    return stats
+
+
+def write_clips(tmp_path, width, height, num_frames, seed=0):
+    # Writes a random source clip and a noisy copy of it as decoded clip.
+    rng = np.random.RandomState(seed)
+    size = width * height + 2 * ((width + 1) // 2) * ((height + 1) // 2)
+    source = rng.randint(0, 256, size=(num_frames, size)).astype(np.uint8)
+    noise = rng.randint(-12, 13, size=source.shape)
+    decoded = np.clip(source.astype(np.int32) + noise, 0, 255).astype(np.uint8)
+    # One frame is left untouched to cover the PSNR cap.
+    decoded[0] = source[0]
+    source_file = str(tmp_path / 'source.yuv')
+    decoded_file = str(tmp_path / 'decoded.yuv')
+    source.tofile(source_file)
+    decoded.tofile(decoded_file)
+    return (source, decoded, source_file, decoded_file)
+
+
+# Chroma planes need at least one 8x8 window, like in tiny_ssim.
+@pytest.mark.parametrize('width,height', [(17, 15), (19, 21), (16, 16),
+                                          (33, 17)])
+def test_matches_tiny_ssim_loops(tmp_path, width, height):
+    num_frames = 3
+    (source, decoded, source_file, decoded_file) = write_clips(
+        tmp_path, width, height, num_frames)
+    (summary, frame_stats) = yuv_metrics.compute_metrics(
+        source_file, decoded_file, width, height)
+    assert summary['Nframes'] == num_frames
+    for i in range(num_frames):
+        expected = reference_frame_stats(source[i].tolist(),
+                                         decoded[i].tolist(), width, height)
+        for (key, value) in expected.items():
+            assert frame_stats[key][i] == pytest.approx(value, abs=1e-9), key
+    assert frame_stats['psnr'][0] == yuv_metrics.MAX_PSNR
+    assert summary['AvgPSNR'] == pytest.approx(
+        sum(frame_stats['psnr']) / num_frames)
+    assert summary['VpxSSIM'] == pytest.approx(100 * summary['SSIM']**8)
+
+
+def test_small_batches_match_one_batch(tmp_path, monkeypatch):
+    (_, _, source_file, decoded_file) = write_clips(tmp_path, 17, 15, 5)
+    expected = yuv_metrics.compute_metrics(source_file, decoded_file, 17, 15)
+    monkeypatch.setattr(yuv_metrics, 'BATCH_PIXELS', 17 * 15 * 2)
+    assert yuv_metrics.compute_metrics(source_file, decoded_file, 17,
+                                       15) == expected
+
+
+def test_temporal_skip_and_short_decode(tmp_path):
+    width = 16
+    height = 16
+    (source, decoded, source_file, decoded_file) = write_clips(
+        tmp_path, width, height, 4)
+    # A decoded clip with two frames is compared to every other source frame.
+    decoded[[0, 2]].tofile(decoded_file)
+    (summary, frame_stats) = yuv_metrics.compute_metrics(source_file,
+                                                         decoded_file,
+                                                         width,
+                                                         height,
+                                                         temporal_skip=1)
+    assert summary['Nframes'] == 2
+    for (i, j) in [(0, 0), (1, 2)]:
+        expected = reference_frame_stats(source[j].tolist(),
+                                         decoded[j].tolist(), width, height)
+        assert frame_stats['psnr'][i] == pytest.approx(expected['psnr'])
+        assert frame_stats['ssim'][i] == pytest.approx(expected['ssim'])
+
@@ -0,0 +1,180 @@
+# Copyright 2020 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Frame-accurate access to raw planar YUV frames, in raw files or at known
+# offsets in other files (such as .y4m). A frame window (a range of frames of a
+# clip) is exposed through memory maps instead of being copied to a file of its
+# own.
+
+import mmap
+import os
+import shutil
+import stat
+
+import numpy as np
+
+# Chroma subsampling factors (horizontal, vertical) per pixel format.
+PIXEL_FORMATS = {
+    'yuv420p': (2, 2),
+    'yuv422p': (2, 1),
+    'yuv444p': (1, 1),
+}
+
+BLOCKSIZE = 1024 * 1024
+
+
+def plane_sizes(width, height, pix_fmt='yuv420p'):
+    (sub_x, sub_y) = PIXEL_FORMATS[pix_fmt]
+    chroma_width = (width + sub_x - 1) // sub_x
+    chroma_height = (height + sub_y - 1) // sub_y
+    return [(width, height), (chroma_width, chroma_height),
+            (chroma_width, chroma_height)]
+
+
+def frame_size(width, height, pix_fmt='yuv420p'):
+    return sum(w * h for (w, h) in plane_sizes(width, height, pix_fmt))
+
+
+def count_frames(filename, width, height, pix_fmt='yuv420p'):
+    return os.path.getsize(filename) // frame_size(width, height, pix_fmt)
+
+
+def frame_window(total_frames, frame_offset, num_frames):
+    # Returns (start, count) for `num_frames` frames starting at
+    # `frame_offset`, clamped to the clip. A non-positive `num_frames` selects
+    # all frames from the offset to the end of the clip.
+    start = min(max(frame_offset, 0), total_frames)
+    count = total_frames - start
+    if num_frames > 0:
+        count = min(count, num_frames)
+    return (start, count)
+
+
+def map_frames(filename, width, height, start=0, count=None,
+               pix_fmt='yuv420p'):
+    # Returns a read-only array of shape (count, frame size) backed by the file.
+    size = frame_size(width, height, pix_fmt)
+    if count is None:
+        count = count_frames(filename, width, height, pix_fmt) - start
+    if count <= 0:
+        return np.zeros((0, size), dtype=np.uint8)
+    return np.memmap(filename,
+                     dtype=np.uint8,
+                     mode='r',
+                     offset=start * size,
+                     shape=(count, size))
+
+
+def frame_offsets(width, height, start, count, pix_fmt='yuv420p'):
+    # Byte offsets of the frames [start, start + count) of a raw file.
+    size = frame_size(width, height, pix_fmt)
+    return [(start + i) * size for i in range(count)]
+
+
+def read_frame_batches(filename,
+                       width,
+                       height,
+                       offsets=None,
+                       skip=0,
+                       batch_size=1,
+                       pix_fmt='yuv420p'):
+    # Yields arrays of shape (frames, frame size) with up to `batch_size`
+    # frames each. `offsets` are the byte offsets of the frames to read, all
+    # frames of a raw file are read by default. Every frame read is followed by
+    # `skip` frames that are dropped. Regular files are memory-mapped, other
+    # files (such as FIFOs) are read sequentially as raw files.
+    size = frame_size(width, height, pix_fmt)
+    if stat.S_ISREG(os.stat(filename).st_mode):
+        if offsets is None:
+            frames = map_frames(filename, width, height, pix_fmt=pix_fmt)
+            for batch_start in range(0, len(frames), (skip + 1) * batch_size):
+                yield np.asarray(frames[batch_start:batch_start +
+                                        (skip + 1) * batch_size:skip + 1])
+            return
+        offsets = offsets[::skip + 1]
+        if not offsets:
+            return
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+        for batch_start in range(0, len(offsets), batch_size):
+            yield np.stack([
+                data[offset:offset + size]
+                for offset in offsets[batch_start:batch_start + batch_size]
+            ])
+        return
+    assert offsets is None
+    with open(filename, 'rb') as f:
+        batch = []
+        index = 0
+        while True:
+            data = f.read(size)
+            if len(data) < size:
+                break
+            if index % (skip + 1) == 0:
+                batch.append(np.frombuffer(data, dtype=np.uint8))
+            index += 1
+            if len(batch) == batch_size:
+                yield np.stack(batch)
+                batch = []
+        if batch:
+            yield np.stack(batch)
+
+
+class FrameWindow(object):
+    # Read-only file object over the frames of a file at the given byte
+    # offsets, for feeding a frame window to pipes.
+
+    def __init__(self, filename, offsets, size):
+        self.offsets = offsets
+        self.size = size
+        self.frame = 0
+        self.position = 0
+        self.file = open(filename, 'rb')
+        self.map = None
+        if offsets:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, size=-1):
+        # Reads at most up to the end of the current frame.
+        if self.frame >= len(self.offsets):
+            return b''
+        if size < 0 or size > self.size - self.position:
+            size = self.size - self.position
+        start = self.offsets[self.frame] + self.position
+        data = self.map[start:start + size]
+        if len(data) < size:
+            raise EOFError("Frame %d is truncated." % self.frame)
+        self.position += size
+        if self.position == self.size:
+            self.frame += 1
+            self.position = 0
+        return data
+
+    def close(self):
+        if self.map:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def copy_frames(filename, out_filename, offsets, size):
+    # Writes the frames at `offsets` to a raw file of their own, for readers
+    # that can't read a frame window any other way.
+    with FrameWindow(filename, offsets, size) as window:
+        with open(out_filename, 'wb') as out_file:
+            shutil.copyfileobj(window, out_file, BLOCKSIZE)